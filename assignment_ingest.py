@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Streaming, validating ingestion of block assignment files.
+
+The assignment CSV is read in record batches with the pyarrow CSV reader and
+checked in one pass against the canonical block order of the block layer
+(see block_order.py):
+
+- malformed GEOIDs (not 15 digits) and non-integer districts
+- duplicate GEOIDs (the first assignment wins)
+- GEOIDs that are not in the block layer (blocks of other states in a
+  national file are counted separately and skipped)
+- blocks of the layer left without a district
+
+The result is an int8 district array aligned to the block order, so memory is
+bounded by the block layer, not by the size of the input file. With
+``max_errors`` the read stops as soon as too many problems were seen.
+
+Census block assignment files (``BLOCKID|DISTRICT``, e.g.
+BlockAssign_ST24_MD_CD.txt) are read as well; their ``ZZ`` district (block in
+no district) is left unassigned.
+"""
+import argparse
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+from block_order import NO_BLOCK, NO_DISTRICT, PLAN_DTYPE, load_block_order
+
+MAX_DISTRICT = np.iinfo(PLAN_DTYPE).max
+
+BLOCK_SIZE = 1 << 22  # bytes per CSV batch
+SAMPLE_SIZE = 10
+
+GEOID_PATTERN = r'^\d{15}$'
+
+# District code of Census block assignment files for blocks in no district
+NO_DISTRICT_CODE = 'ZZ'
+
+
+class AssignmentError(ValueError):
+    """The assignment file failed validation."""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+class Assignment:
+    """District of every block position, with the validation report of the file it came from."""
+
+    def __init__(self, order, plan, report):
+        self.order = order
+        self.plan = plan
+        self.report = report
+
+    def frame(self):
+        """Assigned blocks as a GEOID20/District DataFrame, in block order."""
+        return self.order.plan_to_frame(self.plan)
+
+
+def _new_report():
+    return {
+        'rows': 0, 'malformed': 0, 'bad_district': 0, 'duplicates': 0,
+        'unknown': 0, 'other_state': 0, 'unassigned': 0,
+        'samples': {'malformed': [], 'bad_district': [], 'duplicates': [], 'unknown': [], 'unassigned': []},
+    }
+
+
+def _sample(report, kind, values):
+    room = SAMPLE_SIZE - len(report['samples'][kind])
+    if room > 0:
+        report['samples'][kind].extend(str(v) for v in values[:room])
+
+
+def _errors(report, allow_unassigned):
+    count = report['malformed'] + report['bad_district'] + report['duplicates'] + report['unknown']
+    return count + (0 if allow_unassigned else report['unassigned'])
+
+
+def _layout(path, geoid_col, district_col):
+    """Delimiter and column names of ``path``; block assignment files use their first two columns."""
+    # utf-8-sig drops the byte order mark Excel writes, which pyarrow skips as well
+    with open(path, encoding='utf-8-sig') as f:
+        header = f.readline().strip()
+    delimiter = '|' if '|' in header else ','
+    names = header.split(delimiter)
+    if geoid_col not in names and len(names) >= 2:
+        geoid_col, district_col = names[0], names[1]
+    return delimiter, geoid_col, district_col
+
+
+def ingest_assignment(path, order, geoid_col='GEOID20', district_col='District',
+                      max_errors=None, allow_unassigned=True, block_size=BLOCK_SIZE):
+    """
+    Stream ``path`` into an ``Assignment`` aligned to ``order`` (a ``BlockOrder``).
+
+    Raises ``AssignmentError`` once more than ``max_errors`` problems are found
+    (``None`` never raises). Unassigned blocks count as errors unless
+    ``allow_unassigned``.
+    """
+    states = set(np.unique(order.geoids.astype('S2')).tolist())
+    plan = order.empty_plan()
+    report = _new_report()
+
+    delimiter, geoid_col, district_col = _layout(path, geoid_col, district_col)
+    reader = csv.open_csv(
+        path,
+        read_options=csv.ReadOptions(block_size=block_size),
+        parse_options=csv.ParseOptions(delimiter=delimiter),
+        convert_options=csv.ConvertOptions(
+            include_columns=[geoid_col, district_col],
+            column_types={geoid_col: pa.string(), district_col: pa.string()},
+        ),
+    )
+    for batch in reader:
+        geoids = pc.utf8_trim_whitespace(batch.column(geoid_col))
+        districts = pc.utf8_trim_whitespace(batch.column(district_col))
+        report['rows'] += batch.num_rows
+        listed = pc.fill_null(pc.not_equal(districts, NO_DISTRICT_CODE), True).to_numpy(zero_copy_only=False)
+
+        well_formed = pc.fill_null(pc.match_substring_regex(geoids, GEOID_PATTERN), False).to_numpy(zero_copy_only=False)
+        digits = pc.fill_null(pc.match_substring_regex(districts, r'^\d{1,3}$'), False).to_numpy(zero_copy_only=False)
+        values = np.zeros(batch.num_rows, dtype=np.int64)
+        values[digits] = pc.cast(pc.filter(districts, pa.array(digits)), pa.int64()).to_numpy()
+        valid_district = digits & (values >= 0) & (values <= MAX_DISTRICT)
+
+        geoid_values = geoids.to_numpy(zero_copy_only=False)
+        report['malformed'] += int((~well_formed).sum())
+        _sample(report, 'malformed', geoid_values[~well_formed])
+        bad = well_formed & ~valid_district & listed
+        report['bad_district'] += int(bad.sum())
+        _sample(report, 'bad_district', [f'{g}: {d}' for g, d in zip(geoid_values[bad], districts.to_numpy(zero_copy_only=False)[bad])])
+
+        rows = np.flatnonzero(well_formed & valid_district)
+        positions = order.positions(geoid_values[rows])
+        unknown = positions == NO_BLOCK
+        if unknown.any():
+            foreign = np.isin(geoid_values[rows[unknown]].astype('S2'), list(states), invert=True)
+            report['other_state'] += int(foreign.sum())
+            report['unknown'] += int((~foreign).sum())
+            _sample(report, 'unknown', geoid_values[rows[unknown][~foreign]])
+        rows, positions = rows[~unknown], positions[~unknown]
+
+        # Duplicates against earlier batches and within this batch; the first row wins
+        _, first = np.unique(positions, return_index=True)
+        keep = np.zeros(len(positions), dtype=bool)
+        keep[first] = True
+        keep &= plan[positions] == NO_DISTRICT
+        report['duplicates'] += int((~keep).sum())
+        _sample(report, 'duplicates', geoid_values[rows[~keep]])
+        plan[positions[keep]] = values[rows[keep]]
+
+        if max_errors is not None and _errors(report, True) > max_errors:
+            raise AssignmentError(f"{path}: more than {max_errors} invalid rows", report)
+
+    missing = np.flatnonzero(plan == NO_DISTRICT)
+    report['unassigned'] = len(missing)
+    _sample(report, 'unassigned', order.geoids[missing[:SAMPLE_SIZE]].astype(str))
+    if max_errors is not None and _errors(report, allow_unassigned) > max_errors:
+        raise AssignmentError(f"{path}: {_errors(report, allow_unassigned)} problems", report)
+    return Assignment(order, plan, report)
+
+
+def print_report(report):
+    """Print a validation report from ``ingest_assignment``."""
+    print(f"Rows read: {report['rows']:,}")
+    labels = {
+        'malformed': 'malformed GEOIDs', 'bad_district': 'invalid districts',
+        'duplicates': 'duplicate GEOIDs', 'unknown': 'GEOIDs not in the block layer',
+        'unassigned': 'blocks without a district',
+    }
+    for kind, label in labels.items():
+        if report[kind]:
+            print(f"Warning: {report[kind]:,} {label}, e.g. {report['samples'][kind][:5]}")
+    if report['other_state']:
+        print(f"Skipped {report['other_state']:,} rows for blocks of other states")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignment', help="assignment CSV or Census block assignment file")
+    parser.add_argument('--blocks', default="tl_2020_24_tabblock20.shp")
+    parser.add_argument('--geoid-col', default='GEOID20')
+    parser.add_argument('--district-col', default='District')
+    parser.add_argument('--max-errors', type=int, default=0, help="fail after this many problems")
+    parser.add_argument('--require-all', action='store_true', help="treat unassigned blocks as errors")
+    args = parser.parse_args(argv)
+    from layer_cache import load_layer
+    try:
+        order = load_block_order(load_layer(args.blocks, epsg=4326))
+        result = ingest_assignment(args.assignment, order, args.geoid_col, args.district_col,
+                                   args.max_errors, allow_unassigned=not args.require_all)
+    except AssignmentError as e:
+        print_report(e.report)
+        print(f"FAIL: {e}", file=sys.stderr)
+        return 1
+    print_report(result.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
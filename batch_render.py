@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Render many districting plans in parallel.
+
+The base layers (blocks, precincts, counties, topology, crosswalk, adjacency,
+point index, PL and election data) are loaded once in the parent process; the
+worker processes are forked afterwards and inherit them copy-on-write, so N
+plans cost one load plus N plan renders spread over all cores.
+
+Each plan gets its own directory with the map page, the district GeoJSON and
+TopoJSON and a ``summary.txt`` of the printed report; the headline numbers of
+all plans are collected in ``summary.csv``. A plan that fails to render gets
+its traceback in ``summary.txt`` and an ``error`` in its row; the other plans
+still render.
+"""
+import argparse
+import contextlib
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import pandas as pd
+
+import create_enhanced_map
+
+# Set in the parent before forking; workers read it from their inherited memory
+_BASE = None
+
+
+def _render(task):
+    path, plan_name, out_dir = task
+    plan_dir = os.path.join(out_dir, plan_name)
+    os.makedirs(plan_dir, exist_ok=True)
+    start = time.perf_counter()
+    with open(os.path.join(plan_dir, 'summary.txt'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            summary = create_enhanced_map.render_plan(_BASE, path, plan_dir, plan_name=plan_name)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            summary = {'plan': plan_name, 'error': f'{type(e).__name__}: {e}'}
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def plan_files(paths):
+    """Assignment CSVs given directly or found in the given directories."""
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, '*.csv'))) if os.path.isdir(path) else [path]
+    return files
+
+
+def plan_names(files):
+    """
+    Output name of every file: its base name, prefixed with its directory name
+    where several files share a base name, and numbered if that still clashes.
+    """
+    names = [os.path.splitext(os.path.basename(path))[0] for path in files]
+    names = [
+        f"{os.path.basename(os.path.dirname(os.path.abspath(path)))}_{name}" if names.count(name) > 1 else name
+        for path, name in zip(files, names)
+    ]
+    return [f"{name}_{i}" if names.count(name) > 1 else name for i, name in enumerate(names, 1)]
+
+
+def run(args):
+    global _BASE
+    files = plan_files(args.plans)
+    if not files:
+        sys.exit("No assignment CSVs found")
+    os.makedirs(args.output, exist_ok=True)
+    _BASE = create_enhanced_map.load_base_layers()
+
+    tasks = [(path, name, args.output) for path, name in zip(files, plan_names(files))]
+    workers = min(args.workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        print("fork is not available on this platform; rendering serially")
+        workers = 1
+    print(f"\nRendering {len(tasks)} plans with {workers} worker(s)...")
+
+    rows = []
+    if workers == 1:
+        results = map(_render, tasks)
+    else:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        results = pool.imap_unordered(_render, tasks)
+    try:
+        for summary in results:
+            rows.append(summary)
+            status = f"FAILED: {summary['error']}" if 'error' in summary else f"({summary['seconds']}s)"
+            print(f"  [{len(rows)}/{len(tasks)}] {summary['plan']} {status}")
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    summary_file = os.path.join(args.output, 'summary.csv')
+    pd.DataFrame(rows).sort_values('plan').to_csv(summary_file, index=False)
+    print(f"Summary saved to: {summary_file}")
+    failed = sum('error' in row for row in rows)
+    if failed:
+        print(f"{failed} of {len(rows)} plans failed; see their summary.txt")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('plans', nargs='+', help="assignment CSVs (GEOID20, District) or directories of them")
+    parser.add_argument('-o', '--output', required=True, help="output directory, one subdirectory per plan")
+    parser.add_argument('-j', '--workers', type=int, help="worker processes (default: all cores)")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Benchmark the map pipeline on synthetic block grids.
+
+A square or hexagonal tessellation of N "blocks" is generated in the Maryland
+State Plane projection, together with precincts and counties made of groups of
+blocks, a random contiguous plan (nearest of 8 random seeds), PL 94-171 style
+counts and precinct returns. The pipeline stages are then timed and
+memory-profiled on it with profiler.py: cold and cached load, reprojection,
+topology, ingest, full and incremental dissolve, simplification, precinct
+assignment, point lookup, contiguity, tabulation, partisan scoring,
+interactive plan edits and GeoJSON/TopoJSON/HTML serialization.
+
+Inputs are generated once per (shape, size, seed) in the work directory and
+all caches are kept there, so runs are reproducible and need no network or
+Census downloads. Each run is stored as a JSON report in the results directory
+and compared with the previous run of the same shape and size.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import folium
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from assignment_ingest import ingest_assignment
+from block_index import ensure_block_index
+from block_order import load_block_order
+from compact_output import to_geojson, to_topojson, write_text
+from crosswalk import align_crosswalk, load_crosswalk, precinct_shares
+from incremental_dissolve import dissolve_districts
+from layer_cache import load_layer
+from multires import DISTRICT_LEVELS, PRECINCT_LEVELS, MultiResolutionGeoJson, build_district_levels, build_levels
+from partisan import ElectionModel, block_weights, evaluate
+from plan_editor import PlanEditor
+from plan_metrics import contiguity, load_adjacency
+from profiler import Profiler, compare_reports, print_report
+from tabulation import PL_COLUMNS, block_counts, tabulate
+from topology import boundary_arcs, load_topology
+
+# NAD83 / Maryland (metres); the grid starts near the western end of the state
+PROJECTED_EPSG = 26985
+ORIGIN = (200_000.0, 150_000.0)
+CELL_SIZE = 100.0
+
+DISTRICTS = 8
+PRECINCT_SIZE = 6  # blocks per precinct side (~36 blocks, as in Maryland)
+COUNTY_GRID = 5  # counties per side
+LOOKUP_POINTS = 100_000
+MOVED_FRACTION = 0.001
+EDITS = 20  # precinct clicks in the plan editor
+
+WORK_DIR = 'benchmarks/work'
+RESULTS_DIR = 'benchmarks/results'
+
+
+def _grid(n_blocks, shape):
+    """Cell geometries, centres and (row, column) of a roughly square grid of ``n_blocks`` cells."""
+    side = int(np.ceil(np.sqrt(n_blocks)))
+    rows, cols = np.divmod(np.arange(n_blocks), side)
+    if shape == 'square':
+        x = ORIGIN[0] + cols * CELL_SIZE
+        y = ORIGIN[1] + rows * CELL_SIZE
+        geoms = shapely.box(x, y, x + CELL_SIZE, y + CELL_SIZE)
+        return geoms, x + CELL_SIZE / 2, y + CELL_SIZE / 2, rows, cols
+    # Pointy-top hexagons of the same area, odd rows shifted by half a cell. Vertices are
+    # computed on an integer lattice (half widths, half radii) so neighbours share them exactly
+    radius = CELL_SIZE / np.sqrt(1.5 * np.sqrt(3))
+    half_x, half_y = np.sqrt(3) * radius / 2, radius / 2
+    ix, iy = 2 * cols + rows % 2, 3 * rows
+    offsets = np.array([(1, 1), (0, 2), (-1, 1), (-1, -1), (0, -2), (1, -1), (1, 1)])
+    ring = np.stack([
+        ORIGIN[0] + (ix[:, None] + offsets[:, 0]) * half_x,
+        ORIGIN[1] + (iy[:, None] + offsets[:, 1]) * half_y,
+    ], axis=-1)
+    return shapely.polygons(ring), ORIGIN[0] + ix * half_x, ORIGIN[1] + iy * half_y, rows, cols
+
+
+def _groups(geoms, labels):
+    """Union of the cells of every label, in label order."""
+    order = np.argsort(labels, kind='stable')
+    ids, starts = np.unique(labels[order], return_index=True)
+    parts = np.split(geoms[order], starts[1:])
+    return ids, np.array([shapely.coverage_union_all(p) for p in parts], dtype=object)
+
+
+def generate(path, n_blocks, shape, seed):
+    """Write a synthetic block layer, precincts, counties, plan, PL counts and returns to ``path``."""
+    rng = np.random.default_rng(seed)
+    geoms, x, y, rows, cols = _grid(n_blocks, shape)
+    geoids = np.char.add('24', np.char.zfill(np.arange(n_blocks).astype(str), 13))
+    crs = f'EPSG:{PROJECTED_EPSG}'
+
+    side = cols.max() + 1
+    precinct = (rows // PRECINCT_SIZE) * (side // PRECINCT_SIZE + 1) + cols // PRECINCT_SIZE
+    county_side = max(1, int(np.ceil((rows.max() + 1) / COUNTY_GRID)))
+    county = (rows // county_side) * COUNTY_GRID + np.minimum(cols // max(1, side // COUNTY_GRID), COUNTY_GRID - 1)
+
+    gpd.GeoDataFrame({
+        'GEOID20': geoids,
+        'ALAND20': np.full(n_blocks, int(shapely.area(geoms[0]))),
+        'INTPTLAT20': '', 'INTPTLON20': '',
+    }, geometry=geoms, crs=crs).to_file(os.path.join(path, 'blocks.shp'))
+
+    ids, shapes = _groups(geoms, precinct)
+    vtd_geoids = np.array([f'24{i:09d}' for i in ids])
+    gpd.GeoDataFrame({'GEOID20': vtd_geoids, 'NAME20': [f'Precinct {i}' for i in ids]},
+                     geometry=shapes, crs=crs).to_file(os.path.join(path, 'vtd.shp'))
+    ids, shapes = _groups(geoms, county)
+    gpd.GeoDataFrame({'GEOID20': [f'24{i:03d}' for i in ids], 'NAME20': [f'County {i}' for i in ids]},
+                     geometry=shapes, crs=crs).to_file(os.path.join(path, 'county.shp'))
+
+    # Nearest of DISTRICTS random seeds: contiguous, irregular districts
+    seeds = rng.choice(n_blocks, DISTRICTS, replace=False)
+    distance = (x[:, None] - x[seeds]) ** 2 + (y[:, None] - y[seeds]) ** 2
+    pd.DataFrame({'GEOID20': geoids, 'District': np.argmin(distance, axis=1) + 1}).to_csv(
+        os.path.join(path, 'plan.csv'), index=False)
+
+    population = rng.poisson(8, n_blocks)
+    pl = pd.DataFrame({'GEOID20': geoids, 'P0010001': population, 'P0030001': rng.binomial(population, 0.78)})
+    pl.to_csv(os.path.join(path, 'pl.csv'), index=False)
+
+    votes = rng.poisson(250, (len(vtd_geoids), 2))
+    pd.DataFrame({'GEOID20': vtd_geoids, 'DEM': votes[:, 0], 'REP': votes[:, 1]}).to_csv(
+        os.path.join(path, 'returns.csv'), index=False)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_pipeline(path, profile, seed):
+    """Time every pipeline stage on the inputs in ``path``; caches go to ``path``/cache."""
+    cache = os.path.join(path, 'cache')
+    out = os.path.join(path, 'out')
+    os.makedirs(out, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    with profile.stage('load'):
+        blocks = load_layer(os.path.join(path, 'blocks.shp'), epsg=4326, cache_dir=cache, refresh=True)
+        precincts = load_layer(os.path.join(path, 'vtd.shp'), epsg=4326, cache_dir=cache, refresh=True)
+        counties = load_layer(os.path.join(path, 'county.shp'), epsg=4326, cache_dir=cache, refresh=True)
+    with profile.stage('load (cached)'):
+        blocks = load_layer(os.path.join(path, 'blocks.shp'), epsg=4326, cache_dir=cache)
+    with profile.stage('reprojection'):
+        blocks.to_crs(epsg=PROJECTED_EPSG)
+
+    with profile.stage('topology'):
+        topology = load_topology(blocks, cache, refresh=True)
+    with profile.stage('block order'):
+        order = load_block_order(blocks, cache, refresh=True)
+    with profile.stage('ingest'):
+        plan = ingest_assignment(os.path.join(path, 'plan.csv'), order).plan
+        layer_plan = order.to_layer(plan)
+
+    # Start the dissolve from scratch; its state from the previous run would make it a no-op
+    for state in glob.glob(os.path.join(cache, 'benchmark.*')):
+        os.remove(state)
+    with profile.stage('dissolve'):
+        dissolve_districts(blocks, plan, order, cache, name='benchmark', method='redissolve')
+    moved = rng.choice(len(plan), max(1, int(len(plan) * MOVED_FRACTION)), replace=False)
+    edited = plan.copy()
+    edited[moved] = rng.integers(1, DISTRICTS + 1, len(moved))
+    with profile.stage('dissolve (incremental)'):
+        dissolve_districts(blocks, edited, order, cache, name='benchmark', method='patch')
+
+    with profile.stage('simplify'):
+        district_levels = build_district_levels(*boundary_arcs(topology, layer_plan, 0), DISTRICT_LEVELS, blocks.crs)
+        boundaries = district_levels[-1]['frame']
+        precinct_levels = build_levels(precincts, PRECINCT_LEVELS)
+
+    with profile.stage('precinct assignment'):
+        crosswalk = load_crosswalk(blocks, precincts, cache, refresh=True)
+        aligned = align_crosswalk(crosswalk, order)
+    with profile.stage('precinct shares'):
+        precinct_shares(aligned, plan)
+
+    with profile.stage('point index'):
+        index = ensure_block_index(blocks, os.path.join(cache, 'block_index'))
+    lon0, lat0, lon1, lat1 = blocks.total_bounds
+    lat = rng.uniform(lat0, lat1, LOOKUP_POINTS)
+    lon = rng.uniform(lon0, lon1, LOOKUP_POINTS)
+    with profile.stage('point lookup'):
+        index.lookup(lat, lon, layer_plan)
+
+    with profile.stage('contiguity'):
+        adjacency = load_adjacency(blocks, topology, cache, refresh=True)
+        contiguity(adjacency, layer_plan)
+    pl_blocks = pd.read_csv(os.path.join(path, 'pl.csv'), dtype={'GEOID20': str}).rename(columns=PL_COLUMNS)
+    with profile.stage('tabulation'):
+        counts = block_counts(pl_blocks, order)
+        tabulate(counts, plan)
+    returns = pd.read_csv(os.path.join(path, 'returns.csv'), dtype={'GEOID20': str})
+    returns = returns.rename(columns={'GEOID20': 'VTD', 'DEM': 'Dem', 'REP': 'Rep'})
+    with profile.stage('partisan'):
+        evaluate(ElectionModel(returns, block_weights(crosswalk, pl_blocks), order), plan)
+
+    editor = PlanEditor({
+        'blocks': blocks, 'counties': counties, 'order': order, 'topology': topology, 'adjacency': adjacency,
+        'block_index': index, 'crosswalk': aligned, 'counts': counts,
+    }, plan)
+    clicks = shapely.point_on_surface(blocks.geometry.values[rng.choice(len(blocks), EDITS)])
+    with profile.stage('plan edit'):
+        for point, district in zip(clicks, rng.integers(1, DISTRICTS + 1, EDITS)):
+            editor.assign(editor.select(point.y, point.x), int(district))
+
+    with profile.stage('geojson'):
+        write_text(os.path.join(out, 'districts.geojson'), to_geojson(boundaries, ['District']))
+        write_text(os.path.join(out, 'precincts.geojson'), to_geojson(precincts, ['NAME20']))
+    with profile.stage('topojson'):
+        write_text(os.path.join(out, 'districts.topojson'), to_topojson({
+            'districts': (boundaries, ['District']), 'counties': (counties, ['NAME20']),
+        }))
+    with profile.stage('html'):
+        m = folium.Map(location=[(lat0 + lat1) / 2, (lon0 + lon1) / 2], zoom_start=9, tiles=None)
+        for levels, name, fields in ((district_levels, 'Districts', ['District']), (precinct_levels, 'Precincts', ['NAME20'])):
+            MultiResolutionGeoJson(levels, "function(f) { return {weight: 1}; }", fields, fields,
+                                   name=name, topojson=True).add_to(m)
+        m.save(os.path.join(out, 'map.html'))
+
+
+def previous_result(results_dir, label):
+    runs = sorted(glob.glob(os.path.join(results_dir, f'{label}-*.json')))
+    if not runs:
+        return None
+    with open(runs[-1]) as f:
+        return json.load(f)
+
+
+def run(args):
+    os.makedirs(args.results, exist_ok=True)
+    failed = False
+    for n_blocks in args.blocks:
+        label = f'{args.shape}-{n_blocks}'
+        path = os.path.join(args.work, f'{label}-seed{args.seed}')
+        if not os.path.exists(os.path.join(path, 'returns.csv')):
+            print(f"Generating {n_blocks:,} {args.shape} blocks in {path}...")
+            os.makedirs(path, exist_ok=True)
+            generate(path, n_blocks, args.shape, args.seed)
+
+        print(f"\n=== {label} ===")
+        profile = Profiler(label, trace=args.trace)
+        run_pipeline(path, profile, args.seed)
+        report = profile.report()
+        report.update({'blocks': n_blocks, 'shape': args.shape, 'seed': args.seed, 'commit': _commit()})
+
+        baseline = previous_result(args.results, label)
+        print_report(report, baseline)
+        if baseline is not None:
+            for regression in compare_reports(report, baseline, args.tolerance):
+                print(f"REGRESSION: {regression}", file=sys.stderr)
+                failed = True
+
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        result_file = os.path.join(args.results, f'{label}-{stamp}.json')
+        with open(result_file, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Result saved to: {result_file}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--blocks', type=int, nargs='+', default=[10_000, 100_000], help="grid sizes to run")
+    parser.add_argument('--shape', choices=['square', 'hex'], default='square')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work', default=WORK_DIR, help="generated inputs and caches")
+    parser.add_argument('--results', default=RESULTS_DIR, help="one JSON report per run")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="slowdown flagged against the previous run")
+    parser.add_argument('--trace', action='store_true', help="record tracemalloc top allocations per stage")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Persistent block-level point index.
+
+Points are resolved against the raw census block polygons, so the answer is the
+authoritative GEOID20 (and, through the assignment table, the district) rather
+than a hit on a simplified district outline.
+
+The index is a uniform grid stored as flat NumPy arrays (CSR of candidate blocks
+per cell, plus the block that fully covers a cell where there is one) next to
+the block geometries as WKB in an Arrow file. Everything is memory-mapped on
+load; geometries are decoded lazily for the cells that are actually queried.
+
+Run as a script to look up points against a built index; it never loads
+geopandas or the block shapefile, so it starts quickly enough for cron jobs.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pyarrow as pa
+import shapely
+
+from block_order import NO_BLOCK, NO_DISTRICT, BlockOrder
+from layer_cache import CACHE_DIR, blocks_key
+from settings import ASSIGNMENT_FILE
+
+INDEX_VERSION = 1
+INDEX_DIR = os.path.join(CACHE_DIR, 'block_index')
+
+# Points per bulk query; bounds the size of the candidate pair arrays
+CHUNK_SIZE = 1_000_000
+
+
+def build_block_index(blocks, path=INDEX_DIR, cells_per_block=4.0, key=None):
+    """
+    Build the grid index for ``blocks`` (GEOID20 + geometry) and write it to ``path``.
+
+    The cell size is chosen so that there are roughly ``cells_per_block`` cells
+    per block over the layer extent.
+    """
+    geoms = np.asarray(blocks.geometry.values, dtype=object)
+    geoids = np.asarray(blocks['GEOID20'].values).astype('S')
+    x0, y0, x1, y1 = shapely.total_bounds(geoms)
+    cell = np.sqrt((x1 - x0) * (y1 - y0) / max(len(geoms) * cells_per_block, 1))
+    nx = int(np.ceil((x1 - x0) / cell)) or 1
+    ny = int(np.ceil((y1 - y0) / cell)) or 1
+
+    bounds = shapely.bounds(geoms)
+    ix0 = np.clip(((bounds[:, 0] - x0) // cell).astype(np.int64), 0, nx - 1)
+    iy0 = np.clip(((bounds[:, 1] - y0) // cell).astype(np.int64), 0, ny - 1)
+    ix1 = np.clip(((bounds[:, 2] - x0) // cell).astype(np.int64), 0, nx - 1)
+    iy1 = np.clip(((bounds[:, 3] - y0) // cell).astype(np.int64), 0, ny - 1)
+
+    # Enumerate every (block, cell) pair covered by the block's bounding box
+    w, h = ix1 - ix0 + 1, iy1 - iy0 + 1
+    counts = w * h
+    block = np.repeat(np.arange(len(geoms)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = ix0[block] + k % w[block]
+    cy = iy0[block] + k // w[block]
+    cells = cy * nx + cx
+
+    # Drop pairs whose cell does not actually touch the block
+    boxes = shapely.box(x0 + cx * cell, y0 + cy * cell, x0 + (cx + 1) * cell, y0 + (cy + 1) * cell)
+    shapely.prepare(geoms)
+    touches = shapely.intersects(geoms[block], boxes)
+    block, cells, boxes = block[touches], cells[touches], boxes[touches]
+
+    order = np.lexsort((block, cells))
+    block, cells, boxes = block[order], cells[order], boxes[order]
+    cell_ptr = np.zeros(nx * ny + 1, dtype=np.int64)
+    np.add.at(cell_ptr, cells + 1, 1)
+    cell_ptr = np.cumsum(cell_ptr)
+
+    # Cells entirely inside one block need no exact test at query time
+    cell_owner = np.full(nx * ny, NO_BLOCK, dtype=np.int32)
+    single = np.flatnonzero(np.diff(cell_ptr) == 1)
+    first = cell_ptr[single]
+    covered = shapely.covers(geoms[block[first]], boxes[first])
+    cell_owner[single[covered]] = block[first][covered]
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'cell_ptr.npy'), cell_ptr)
+    np.save(os.path.join(path, 'cell_blocks.npy'), block.astype(np.int32))
+    np.save(os.path.join(path, 'cell_owner.npy'), cell_owner)
+    np.save(os.path.join(path, 'geoids.npy'), geoids)
+    np.save(os.path.join(path, 'geoid_order.npy'), np.argsort(geoids, kind='stable').astype(np.int32))
+    table = pa.table({'wkb': pa.array(shapely.to_wkb(geoms), type=pa.binary())})
+    with pa.OSFile(os.path.join(path, 'geometries.arrow'), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({
+            'version': INDEX_VERSION, 'key': key, 'origin': [float(x0), float(y0)],
+            'cell': float(cell), 'nx': nx, 'ny': ny, 'blocks': len(geoms),
+        }, f)
+
+
+def index_key(path=INDEX_DIR):
+    """Key the index was built with, or None if there is no usable index at ``path``."""
+    try:
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta.get('key') if meta.get('version') == INDEX_VERSION else None
+
+
+def ensure_block_index(blocks, path=INDEX_DIR):
+    """Build the index for ``blocks`` unless an up-to-date one exists; return it loaded."""
+    key = blocks_key(blocks)
+    if index_key(path) != key:
+        build_block_index(blocks, path, key=key)
+    return BlockIndex(path)
+
+
+class BlockIndex:
+    """Memory-mapped grid index answering points with their census block."""
+
+    def __init__(self, path=INDEX_DIR):
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Block index at {path} has an unsupported version; rebuild it")
+        self.origin = meta['origin']
+        self.cell = meta['cell']
+        self.nx, self.ny = meta['nx'], meta['ny']
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+
+        self.cell_ptr = load('cell_ptr.npy')
+        self.cell_blocks = load('cell_blocks.npy')
+        self.cell_owner = load('cell_owner.npy')
+        self.geoids = load('geoids.npy')
+        self.geoid_order = load('geoid_order.npy')
+
+        source = pa.memory_map(os.path.join(path, 'geometries.arrow'))
+        self._wkb = pa.ipc.open_file(source).read_all().column('wkb').combine_chunks()
+        self._geoms = np.empty(meta['blocks'], dtype=object)
+        self._decoded = np.zeros(meta['blocks'], dtype=bool)
+
+    def __len__(self):
+        return len(self.geoids)
+
+    def _geometries(self, positions):
+        """Decode (once) and return the prepared geometries at ``positions``."""
+        missing = np.unique(positions[~self._decoded[positions]])
+        if len(missing):
+            decoded = shapely.from_wkb(self._wkb.take(pa.array(missing)).to_numpy(zero_copy_only=False))
+            shapely.prepare(decoded)
+            self._geoms[missing] = decoded
+            self._decoded[missing] = True
+        return self._geoms[positions]
+
+    def query(self, lat, lon):
+        """Return the block position of every (lat, lon) pair (``NO_BLOCK`` if none)."""
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        if lat.shape != lon.shape:
+            raise ValueError("lat and lon must have the same length")
+        result = np.full(len(lat), NO_BLOCK, dtype=np.int64)
+        for start in range(0, len(lat), CHUNK_SIZE):
+            stop = start + CHUNK_SIZE
+            result[start:stop] = self._query_chunk(lon[start:stop], lat[start:stop])
+        return result
+
+    def _query_chunk(self, x, y):
+        result = np.full(len(x), NO_BLOCK, dtype=np.int64)
+        ix = np.floor((x - self.origin[0]) / self.cell)
+        iy = np.floor((y - self.origin[1]) / self.cell)
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+        points = np.flatnonzero(inside)
+        cells = iy[points].astype(np.int64) * self.nx + ix[points].astype(np.int64)
+
+        owner = self.cell_owner[cells]
+        covered = owner != NO_BLOCK
+        result[points[covered]] = owner[covered]
+        points, cells = points[~covered], cells[~covered]
+
+        # Expand each remaining point into (point, candidate block) pairs
+        starts = self.cell_ptr[cells]
+        counts = self.cell_ptr[cells + 1] - starts
+        pair_point = np.repeat(points, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_block = np.asarray(self.cell_blocks[np.repeat(starts, counts) + offsets], dtype=np.int64)
+        if len(pair_block) == 0:
+            return result
+
+        geoms = self._geometries(pair_block)
+        hit = shapely.contains_xy(geoms, x[pair_point], y[pair_point])
+        # Points exactly on a shared edge are in no block's interior; take a touching one
+        unresolved = ~np.isin(pair_point, pair_point[hit])
+        if unresolved.any():
+            hit[unresolved] = shapely.intersects_xy(geoms[unresolved], x[pair_point[unresolved]], y[pair_point[unresolved]])
+        # Pairs are ordered by block within each cell; keep the lowest hit per point
+        hit_point, hit_block = pair_point[hit][::-1], pair_block[hit][::-1]
+        result[hit_point] = hit_block
+        return result
+
+    def geoid(self, positions):
+        """GEOID20 strings of block positions (empty string for ``NO_BLOCK``)."""
+        positions = np.asarray(positions)
+        out = np.full(len(positions), '', dtype=object)
+        found = positions != NO_BLOCK
+        out[found] = self.geoids[positions[found]].astype(str)
+        return out
+
+    def positions(self, geoids):
+        """Block positions of GEOID20 strings (``NO_BLOCK`` for unknown GEOIDs)."""
+        geoids = np.asarray(geoids).astype(self.geoids.dtype)
+        sorted_geoids = self.geoids[self.geoid_order]
+        idx = np.clip(np.searchsorted(sorted_geoids, geoids), 0, len(sorted_geoids) - 1)
+        found = sorted_geoids[idx] == geoids
+        return np.where(found, self.geoid_order[idx], NO_BLOCK)
+
+    def block_order(self):
+        """The canonical ``BlockOrder`` of the indexed blocks, without loading the block layer."""
+        return BlockOrder(np.asarray(self.geoids[self.geoid_order]).astype('S15'), np.asarray(self.geoid_order))
+
+    def lookup(self, lat, lon, plan):
+        """Return (block positions, districts) of every point under ``plan``, a plan in block layer order."""
+        positions = self.query(lat, lon)
+        districts = np.where(positions != NO_BLOCK, plan[np.maximum(positions, 0)], NO_DISTRICT)
+        return positions, districts
+
+
+def run(args):
+    from assignment_ingest import ingest_assignment
+
+    try:
+        index = BlockIndex(args.index)
+    except OSError:
+        sys.exit(f"No block index at {args.index}; build it with the map script or geocode_batch.py --rebuild-index")
+    points = args.points or [line for line in sys.stdin if line.strip()]
+    try:
+        lat, lon = np.array([[float(v) for v in p.replace(',', ' ').split()] for p in points]).reshape(-1, 2).T
+    except ValueError:
+        sys.exit("Points must be LAT,LON pairs")
+    order = index.block_order()
+    plan = order.to_layer(ingest_assignment(args.assignment, order).plan)
+    positions, districts = index.lookup(lat, lon, plan)
+    print('lat,lon,District,GEOID20')
+    for y, x, district, geoid in zip(lat, lon, districts, index.geoid(positions)):
+        print(f"{y},{x},{'' if district == NO_DISTRICT else district},{geoid}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up the district and block of points in the block index.")
+    parser.add_argument('points', nargs='*', help="LAT,LON pairs (default: one pair per line on stdin)")
+    parser.add_argument('--assignment', default=ASSIGNMENT_FILE, help="block assignment CSV (GEOID20, District)")
+    parser.add_argument('--index', default=INDEX_DIR, help="block index directory")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
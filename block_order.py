@@ -0,0 +1,117 @@
+"""
+Canonical block order and array-backed plans.
+
+Every block of the layer gets a fixed position in GEOID20 order, stored once
+per block layer. A plan is then an int8 array over that order (``NO_DISTRICT``
+where unassigned) and per-plan work indexes by position instead of joining on
+GEOID strings; block tables (PL counts, crosswalk, votes) are aligned to the
+order once when loaded.
+
+``layer`` maps canonical positions to rows of the block layer, which is the
+order of the geometry and of everything built from it (topology, adjacency,
+point index); ``to_layer``/``from_layer`` convert arrays between the two.
+"""
+import json
+import os
+
+import numpy as np
+
+from layer_cache import CACHE_DIR, blocks_key
+
+ORDER_VERSION = 1
+
+NO_BLOCK = -1
+NO_DISTRICT = -1
+PLAN_DTYPE = np.int8
+
+
+class BlockOrder:
+    """GEOID20-sorted block order with its mapping to the rows of the block layer."""
+
+    def __init__(self, geoids, layer):
+        self.geoids = geoids
+        self.layer = layer
+        self.canonical = np.empty_like(layer)
+        self.canonical[layer] = np.arange(len(layer), dtype=layer.dtype)
+
+    def __len__(self):
+        return len(self.geoids)
+
+    def positions(self, geoids):
+        """Canonical positions of GEOID20 strings (``NO_BLOCK`` for unknown GEOIDs)."""
+        geoids = np.asarray(geoids).astype(self.geoids.dtype)
+        idx = np.clip(np.searchsorted(self.geoids, geoids), 0, len(self) - 1)
+        return np.where(self.geoids[idx] == geoids, idx, NO_BLOCK).astype(np.int32)
+
+    def empty_plan(self):
+        return np.full(len(self), NO_DISTRICT, dtype=PLAN_DTYPE)
+
+    def plan_from_frame(self, frame, geoid_col='GEOID20', district_col='District'):
+        """Plan array from a GEOID20/District table (unknown GEOIDs are ignored)."""
+        plan = self.empty_plan()
+        positions = self.positions(frame[geoid_col].values)
+        found = positions != NO_BLOCK
+        plan[positions[found]] = np.asarray(frame[district_col].values)[found]
+        return plan
+
+    def plan_to_frame(self, plan):
+        """Assigned blocks of ``plan`` as a GEOID20/District DataFrame, in GEOID order."""
+        import pandas as pd
+
+        assigned = np.flatnonzero(plan != NO_DISTRICT)
+        return pd.DataFrame({'GEOID20': self.geoids[assigned].astype(str), 'District': plan[assigned].astype(int)})
+
+    def align(self, table, geoid_col='GEOID20', fill=0):
+        """Rows of a block table in canonical order (missing blocks filled with ``fill``)."""
+        import pandas as pd
+
+        table = table.drop_duplicates(geoid_col, keep='last')
+        positions = self.positions(table[geoid_col].values)
+        found = positions != NO_BLOCK
+        columns = [c for c in table.columns if c != geoid_col]
+        aligned = pd.DataFrame(index=pd.RangeIndex(len(self)), columns=columns)
+        for column in columns:
+            values = np.full(len(self), fill, dtype=object if isinstance(fill, str) else table[column].dtype)
+            values[positions[found]] = table[column].values[found]
+            aligned[column] = values
+        return aligned
+
+    def to_layer(self, values):
+        """Array in canonical order -> the same values in block layer order."""
+        out = np.empty_like(values)
+        out[self.layer] = values
+        return out
+
+    def from_layer(self, values):
+        """Array in block layer order -> the same values in canonical order."""
+        return np.asarray(values)[self.layer]
+
+
+def build_block_order(blocks):
+    geoids = np.asarray(blocks['GEOID20'].values).astype('S15')
+    layer = np.argsort(geoids, kind='stable').astype(np.int32)
+    return BlockOrder(geoids[layer], layer)
+
+
+def load_block_order(blocks, cache_dir=CACHE_DIR, name='blocks', refresh=False):
+    """Return the canonical order of ``blocks``, building and caching it on first use."""
+    path = os.path.join(cache_dir, f'{name}.order.npz')
+    key = blocks_key(blocks)
+    if not refresh and os.path.exists(path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') == ORDER_VERSION and meta.get('blocks') == key:
+                return BlockOrder(data['geoids'], data['layer'])
+
+    order = build_block_order(blocks)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, meta=json.dumps({'version': ORDER_VERSION, 'blocks': key}), geoids=order.geoids, layer=order.layer)
+    os.replace(tmp, path)
+    return order
+
+
+def write_plan(path, order, plan):
+    """Write ``plan`` as a GEOID20,District CSV."""
+    order.plan_to_frame(plan).to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
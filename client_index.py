@@ -0,0 +1,140 @@
+"""
+Compact point-in-district index embedded in the generated page.
+
+The browser used to ray-cast every vertex of every district's outer ring for each
+click. Instead the generator precomputes:
+
+- a coarse grid over the state where each cell either names the district that
+  fully covers it, is empty, or lists the few districts crossing it;
+- per district, its edges (all rings, so holes and enclaves are handled by the
+  even-odd rule) bucketed into horizontal bands, so a ray cast only visits the
+  edges in the band of the query point.
+
+Coordinates are quantized to integers relative to a common origin to keep the
+embedded JSON small.
+"""
+import json
+
+import numpy as np
+import shapely
+
+SCALE = 1e6  # quantization steps per degree (~0.1 m)
+GRID_SIZE = 64
+
+EMPTY = -1
+
+
+def _feature_index(geom, origin, scale):
+    """Quantized ring coordinates and band CSR of edge start indices for one district."""
+    rings = shapely.get_rings(shapely.get_parts(geom))
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    q = np.round((coords - origin) * scale).astype(np.int64)
+
+    # An edge runs from vertex k to k + 1 within the same ring
+    starts = np.flatnonzero(ring[:-1] == ring[1:])
+    y0 = np.minimum(q[starts, 1], q[starts + 1, 1])
+    y1 = np.maximum(q[starts, 1], q[starts + 1, 1])
+    bbox = [int(q[:, 0].min()), int(q[:, 1].min()), int(q[:, 0].max()), int(q[:, 1].max())]
+
+    bands = max(1, int(np.sqrt(len(starts))))
+    height = max(1, int(np.ceil((bbox[3] - bbox[1] + 1) / bands)))
+    b0 = (y0 - bbox[1]) // height
+    b1 = (y1 - bbox[1]) // height
+    counts = b1 - b0 + 1
+    edge = np.repeat(starts, counts)
+    band = np.repeat(b0, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    order = np.argsort(band, kind='stable')
+    band_ptr = np.r_[0, np.cumsum(np.bincount(band, minlength=bands))]
+
+    return {
+        'bbox': bbox,
+        'coords': q.ravel().tolist(),
+        'bands': bands,
+        'bandHeight': height,
+        'bandPtr': band_ptr.tolist(),
+        'bandEdges': edge[order].tolist(),
+    }
+
+
+def build_client_index(districts_gdf, id_column='District', grid_size=GRID_SIZE, scale=SCALE):
+    """Build the JSON-serializable lookup structure for ``districts_gdf`` (lon/lat)."""
+    geoms = np.asarray(districts_gdf.geometry.values, dtype=object)
+    ids = [int(d) for d in districts_gdf[id_column]]
+    x0, y0, x1, y1 = shapely.total_bounds(geoms)
+    origin = np.array([x0, y0])
+
+    features = [dict(id=d, **_feature_index(g, origin, scale)) for d, g in zip(ids, geoms)]
+
+    # Coarse grid in quantized units
+    cell = int(np.ceil(max(x1 - x0, y1 - y0) * scale / grid_size)) + 1
+    nx = int(np.ceil((x1 - x0) * scale / cell)) + 1
+    ny = int(np.ceil((y1 - y0) * scale / cell)) + 1
+    cx, cy = np.meshgrid(np.arange(nx), np.arange(ny))
+    cx, cy = cx.ravel(), cy.ravel()
+    boxes = shapely.box(
+        x0 + cx * cell / scale, y0 + cy * cell / scale,
+        x0 + (cx + 1) * cell / scale, y0 + (cy + 1) * cell / scale,
+    )
+    shapely.prepare(geoms)
+    cells = np.full(nx * ny, EMPTY, dtype=np.int64)
+    candidates = [[] for _ in range(nx * ny)]
+    for i, geom in enumerate(geoms):
+        covered = shapely.covers(geom, boxes)
+        cells[covered] = i
+        for c in np.flatnonzero(shapely.intersects(geom, boxes) & ~covered):
+            candidates[c].append(i)
+
+    # Cells crossed by boundaries point (as -2 - k) into the candidate list k
+    cand_ptr, cand = [0], []
+    for c in range(nx * ny):
+        if cells[c] == EMPTY and candidates[c]:
+            cells[c] = -2 - (len(cand_ptr) - 1)
+            cand.extend(candidates[c])
+            cand_ptr.append(len(cand))
+
+    return {
+        'origin': [float(x0), float(y0)],
+        'scale': scale,
+        'grid': {'nx': nx, 'ny': ny, 'cell': cell, 'cells': cells.tolist(), 'candPtr': cand_ptr, 'cand': cand},
+        'features': features,
+    }
+
+
+def client_index_json(districts_gdf, **kwargs):
+    """The lookup structure as compact JSON, ready to embed in a script."""
+    return json.dumps(build_client_index(districts_gdf, **kwargs), separators=(',', ':'))
+
+
+# Expects a ``districtIndex`` variable holding the output of build_client_index
+FIND_DISTRICT_JS = '''
+        function pointInFeature(f, x, y) {
+            if (x < f.bbox[0] || x > f.bbox[2] || y < f.bbox[1] || y > f.bbox[3]) return false;
+            var band = Math.min(f.bands - 1, Math.floor((y - f.bbox[1]) / f.bandHeight));
+            var c = f.coords, inside = false;
+            for (var i = f.bandPtr[band]; i < f.bandPtr[band + 1]; i++) {
+                var k = f.bandEdges[i] * 2;
+                var xi = c[k], yi = c[k + 1], xj = c[k + 2], yj = c[k + 3];
+                if (((yi > y) != (yj > y)) && (x < (xj - xi) * (y - yi) / (yj - yi) + xi)) {
+                    inside = !inside;
+                }
+            }
+            return inside;
+        }
+
+        function findDistrict(lng, lat) {
+            var idx = districtIndex, grid = idx.grid;
+            var x = Math.round((lng - idx.origin[0]) * idx.scale);
+            var y = Math.round((lat - idx.origin[1]) * idx.scale);
+            var cx = Math.floor(x / grid.cell), cy = Math.floor(y / grid.cell);
+            if (cx < 0 || cy < 0 || cx >= grid.nx || cy >= grid.ny) return null;
+            var cell = grid.cells[cy * grid.nx + cx];
+            if (cell === -1) return null;
+            if (cell >= 0) return idx.features[cell].id;
+            var k = -cell - 2;
+            for (var i = grid.candPtr[k]; i < grid.candPtr[k + 1]; i++) {
+                var f = idx.features[grid.cand[i]];
+                if (pointInFeature(f, x, y)) return f.id;
+            }
+            return null;
+        }
+'''
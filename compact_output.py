@@ -0,0 +1,182 @@
+"""
+Compact GeoJSON/TopoJSON output for the map layers.
+
+Dissolved layers carry every attribute of an arbitrary first block and
+full-precision coordinates. The writers here keep only the requested
+properties and quantize coordinates:
+
+- GeoJSON with coordinates rounded to a fixed number of decimals (6 is ~0.1 m);
+- TopoJSON with shared arcs stored once, quantized to an integer grid and
+  delta-encoded, so a boundary between two districts is written a single time.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+PRECISION = 6
+QUANTIZATION = 100_000
+
+SEPARATORS = (',', ':')
+
+
+def feature_properties(frame, properties):
+    """Feature property dicts limited to ``properties``, with missing values dropped."""
+    return [
+        {k: (v.item() if hasattr(v, 'item') else v) for k, v in row.items() if pd.notna(v)}
+        for row in frame[list(properties)].to_dict('records')
+    ]
+
+
+def round_geometries(geoms, precision=PRECISION):
+    """Geometries with every coordinate rounded to ``precision`` decimals."""
+    return shapely.transform(np.asarray(geoms, dtype=object), lambda c: np.round(c, precision))
+
+
+def to_geojson(frame, properties, precision=PRECISION):
+    """Compact GeoJSON FeatureCollection string with only ``properties`` kept."""
+    geoms = round_geometries(frame.geometry.values, precision)
+    features = [
+        {'type': 'Feature', 'properties': props, 'geometry': None if geom is None else geom.__geo_interface__}
+        for props, geom in zip(feature_properties(frame, properties), geoms)
+    ]
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=SEPARATORS)
+
+
+class _ArcBuilder:
+    """Cuts quantized rings into arcs at junctions and stores each arc once."""
+
+    def __init__(self, junctions, quantization):
+        self.junctions = junctions
+        self.quantization = quantization
+        self.arcs = []
+        self.index = {}
+
+    def _add(self, keys):
+        arc = tuple(keys)
+        if arc in self.index:
+            return self.index[arc]
+        reverse = arc[::-1]
+        if reverse in self.index:
+            return ~self.index[reverse]
+        self.index[arc] = len(self.arcs)
+        self.arcs.append(arc)
+        return self.index[arc]
+
+    def ring(self, keys):
+        """Arc indices of a ring given as vertex keys (open, no closing vertex)."""
+        cuts = [i for i, key in enumerate(keys) if key in self.junctions]
+        if not cuts:
+            # Closed ring without junctions: start at the smallest key so that a
+            # hole and the island filling it produce the same arc
+            start = keys.index(min(keys))
+            keys = keys[start:] + keys[:start]
+            return [self._add(keys + [keys[0]])]
+        keys = keys[cuts[0]:] + keys[:cuts[0]]
+        cuts = [c - cuts[0] for c in cuts] + [len(keys)]
+        closed = keys + [keys[0]]
+        return [self._add(closed[a:b + 1]) for a, b in zip(cuts[:-1], cuts[1:])]
+
+    def encoded(self):
+        """Arcs as delta-encoded quantized positions."""
+        out = []
+        for arc in self.arcs:
+            q = np.array([divmod(key, self.quantization) for key in arc], dtype=np.int64)
+            out.append(np.vstack([q[:1], np.diff(q, axis=0)]).tolist())
+        return out
+
+
+def to_topojson(layers, quantization=QUANTIZATION):
+    """
+    TopoJSON Topology string for ``layers``, a dict of name -> (frame, properties).
+
+    All layers share one arc table, so an edge common to several layers (or to
+    neighbouring features) is stored once.
+    """
+    frames = {name: frame for name, (frame, _) in layers.items()}
+    x0, y0, x1, y1 = np.array([shapely.total_bounds(f.geometry.values) for f in frames.values()]).T
+    x0, y0, x1, y1 = x0.min(), y0.min(), x1.max(), y1.max()
+    kx = (x1 - x0) / (quantization - 1) or 1.0
+    ky = (y1 - y0) / (quantization - 1) or 1.0
+
+    # Quantized rings (open, consecutive duplicates removed) of every polygon part
+    structure, rings = {}, []
+    for name, frame in frames.items():
+        features = []
+        for geom in frame.geometry.values:
+            polygons = []
+            for part in shapely.get_parts(geom) if geom is not None else []:
+                if part.geom_type != 'Polygon':
+                    continue
+                ring_ids = []
+                for ring in shapely.get_rings(part):
+                    c = shapely.get_coordinates(ring)
+                    q = np.round((c - [x0, y0]) / [kx, ky]).astype(np.int64)
+                    keys = q[:, 0] * quantization + q[:, 1]
+                    keys = keys[np.r_[True, keys[1:] != keys[:-1]]][:-1]
+                    if len(keys) < 3:
+                        if not ring_ids:
+                            break  # exterior collapsed
+                        continue
+                    ring_ids.append(len(rings))
+                    rings.append(keys)
+                if ring_ids:
+                    polygons.append(ring_ids)
+            features.append(polygons)
+        structure[name] = features
+
+    # A junction is a vertex reached from different neighbours by different rings
+    if rings:
+        keys = np.concatenate(rings)
+        prev = np.concatenate([np.roll(r, 1) for r in rings])
+        nxt = np.concatenate([np.roll(r, -1) for r in rings])
+        pairs = np.unique(np.column_stack([keys, np.minimum(prev, nxt), np.maximum(prev, nxt)]), axis=0)
+        first = np.r_[True, pairs[1:, 0] != pairs[:-1, 0]]
+        counts = np.diff(np.r_[np.flatnonzero(first), len(pairs)])
+        junctions = set(pairs[first, 0][counts > 1].tolist())
+    else:
+        junctions = set()
+
+    builder = _ArcBuilder(junctions, quantization)
+    ring_arcs = [builder.ring(r.tolist()) for r in rings]
+
+    objects = {}
+    for name, (frame, properties) in layers.items():
+        geometries = []
+        for polygons, props in zip(structure[name], feature_properties(frame, properties)):
+            arcs = [[ring_arcs[r] for r in polygon] for polygon in polygons]
+            if not arcs:
+                geometry = {'type': None}
+            elif len(arcs) == 1:
+                geometry = {'type': 'Polygon', 'arcs': arcs[0]}
+            else:
+                geometry = {'type': 'MultiPolygon', 'arcs': arcs}
+            geometry['properties'] = props
+            geometries.append(geometry)
+        objects[name] = {'type': 'GeometryCollection', 'geometries': geometries}
+
+    return json.dumps({
+        'type': 'Topology',
+        'transform': {'scale': [kx, ky], 'translate': [float(x0), float(y0)]},
+        'objects': objects,
+        'arcs': builder.encoded(),
+    }, separators=SEPARATORS)
+
+
+def write_text(path, text):
+    """Write ``text`` to ``path`` atomically and return its size in bytes."""
+    data = text.encode('utf-8')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+def print_sizes(sizes):
+    """Print a {label: bytes} size report."""
+    width = max((len(label) for label in sizes), default=0)
+    for label, size in sizes.items():
+        print(f"  {label:<{width}}  {size / 1024:,.1f} KB")
@@ -3,55 +3,57 @@
 Enhanced redistricting map with precincts and address lookup.
 Uses US Census Bureau geocoder for reliable CORS-free geocoding.
 """
-import geopandas as gpd
+import argparse
 import pandas as pd
 import folium
 from folium.plugins import Fullscreen
 import json
+import os
 import warnings
+from layer_cache import load_layer
+from topology import load_topology, boundary_arcs, arc_polygons
+from block_index import ensure_block_index
+from block_order import load_block_order, NO_DISTRICT
+from vector_tiles import TileSource, export_tiles, tile_layer, TilePopup
+from multires import DISTRICT_LEVELS, PRECINCT_LEVELS, build_levels, build_district_levels, encode_levels, MultiResolutionGeoJson
+from client_index import client_index_json, FIND_DISTRICT_JS
+from crosswalk import load_crosswalk, align_crosswalk, precinct_shares, precinct_districts
+from tabulation import load_pl_blocks, block_counts, tabulate, print_tabulation
+from partisan import ElectionModel, load_returns, block_weights, evaluate, print_metrics
+from plan_metrics import load_adjacency, plan_metrics, plan_failures, print_plan_metrics
+from plan_diff import moved_blocks, change_polygons, print_diff
+from assignment_ingest import ingest_assignment, print_report
+from compact_output import to_geojson, to_topojson, write_text, print_sizes
+from profiler import Profiler, load_report, compare_reports, print_report as print_profile
+from settings import (
+    BLOCKS_FILE, PRECINCTS_FILE, COUNTIES_FILE, ASSIGNMENT_FILE, OUTPUT_DIR, PL_FILE, RETURNS_FILE,
+    CURRENT_PLAN_FILE,
+)
 warnings.filterwarnings('ignore')
 
-print("Loading census block shapefile...")
-blocks = gpd.read_file("tl_2020_24_tabblock20.shp")
-print(f"Loaded {len(blocks)} census blocks")
-
-print("Loading VTD/precinct shapefile...")
-precincts = gpd.read_file("tl_2020_24_vtd20.shp")
-print(f"Loaded {len(precincts)} precincts")
-
-print("Loading county boundaries...")
-counties = gpd.read_file("tl_2020_24_county20.shp")
-print(f"Loaded {len(counties)} counties")
-
-print("\nLoading district assignments...")
-districts_csv = pd.read_csv("/Users/davidkunes/Desktop/DKunes_Submission.csv", dtype={'GEOID20': str, 'District': int})
-print(f"Loaded {len(districts_csv)} district assignments")
-
-# Join blocks with districts
-print("\nJoining census blocks with districts...")
-blocks_with_districts = blocks.merge(districts_csv, on='GEOID20', how='left')
-
-# Convert to WGS84
-print("Converting to WGS84...")
-blocks_with_districts = blocks_with_districts.to_crs(epsg=4326)
-precincts = precincts.to_crs(epsg=4326)
-counties = counties.to_crs(epsg=4326)
-
-# Dissolve blocks into district boundaries
-print("Creating district boundaries...")
-districts_dissolved = blocks_with_districts.dissolve(by='District', as_index=False)
-districts_dissolved['geometry'] = districts_dissolved['geometry'].simplify(tolerance=0.001, preserve_topology=True)
-
-# Assign districts to precincts via spatial join (based on centroid)
-print("Assigning districts to precincts...")
-precinct_centroids = precincts.copy()
-precinct_centroids['geometry'] = precincts.geometry.centroid
-precincts_with_districts = gpd.sjoin(precinct_centroids, districts_dissolved[['District', 'geometry']], how='left', predicate='within')
-precincts['District'] = precincts_with_districts['District'].values
-
-# Simplify precinct geometries for web
-print("Simplifying precinct geometries...")
-precincts['geometry'] = precincts['geometry'].simplify(tolerance=0.0005, preserve_topology=True)
+# Vector tile mode writes a z/x/y tile pyramid next to the HTML and loads the layers from
+# it instead of inlining GeoJSON (the page must then be served over HTTP with its tiles)
+USE_VECTOR_TILES = False
+TILE_BLOCKS = False
+TILE_URL = "tiles"
+
+# Without tiles, districts and precincts are simplified into several zoom levels with a
+# vertex budget each. SPLIT_ZOOM_LEVELS embeds only the coarsest level and writes the finer
+# ones as files next to the page, fetched on zoom (a page opened from disk rather than over
+# HTTP keeps the coarse level); turn it off to embed every level in a self-contained page
+SPLIT_ZOOM_LEVELS = True
+ZOOM_LEVEL_URL = "levels"
+
+# Embedded and exported geometry keeps only the displayed properties; levels are written as
+# delta-encoded TopoJSON (shared borders stored once) or as GeoJSON rounded to OUTPUT_PRECISION
+EMBED_TOPOJSON = True
+OUTPUT_PRECISION = 6
+
+# Every run writes per-stage timings and memory to <plan>_profile.json; copy one to
+# PROFILE_BASELINE to have later runs flag stages that got slower. PROFILE_ALLOCATIONS adds
+# tracemalloc's top allocating lines per stage (slow)
+PROFILE_BASELINE = os.path.join(OUTPUT_DIR, "profile_baseline.json")
+PROFILE_ALLOCATIONS = False
 
 # Color scheme
 district_colors = {
@@ -63,82 +65,8 @@ district_colors = {
 center_lat = 39.0458
 center_lon = -76.6413
 
-print(f"\nCreating interactive map...")
-
-# Create map
-m = folium.Map(location=[center_lat, center_lon], zoom_start=8, tiles='CartoDB positron')
-
-# District style function
-def district_style(feature):
-    dist = feature['properties']['District']
-    if dist is None or pd.isna(dist):
-        return {'fillColor': '#808080', 'color': '#000000', 'weight': 2, 'fillOpacity': 0.5}
-    return {'fillColor': district_colors.get(int(dist), '#808080'), 'color': '#000000', 'weight': 2, 'fillOpacity': 0.6}
-
-def district_highlight(feature):
-    return {'fillColor': '#ffffff', 'color': '#000000', 'weight': 3, 'fillOpacity': 0.8}
-
-# Precinct style function
-def precinct_style(feature):
-    dist = feature['properties']['District']
-    if dist is None or pd.isna(dist):
-        return {'fillColor': '#808080', 'color': '#333333', 'weight': 1, 'fillOpacity': 0.4}
-    return {'fillColor': district_colors.get(int(dist), '#808080'), 'color': '#333333', 'weight': 1, 'fillOpacity': 0.4}
-
-def precinct_highlight(feature):
-    return {'fillColor': '#ffffff', 'color': '#000000', 'weight': 2, 'fillOpacity': 0.7}
-
-# Add district layer
-district_layer = folium.FeatureGroup(name='Congressional Districts', show=True)
-folium.GeoJson(
-    districts_dissolved,
-    style_function=district_style,
-    highlight_function=district_highlight,
-    tooltip=folium.GeoJsonTooltip(fields=['District'], aliases=['District:'], style='font-size: 14px; font-weight: bold;')
-).add_to(district_layer)
-district_layer.add_to(m)
-
-# Add precinct layer
-precinct_layer = folium.FeatureGroup(name='Voting Precincts', show=False)
-folium.GeoJson(
-    precincts,
-    style_function=precinct_style,
-    highlight_function=precinct_highlight,
-    tooltip=folium.GeoJsonTooltip(
-        fields=['NAME20', 'District'],
-        aliases=['Precinct:', 'District:'],
-        style='font-size: 12px;'
-    )
-).add_to(precinct_layer)
-precinct_layer.add_to(m)
-
-# Add county boundaries layer
-print("Adding county boundaries...")
-county_layer = folium.FeatureGroup(name='County Boundaries', show=True)
-
-def county_style(feature):
-    return {
-        'fillColor': 'transparent',
-        'fillOpacity': 0,
-        'color': '#000000',
-        'weight': 3,
-        'dashArray': '5, 5'
-    }
-
-folium.GeoJson(
-    counties,
-    style_function=county_style,
-    tooltip=folium.GeoJsonTooltip(
-        fields=['NAME20'],
-        aliases=['County:'],
-        style='font-size: 12px; font-weight: bold;'
-    )
-).add_to(county_layer)
-county_layer.add_to(m)
-
 # Major communities/municipalities with coordinates
 # Format: (name, lat, lon, type) - type: 'city', 'town', 'cdp', 'community'
-print("Adding community markers...")
 communities = [
     # Federal Facilities
     ("NIH (National Institutes of Health)", 39.0003, -77.1056, "federal"),
@@ -231,89 +159,82 @@ communities = [
     ("Cambridge", 38.5632, -76.0788, "city"),
 ]
 
-# Create a function to find which district a point is in
-from shapely.geometry import Point
-
-def get_district_for_point(lat, lon, districts_gdf):
-    point = Point(lon, lat)
-    for idx, row in districts_gdf.iterrows():
-        if row['geometry'].contains(point):
-            return int(row['District'])
-    return None
-
-# Add community markers layer
-community_layer = folium.FeatureGroup(name='Communities & Municipalities', show=True)
-
-for name, lat, lon, comm_type in communities:
-    district = get_district_for_point(lat, lon, districts_dissolved)
-
-    if district is None:
-        continue  # Skip if outside Maryland districts
-
-    color = district_colors.get(district, '#808080')
-
-    # Different icons for different types
-    if comm_type == 'federal':
-        icon = folium.Icon(color='green', icon='building', prefix='fa')
-        radius = 8
-    elif comm_type == 'city':
-        icon = folium.Icon(color='darkblue', icon='building', prefix='fa')
-        radius = 8
-    elif comm_type == 'town':
-        icon = folium.Icon(color='blue', icon='home', prefix='fa')
-        radius = 6
-    elif name == 'Leisure World':
-        icon = folium.Icon(color='red', icon='star', prefix='fa')
-        radius = 8
-    else:  # cdp or community
-        icon = None
-        radius = 5
-
-    # Create popup with district info
-    popup_html = f"""
-    <div style="font-family: Arial; min-width: 150px;">
-        <b style="font-size: 14px;">{name}</b><br>
-        <span style="color: {color}; font-weight: bold;">District {district}</span><br>
-        <span style="font-size: 11px; color: #666;">{comm_type.upper()}</span>
-    </div>
-    """
+# Legend
+legend_html = '''
+<div style="position: fixed; bottom: 50px; right: 50px; width: 150px;
+            border:2px solid grey; z-index:9999; font-size:14px;
+            background-color:white; padding: 10px; border-radius: 5px;">
+<b>Congressional Districts</b><br>
+'''
+for dist, color in sorted(district_colors.items()):
+    legend_html += f'<i style="background:{color};width:20px;height:12px;display:inline-block;margin-right:5px;"></i> District {dist}<br>'
+legend_html += '</div>'
 
-    if icon:
-        folium.Marker(
-            location=[lat, lon],
-            popup=folium.Popup(popup_html, max_width=200),
-            tooltip=f"{name} (District {district})",
-            icon=icon
-        ).add_to(community_layer)
-    else:
-        # Use circle marker for CDPs
-        folium.CircleMarker(
-            location=[lat, lon],
-            radius=radius,
-            color='#333',
-            fill=True,
-            fillColor=color,
-            fillOpacity=0.8,
-            weight=2,
-            popup=folium.Popup(popup_html, max_width=200),
-            tooltip=f"{name} (District {district})"
-        ).add_to(community_layer)
-
-community_layer.add_to(m)
-print(f"Added {len(communities)} community markers")
-
-# Add layer control
-folium.LayerControl(collapsed=False).add_to(m)
-Fullscreen().add_to(m)
-
-# Convert districts to JSON for JavaScript
-districts_json = districts_dissolved.to_json()
-
-# Get the map variable name from folium
-map_name = m.get_name()
-
-# Custom HTML/JS for address lookup using Census Bureau Geocoder
-address_lookup_html = f'''
+
+def load_base_layers(profile=None):
+    """Load everything that does not depend on the plan; shared by every plan of a batch."""
+    profile = profile or Profiler()
+
+    # Layers are read through the on-disk cache, already reprojected to WGS84
+    print("Loading census block shapefile...")
+    profile.lap('load blocks')
+    blocks = load_layer(BLOCKS_FILE, epsg=4326)
+    print(f"Loaded {len(blocks)} census blocks")
+
+    print("Loading VTD/precinct shapefile...")
+    profile.lap('load precincts')
+    precincts = load_layer(PRECINCTS_FILE, epsg=4326)
+    print(f"Loaded {len(precincts)} precincts")
+
+    print("Loading county boundaries...")
+    profile.lap('load counties')
+    counties = load_layer(COUNTIES_FILE, epsg=4326)
+    print(f"Loaded {len(counties)} counties")
+
+    # Block order, topology, block-to-VTD crosswalk, adjacency graph and point index are cached
+    # on disk; block tables are aligned to the block order here so plans never join on GEOIDs
+    profile.lap('topology')
+    topology = load_topology(blocks)
+    profile.lap('block order')
+    order = load_block_order(blocks)
+    profile.lap('crosswalk')
+    crosswalk = load_crosswalk(blocks, precincts)
+    base = {
+        'blocks': blocks,
+        'precincts': precincts,
+        'counties': counties,
+        'topology': topology,
+        'order': order,
+        'crosswalk': align_crosswalk(crosswalk, order),
+    }
+    profile.lap('adjacency')
+    base['adjacency'] = load_adjacency(blocks, topology)
+    profile.lap('block index')
+    base['block_index'] = ensure_block_index(blocks)
+    profile.lap('PL data')
+    pl_blocks = load_pl_blocks(PL_FILE) if os.path.exists(PL_FILE) else None
+    base['counts'] = block_counts(pl_blocks, order) if pl_blocks is not None else None
+    profile.lap('election model')
+    base['election'] = None
+    if os.path.exists(RETURNS_FILE):
+        base['election'] = ElectionModel(load_returns(RETURNS_FILE), block_weights(crosswalk, pl_blocks), order)
+    profile.lap('current plan')
+    base['current'] = ingest_assignment(CURRENT_PLAN_FILE, order).plan if os.path.exists(CURRENT_PLAN_FILE) else None
+    # Precinct and county geometry does not depend on the plan, so the precinct zoom levels
+    # are simplified and encoded once and each render only joins its district columns
+    base['precinct_levels'] = base['precinct_data'] = base['county_geojson'] = None
+    if not USE_VECTOR_TILES:
+        profile.lap('precinct levels')
+        base['precinct_levels'] = build_levels(precincts, PRECINCT_LEVELS)
+        base['precinct_data'] = encode_levels(base['precinct_levels'], ['NAME20'], OUTPUT_PRECISION, EMBED_TOPOJSON)
+        base['county_geojson'] = to_geojson(counties, ['NAME20'], OUTPUT_PRECISION)
+    profile.lap()
+    return base
+
+
+def address_lookup_html(map_name, district_index_json, plan_label='DKunes Submission'):
+    """Address search panel and click-to-find script for the map ``map_name``."""
+    return f'''
 <div id="address-panel" style="
     position: fixed;
     top: 10px;
@@ -327,7 +248,7 @@ address_lookup_html = f'''
     max-width: 420px;
 ">
     <h3 style="margin: 0 0 10px 0; color: #333;">Maryland Congressional Redistricting Proposal</h3>
-    <p style="margin: 0 0 10px 0; font-size: 12px; color: #666;">DKunes Submission</p>
+    <p style="margin: 0 0 10px 0; font-size: 12px; color: #666;">{plan_label}</p>
 
     <div style="margin-top: 15px; padding-top: 15px; border-top: 1px solid #ddd;">
         <label style="font-weight: bold; display: block; margin-bottom: 5px;">Find Your District:</label>
@@ -388,44 +309,15 @@ address_lookup_html = f'''
         }}
         console.log('Map ready');
 
-        var districtBoundaries = {districts_json};
+        var districtIndex = {district_index_json};
         var districtColors = {{
             1: '#e41a1c', 2: '#377eb8', 3: '#4daf4a', 4: '#984ea3',
             5: '#ff7f00', 6: '#ffff33', 7: '#a65628', 8: '#f781bf'
         }};
         var addressMarker = null;
 
-        // Point in polygon check
-        function pointInPolygon(point, polygon) {{
-            var x = point[0], y = point[1];
-            var inside = false;
-            for (var i = 0, j = polygon.length - 1; i < polygon.length; j = i++) {{
-                var xi = polygon[i][0], yi = polygon[i][1];
-                var xj = polygon[j][0], yj = polygon[j][1];
-                if (((yi > y) != (yj > y)) && (x < (xj - xi) * (y - yi) / (yj - yi) + xi)) {{
-                    inside = !inside;
-                }}
-            }}
-            return inside;
-        }}
-
-        function findDistrict(lng, lat) {{
-            var point = [lng, lat];
-            for (var i = 0; i < districtBoundaries.features.length; i++) {{
-                var feature = districtBoundaries.features[i];
-                var geom = feature.geometry;
-                var district = feature.properties.District;
-                if (geom.type === 'Polygon') {{
-                    if (pointInPolygon(point, geom.coordinates[0])) return district;
-                }} else if (geom.type === 'MultiPolygon') {{
-                    for (var j = 0; j < geom.coordinates.length; j++) {{
-                        if (pointInPolygon(point, geom.coordinates[j][0])) return district;
-                    }}
-                }}
-            }}
-            return null;
-        }}
-
+        // Grid pre-filter plus per-district edge bands (all rings, so holes are respected)
+{FIND_DISTRICT_JS}
         function showResult(lat, lng, displayName) {{
             var resultDiv = document.getElementById('result');
             var district = findDistrict(lng, lat);
@@ -565,34 +457,369 @@ address_lookup_html = f'''
 </script>
 '''
 
-# Add legend
-legend_html = '''
-<div style="position: fixed; bottom: 50px; right: 50px; width: 150px;
-            border:2px solid grey; z-index:9999; font-size:14px;
-            background-color:white; padding: 10px; border-radius: 5px;">
-<b>Congressional Districts</b><br>
-'''
-for dist, color in sorted(district_colors.items()):
-    legend_html += f'<i style="background:{color};width:20px;height:12px;display:inline-block;margin-right:5px;"></i> District {dist}<br>'
-legend_html += '</div>'
 
-m.get_root().html.add_child(folium.Element(address_lookup_html))
-m.get_root().html.add_child(folium.Element(legend_html))
-
-# Save the map
-output_file = "/Users/davidkunes/Desktop/redistricting_map/DKunes_Redistricting_Map.html"
-m.save(output_file)
-print(f"\nMap saved to: {output_file}")
-
-# Summary
-print("\n=== Summary Statistics ===")
-print(f"Total precincts: {len(precincts)}")
-for dist in sorted(districts_dissolved['District'].dropna().unique()):
-    block_count = len(districts_csv[districts_csv['District'] == dist])
-    precinct_count = len(precincts[precincts['District'] == dist])
-    print(f"District {int(dist)}: {block_count:,} blocks, {precinct_count} precincts")
-
-print(f"\nFeatures:")
-print("- Enter street address, city, and optional ZIP to search")
-print("- Click anywhere on the map to find that location's district")
-print("- Toggle precincts layer in the top-right control")
+def render_plan(base, assignment_file, output_dir=OUTPUT_DIR, plan_name='DKunes', profile=None, live_reload=None,
+                write_boundaries=True):
+    """
+    Render one plan from ``load_base_layers`` output: the map page, the district
+    GeoJSON/TopoJSON (unless ``write_boundaries`` is false) and the printed
+    summary, written to ``output_dir`` with ``plan_name`` as file prefix. Stage
+    timings go to ``profile`` (a new ``Profiler`` if omitted) and are written to
+    ``{plan_name}_profile.json``. With ``live_reload`` (the URL of a server-sent
+    events stream, see watch_map.py) the page reloads itself on every event.
+    Returns the headline numbers as a dict.
+    """
+    profile = profile or Profiler(plan_name, trace=PROFILE_ALLOCATIONS)
+    blocks, counties, topology, order = base['blocks'], base['counties'], base['topology'], base['order']
+    precincts = base['precincts'].copy()
+
+    # Stream and validate the assignment into a district array over the block order;
+    # layer_plan is the same plan in block layer order for the geometry-backed steps
+    print("\nLoading district assignments...")
+    profile.lap('ingest')
+    assignment = ingest_assignment(assignment_file, order)
+    plan = assignment.plan
+    layer_plan = order.to_layer(plan)
+    print_report(assignment.report)
+    print(f"Loaded {int((plan != NO_DISTRICT).sum())} district assignments")
+
+    # District polygons come from the shared-arc block topology rather than a polygon union:
+    # the exact arcs give the exact districts, and each boundary between two districts is
+    # simplified once per zoom level, so neighbouring districts stay gap-free. The exported
+    # boundaries and the page's click lookup use the finest level, the geometry shown when
+    # zoomed in
+    print("Creating district boundaries...")
+    profile.lap('boundaries')
+    lines, pairs = boundary_arcs(topology, layer_plan, 0)
+    districts_exact = arc_polygons(lines, pairs, blocks.crs)
+    district_levels = build_district_levels(lines, pairs, DISTRICT_LEVELS, blocks.crs)
+    districts_dissolved = district_levels[-1]['frame']
+
+    # Assign districts to precincts from the cached block-to-VTD crosswalk: each precinct's
+    # land-area share per district, majority district for display
+    print("Assigning districts to precincts...")
+    profile.lap('precinct shares')
+    precinct_split = precinct_districts(precinct_shares(base['crosswalk'], plan))
+    precinct_split = precinct_split.reindex(precincts['GEOID20'].values)
+    precincts['District'] = precinct_split['District'].values
+    precincts['Districts'] = precinct_split['Districts'].fillna('').values
+    split_count = int(precinct_split['Split'].fillna(False).astype(bool).sum())
+    print(f"Split precincts: {split_count} of {len(precincts)}")
+
+    print(f"\nCreating interactive map...")
+
+    # Create map
+    profile.lap('map layers')
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=8, tiles='CartoDB positron')
+
+    if USE_VECTOR_TILES:
+        print("Exporting vector tiles...")
+        profile.lap('vector tiles')
+        tile_sources = [
+            TileSource('districts', districts_exact, ['District'], 5, 12),
+            TileSource('precincts', precincts.assign(District=precincts['District'].astype('Int64')), ['NAME20', 'District', 'Districts'], 9, 13),
+            TileSource('counties', counties, ['NAME20'], 5, 12),
+        ]
+        if TILE_BLOCKS:
+            block_frame = blocks[['GEOID20', 'geometry']].assign(District=layer_plan)
+            tile_sources.append(TileSource('blocks', block_frame, ['GEOID20', 'District'], 12, 14))
+        tiles_written = export_tiles(tile_sources, os.path.join(output_dir, TILE_URL))
+        for layer_name, per_zoom in tiles_written.items():
+            print(f"  {layer_name}: {sum(per_zoom.values()):,} tiles")
+
+        colors_js = json.dumps(district_colors)
+        district_layer = tile_layer(
+            TILE_URL, 'districts',
+            f"function(p) {{ return {{fill: true, fillColor: {colors_js}[p.District] || '#808080', color: '#000000', weight: 2, fillOpacity: 0.6}}; }}",
+            'Congressional Districts', max_native_zoom=12,
+        )
+        TilePopup(['District'], ['District:']).add_to(district_layer)
+        district_layer.add_to(m)
+
+        precinct_layer = tile_layer(
+            TILE_URL, 'precincts',
+            f"function(p) {{ return {{fill: true, fillColor: {colors_js}[p.District] || '#808080', color: '#333333', weight: 1, fillOpacity: 0.4}}; }}",
+            'Voting Precincts', max_native_zoom=13, show=False,
+        )
+        TilePopup(['NAME20', 'District', 'Districts'], ['Precinct:', 'District:', 'Shares:']).add_to(precinct_layer)
+        precinct_layer.add_to(m)
+
+        county_layer = tile_layer(
+            TILE_URL, 'counties',
+            "function(p) { return {fill: false, color: '#000000', weight: 3, dashArray: '5, 5'}; }",
+            'County Boundaries', max_native_zoom=12,
+        )
+        TilePopup(['NAME20'], ['County:']).add_to(county_layer)
+        county_layer.add_to(m)
+    else:
+        print("Building zoom levels...")
+        profile.lap('zoom levels')
+        level_dir = os.path.join(output_dir, ZOOM_LEVEL_URL) if SPLIT_ZOOM_LEVELS else None
+        colors_js = json.dumps(district_colors)
+        precinct_levels = base['precinct_levels']
+        for label, levels in (('Districts', district_levels), ('Precincts', precinct_levels)):
+            print(f"  {label}: " + ', '.join(f"z{l['min']}-{l['max']} {l['vertices']:,} vertices" for l in levels))
+
+        # Add district layer
+        district_layer = MultiResolutionGeoJson(
+            district_levels,
+            f"function(f) {{ return {{fillColor: {colors_js}[f.properties.District] || '#808080', color: '#000000', weight: 2, fillOpacity: 0.6}}; }}",
+            fields=['District'], aliases=['District:'], name='Congressional Districts', show=True,
+            highlight={'fillColor': '#ffffff', 'color': '#000000', 'weight': 3, 'fillOpacity': 0.8},
+            level_dir=level_dir, level_url=ZOOM_LEVEL_URL, prefix=f'{plan_name}_',
+            precision=OUTPUT_PRECISION, topojson=EMBED_TOPOJSON,
+        )
+        district_layer.add_to(m)
+
+        # Add precinct layer
+        precinct_layer = MultiResolutionGeoJson(
+            precinct_levels,
+            f"function(f) {{ return {{fillColor: {colors_js}[f.properties.District] || '#808080', color: '#333333', weight: 1, fillOpacity: 0.4}}; }}",
+            fields=['NAME20', 'District', 'Districts'], aliases=['Precinct:', 'District:', 'Shares:'], name='Voting Precincts', show=False,
+            highlight={'fillColor': '#ffffff', 'color': '#000000', 'weight': 2, 'fillOpacity': 0.7},
+            level_dir=level_dir, level_url=ZOOM_LEVEL_URL, prefix=f'{plan_name}_',
+            precision=OUTPUT_PRECISION, topojson=EMBED_TOPOJSON, data=base['precinct_data'],
+            joined=precincts[['District', 'Districts']].astype({'District': 'Int64'}),
+        )
+        precinct_layer.add_to(m)
+
+        # Add county boundaries layer
+        print("Adding county boundaries...")
+        profile.lap('county layer')
+        county_layer = folium.FeatureGroup(name='County Boundaries', show=True)
+
+        def county_style(feature):
+            return {
+                'fillColor': 'transparent',
+                'fillOpacity': 0,
+                'color': '#000000',
+                'weight': 3,
+                'dashArray': '5, 5'
+            }
+
+        folium.GeoJson(
+            json.loads(base['county_geojson']),
+            style_function=county_style,
+            tooltip=folium.GeoJsonTooltip(
+                fields=['NAME20'],
+                aliases=['County:'],
+                style='font-size: 12px; font-weight: bold;'
+            )
+        ).add_to(county_layer)
+        county_layer.add_to(m)
+
+        print("Zoom level sizes:")
+        print_sizes({
+            f"{layer.layer_name} z{level['min']}-{level['max']}" + (' (file)' if level_dir and i else ''): size
+            for layer, levels in ((district_layer, district_levels), (precinct_layer, precinct_levels))
+            for i, (level, size) in enumerate(zip(levels, layer.sizes))
+        })
+
+    print("Adding community markers...")
+    # Resolve all community districts in one batched lookup against the raw census blocks,
+    # so markers near a boundary get the authoritative block-level district
+    profile.lap('community markers')
+    _, community_districts = base['block_index'].lookup(
+        [c[1] for c in communities], [c[2] for c in communities], layer_plan
+    )
+
+    # Add community markers layer
+    community_layer = folium.FeatureGroup(name='Communities & Municipalities', show=True)
+
+    for (name, lat, lon, comm_type), district in zip(communities, community_districts):
+        if district == NO_DISTRICT:
+            continue  # Skip if outside Maryland districts
+        district = int(district)
+
+        color = district_colors.get(district, '#808080')
+
+        # Different icons for different types
+        if comm_type == 'federal':
+            icon = folium.Icon(color='green', icon='building', prefix='fa')
+            radius = 8
+        elif comm_type == 'city':
+            icon = folium.Icon(color='darkblue', icon='building', prefix='fa')
+            radius = 8
+        elif comm_type == 'town':
+            icon = folium.Icon(color='blue', icon='home', prefix='fa')
+            radius = 6
+        elif name == 'Leisure World':
+            icon = folium.Icon(color='red', icon='star', prefix='fa')
+            radius = 8
+        else:  # cdp or community
+            icon = None
+            radius = 5
+
+        # Create popup with district info
+        popup_html = f"""
+        <div style="font-family: Arial; min-width: 150px;">
+            <b style="font-size: 14px;">{name}</b><br>
+            <span style="color: {color}; font-weight: bold;">District {district}</span><br>
+            <span style="font-size: 11px; color: #666;">{comm_type.upper()}</span>
+        </div>
+        """
+
+        if icon:
+            folium.Marker(
+                location=[lat, lon],
+                popup=folium.Popup(popup_html, max_width=200),
+                tooltip=f"{name} (District {district})",
+                icon=icon
+            ).add_to(community_layer)
+        else:
+            # Use circle marker for CDPs
+            folium.CircleMarker(
+                location=[lat, lon],
+                radius=radius,
+                color='#333',
+                fill=True,
+                fillColor=color,
+                fillOpacity=0.8,
+                weight=2,
+                popup=folium.Popup(popup_html, max_width=200),
+                tooltip=f"{name} (District {district})"
+            ).add_to(community_layer)
+
+    community_layer.add_to(m)
+    print(f"Added {len(communities)} community markers")
+
+    # Blocks moved relative to the current map, dissolved per from/to district pair
+    changes = None
+    if base['current'] is not None:
+        print("Comparing with the current map...")
+        profile.lap('changes')
+        changes = change_polygons(blocks, order, moved_blocks(base['current'], plan), base['counts'])
+        if changes.empty:
+            # Same plan as the current map; folium rejects a tooltip on a layer without features
+            print("No blocks moved")
+        else:
+            change_fields = [c for c in ('From', 'To', 'Blocks', 'Population') if c in changes.columns]
+            change_layer = folium.FeatureGroup(name='Changes from Current Map', show=False)
+            folium.GeoJson(
+                json.loads(to_geojson(changes, change_fields, OUTPUT_PRECISION)),
+                style_function=lambda f: {
+                    'fillColor': district_colors.get(f['properties']['To'], '#808080'),
+                    'color': district_colors.get(f['properties']['From'], '#808080'),
+                    'weight': 2, 'dashArray': '4, 4', 'fillOpacity': 0.7,
+                },
+                tooltip=folium.GeoJsonTooltip(
+                    fields=change_fields,
+                    aliases=['From district:', 'To district:', 'Blocks:', 'Population:'][:len(change_fields)],
+                ),
+            ).add_to(change_layer)
+            change_layer.add_to(m)
+
+    # Add layer control
+    profile.lap('map layers')
+    folium.LayerControl(collapsed=False).add_to(m)
+    Fullscreen().add_to(m)
+
+    # Precompute the grid/edge-band lookup index the page uses to resolve clicks and addresses
+    profile.lap('client index')
+    district_index_json = client_index_json(districts_dissolved)
+
+    m.get_root().html.add_child(folium.Element(address_lookup_html(m.get_name(), district_index_json, f'{plan_name} Submission')))
+    m.get_root().html.add_child(folium.Element(legend_html))
+    if live_reload:
+        m.get_root().html.add_child(folium.Element(
+            f"<script>new EventSource('{live_reload}').onmessage = function() {{ location.reload(); }};</script>"
+        ))
+
+    # Save the map (atomically, so a reloading browser never reads a partial page)
+    output_file = os.path.join(output_dir, f'{plan_name}_Redistricting_Map.html')
+    profile.lap('save map')
+    write_text(output_file, m.get_root().render())
+    print(f"\nMap saved to: {output_file}")
+
+    # Also save the district boundaries with only the District property
+    if write_boundaries:
+        geojson_file = os.path.join(output_dir, f'{plan_name}_Districts.geojson')
+        topojson_file = os.path.join(output_dir, f'{plan_name}_Districts.topojson')
+        profile.lap('write boundaries')
+        print("District boundary files:")
+        print_sizes({
+            geojson_file: write_text(geojson_file, to_geojson(districts_dissolved, ['District'], OUTPUT_PRECISION)),
+            topojson_file: write_text(topojson_file, to_topojson({'districts': (districts_dissolved, ['District'])})),
+        })
+
+    # Summary
+    print("\n=== Summary Statistics ===")
+    print(f"Total precincts: {len(precincts)}")
+    plan_blocks = pd.Series(plan[plan != NO_DISTRICT]).value_counts()
+    precinct_counts = precincts['District'].value_counts()
+    for dist in sorted(districts_dissolved['District'].dropna().unique()):
+        print(f"District {int(dist)}: {plan_blocks.get(dist, 0):,} blocks, {precinct_counts.get(dist, 0)} precincts")
+
+    # Contiguity from the cached block adjacency graph, compactness from the exact district polygons
+    print("\n=== Compactness & Contiguity ===")
+    profile.lap('plan metrics')
+    quality = plan_metrics(blocks, plan, order, districts_exact, adjacency=base['adjacency'])
+    print_plan_metrics(quality)
+    failures = plan_failures(quality)
+    for failure in failures:
+        print(f"Warning: {failure}")
+    summary = {
+        'plan': plan_name,
+        'Split precincts': split_count,
+        'Contiguous': not failures,
+        'Min Polsby-Popper': float(quality['Polsby-Popper'].min()),
+    }
+
+    if changes is not None:
+        print("\n=== Changes from Current Map ===")
+        print_diff(changes)
+        summary['Moved blocks'] = int(changes['Blocks'].sum())
+        if 'Population' in changes.columns:
+            summary['Moved population'] = int(changes['Population'].sum())
+
+    # Equal-population check from the PL 94-171 block counts, when available locally
+    if base['counts'] is not None:
+        print("\n=== Population ===")
+        profile.lap('tabulation')
+        population = tabulate(base['counts'], plan, districts=len(district_colors))
+        print_tabulation(population)
+        summary['Max deviation %'] = float(population['Deviation %'].abs().max())
+    else:
+        print(f"\nNo PL 94-171 data at {PL_FILE}; skipping population tabulation")
+
+    # Partisan metrics from precinct returns disaggregated to blocks through the crosswalk
+    if base['election'] is not None:
+        print("\n=== Partisan Metrics ===")
+        profile.lap('partisan')
+        votes, partisan = evaluate(base['election'], plan)
+        print_metrics(votes, partisan)
+        summary.update({k: partisan[k] for k in ('Dem seats', 'Efficiency gap', 'Mean-median', 'Partisan bias')})
+
+    profile.lap()
+    print("\n=== Timing ===")
+    profile_file = os.path.join(output_dir, f'{plan_name}_profile.json')
+    report = profile.write(profile_file)
+    baseline = load_report(PROFILE_BASELINE) if os.path.exists(PROFILE_BASELINE) else None
+    print_profile(report, baseline)
+    if baseline is not None:
+        for regression in compare_reports(report, baseline):
+            print(f"Warning: slower than baseline: {regression}")
+    print(f"Profile saved to: {profile_file}")
+
+    print(f"\nFeatures:")
+    print("- Enter street address, city, and optional ZIP to search")
+    print("- Click anywhere on the map to find that location's district")
+    print("- Toggle precincts layer in the top-right control")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignment', nargs='?', default=ASSIGNMENT_FILE, help="assignment CSV (GEOID20, District)")
+    parser.add_argument('-o', '--output', default=OUTPUT_DIR, help="output directory")
+    parser.add_argument('--plan-name', default='DKunes', help="file prefix of the outputs")
+    parser.add_argument('--trace', action='store_true', default=PROFILE_ALLOCATIONS,
+                        help="profile allocations with tracemalloc (slow)")
+    args = parser.parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+    profile = Profiler(trace=args.trace)
+    render_plan(load_base_layers(profile), args.assignment, args.output, args.plan_name, profile=profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Block-to-precinct (VTD) crosswalk and per-precinct district shares.
+
+Census blocks nest in 2020 VTDs, so every block belongs to exactly one precinct.
+The crosswalk is computed once from the block internal points (INTPTLAT20 /
+INTPTLON20) and cached. Aligned to the canonical block order (block_order.py)
+with the precinct as an integer code, a plan's precinct district shares are a
+bincount over the plan array, weighted by block land area, with no geometry
+work and no string joins.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from block_order import NO_DISTRICT
+from layer_cache import CACHE_DIR, blocks_key
+
+CROSSWALK_VERSION = 1
+
+NO_PRECINCT = ''
+
+
+def _internal_points(blocks):
+    """Census internal point of every block, or a point on its surface where it is missing or off the block."""
+    geoms = blocks.geometry.values
+    if {'INTPTLON20', 'INTPTLAT20'} <= set(blocks.columns) and blocks.crs is not None and blocks.crs.to_epsg() == 4326:
+        x = pd.to_numeric(blocks['INTPTLON20'], errors='coerce').values
+        y = pd.to_numeric(blocks['INTPTLAT20'], errors='coerce').values
+        points = shapely.points(x, y)
+        missing = ~shapely.intersects_xy(geoms, x, y)
+    else:
+        points = np.empty(len(blocks), dtype=object)
+        missing = np.ones(len(blocks), dtype=bool)
+    points[missing] = shapely.point_on_surface(geoms[missing])
+    return points
+
+
+def build_crosswalk(blocks, precincts):
+    """
+    Precinct of every block.
+
+    Returns a DataFrame with the block ``GEOID20``, its precinct ``VTD`` (the
+    VTD GEOID20, ``NO_PRECINCT`` if none) and its land area ``ALAND20``.
+    """
+    points = _internal_points(blocks)
+    vtd_geoms = precincts.geometry.values
+    tree = shapely.STRtree(vtd_geoms)
+    point_idx, vtd_idx = tree.query(points, predicate='intersects')
+
+    vtd = np.full(len(blocks), -1, dtype=np.int64)
+    # A point on a shared VTD edge intersects both; keep the lowest VTD index
+    vtd[point_idx[::-1]] = vtd_idx[::-1]
+    unmatched = np.flatnonzero(vtd == -1)
+    if len(unmatched):
+        near_point, near_vtd = tree.query_nearest(points[unmatched], return_distance=False)
+        vtd[unmatched[near_point]] = near_vtd
+
+    vtd_geoids = np.asarray(precincts['GEOID20'].values, dtype=object)
+    aland = blocks['ALAND20'] if 'ALAND20' in blocks.columns else pd.Series(0, index=blocks.index)
+    return pd.DataFrame({
+        'GEOID20': blocks['GEOID20'].values,
+        'VTD': np.where(vtd >= 0, vtd_geoids[np.maximum(vtd, 0)], NO_PRECINCT),
+        'ALAND20': pd.to_numeric(aland, errors='coerce').fillna(0).astype(np.int64).values,
+    })
+
+
+def load_crosswalk(blocks, precincts, cache_dir=CACHE_DIR, name='blocks', refresh=False):
+    """Return the block-to-VTD crosswalk, building and caching it on first use."""
+    path = os.path.join(cache_dir, f'{name}.crosswalk.parquet')
+    meta_path = path[:-len('.parquet')] + '.json'
+    key = {'version': CROSSWALK_VERSION, 'blocks': blocks_key(blocks), 'precincts': blocks_key(precincts)}
+    if not refresh:
+        try:
+            with open(meta_path) as f:
+                if json.load(f) == key:
+                    return pd.read_parquet(path)
+        except (OSError, ValueError):
+            pass
+
+    crosswalk = build_crosswalk(blocks, precincts)
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    crosswalk.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(key, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return crosswalk
+
+
+def align_crosswalk(crosswalk, order):
+    """
+    ``crosswalk`` in the canonical ``order``: ``VTD`` as a categorical (code -1
+    for blocks in no precinct) and ``ALAND20``.
+    """
+    aligned = order.align(crosswalk[['GEOID20', 'ALAND20']])
+    vtd = order.align(crosswalk[['GEOID20', 'VTD']], fill=NO_PRECINCT)['VTD']
+    aligned['VTD'] = pd.Categorical(vtd.where(vtd != NO_PRECINCT))
+    return aligned
+
+
+def precinct_shares(aligned, plan, weight='ALAND20'):
+    """
+    Share of every precinct in every district it touches.
+
+    ``aligned`` is the ``align_crosswalk`` table of the block order of ``plan``.
+    Returns one row per (VTD, District) with the summed ``weight``, the block
+    count and ``Share`` of the precinct's total weight. Precincts with no
+    weight (all-water blocks) are shared by block count instead.
+    """
+    codes = aligned['VTD'].cat.codes.values.astype(np.int64)
+    keep = (codes >= 0) & (plan != NO_DISTRICT)
+    span = max(int(plan.max()), 0) + 1
+    pairs, inverse = np.unique(codes[keep] * span + plan[keep], return_inverse=True)
+    vtd, district = pairs // span, pairs % span
+    weights = np.bincount(inverse, weights=aligned[weight].values[keep], minlength=len(pairs))
+    blocks = np.bincount(inverse, minlength=len(pairs))
+
+    total_weight = np.bincount(vtd, weights=weights)[vtd]
+    total_blocks = np.bincount(vtd, weights=blocks)[vtd]
+    share = np.where(total_weight > 0, weights / np.where(total_weight > 0, total_weight, 1), blocks / total_blocks)
+    rank = np.lexsort((district, -share, vtd))
+    return pd.DataFrame({
+        'VTD': np.asarray(aligned['VTD'].cat.categories)[vtd[rank]],
+        'District': district[rank].astype(int),
+        'Weight': weights[rank].astype(np.int64),
+        'Blocks': blocks[rank],
+        'Share': share[rank],
+    })
+
+
+def precinct_districts(shares):
+    """
+    One row per precinct: majority ``District``, its ``Share``, whether the
+    precinct is ``Split`` and a ``Districts`` label such as ``"3 (62%), 7 (38%)"``.
+    """
+    first = shares.drop_duplicates('VTD', keep='first').set_index('VTD')
+    label = shares.assign(Label=shares['District'].astype(str) + ' (' + (shares['Share'] * 100).round().astype(int).astype(str) + '%)')
+    return pd.DataFrame({
+        'District': first['District'],
+        'Share': first['Share'],
+        'Split': shares.groupby('VTD').size() > 1,
+        'Districts': label.groupby('VTD', sort=False)['Label'].agg(', '.join),
+    })
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+ReCom ensembles of districting plans for outlier analysis of a submitted plan.
+
+A ReCom (recombination) step merges two adjacent districts, draws a random
+spanning tree of their units and cuts one tree edge that leaves both sides
+within the population tolerance, giving two new districts. Chains start from
+the submitted assignment, so the ensemble shows where that plan's partisan and
+compactness scores fall among plans drawn under the same constraints.
+
+Units are precinct pieces by default (the blocks of one VTD in one district of
+the submitted plan, so the starting plan is exactly representable), or single
+blocks with ``--units blocks``. The unit graph is a CSR array built from the
+cached block adjacency (plan_metrics.py); units outside its largest connected
+piece (islands) keep their district and only count in the totals.
+
+A step updates only the two recombined districts: their population and votes
+come from the subtree sums of the spanning tree, and the cut-edge counts
+between district pairs (which pick the next pair, the same as drawing a
+uniformly random cut edge) are patched from the edges of the merged region.
+Scores per step are the seats, efficiency gap, mean-median and partisan bias of
+partisan.py, the number of cut edges (the usual graph compactness measure), the
+largest population deviation and the sorted Democratic shares.
+
+Chains run in forked processes, checkpoint every ``--checkpoint`` steps (a
+rerun resumes them) and write their steps to ``chain_<n>.parquet``; the summary
+ranks the submitted plan in the pooled ensemble.
+
+Needs scipy.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from assignment_ingest import ingest_assignment
+from block_order import NO_DISTRICT, load_block_order
+from crosswalk import align_crosswalk, load_crosswalk
+from layer_cache import load_layer
+from partisan import ElectionModel, block_weights, load_returns, vote_metrics
+from plan_metrics import load_adjacency
+from tabulation import block_counts, load_pl_blocks
+
+ENSEMBLE_VERSION = 1
+
+EPSILON = 0.01  # allowed deviation of a district from the ideal population
+TREE_TRIES = 10  # spanning trees drawn per step before the step is rejected
+CHECKPOINT_EVERY = 1000
+
+SCORES = ['Dem seats', 'Efficiency gap', 'Mean-median', 'Partisan bias', 'Cut edges', 'Max deviation']
+
+# Set in the parent before forking; chain processes read it from their inherited memory
+_ENSEMBLE = None
+
+
+def _edge_slots(indptr, nodes):
+    """Positions of the edges of ``nodes`` in a CSR ``indices`` array, and the index into ``nodes`` of each."""
+    starts = indptr[nodes]
+    degree = indptr[nodes + 1] - starts
+    owner = np.repeat(np.arange(len(nodes)), degree)
+    slots = np.arange(degree.sum()) + np.repeat(starts - np.cumsum(degree) + degree, degree)
+    return slots, owner
+
+
+def build_units(plan, aligned, units='precincts'):
+    """
+    Unit of every canonical block position (-1 where unassigned) and the
+    district of every unit in ``plan``.
+    """
+    assigned = plan != NO_DISTRICT
+    if units == 'blocks':
+        keys = np.arange(len(plan), dtype=np.int64)
+    else:
+        codes = aligned['VTD'].cat.codes.values.astype(np.int64)
+        span = int(plan.max()) + 1
+        # Blocks in no precinct are units of their own
+        keys = np.where(codes >= 0, codes * span + plan, -1 - np.arange(len(plan)))
+    ids, inverse = np.unique(keys[assigned], return_inverse=True)
+    block_units = np.full(len(plan), -1, dtype=np.int64)
+    block_units[assigned] = inverse
+    unit_district = np.empty(len(ids), dtype=plan.dtype)
+    unit_district[inverse] = plan[assigned]
+    return block_units, unit_district
+
+
+def unit_graph(adjacency, layer_units, n_units):
+    """Unit adjacency as CSR (``indptr``, ``indices``) from the block adjacency and the unit of every layer row."""
+    indptr, indices = adjacency['indptr'], adjacency['indices']
+    src = layer_units[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))]
+    dst = layer_units[indices]
+    keep = (src >= 0) & (dst >= 0) & (src != dst)
+    pairs = np.unique(np.column_stack([src[keep], dst[keep]]), axis=0)
+    indptr = np.r_[0, np.cumsum(np.bincount(pairs[:, 0], minlength=n_units))].astype(np.int64)
+    return indptr, pairs[:, 1].astype(np.int32)
+
+
+class Ensemble:
+    """Unit graph, unit tallies and starting plan shared by the chains of one ensemble."""
+
+    def __init__(self, adjacency, order, plan, aligned, counts, model, units='precincts', epsilon=EPSILON):
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        block_units, unit_district = build_units(plan, aligned, units)
+        n = len(unit_district)
+        assigned = block_units >= 0
+        pop, dem, rep = (
+            np.bincount(block_units[assigned], weights=np.asarray(values, dtype=float)[assigned], minlength=n)
+            for values in (counts['Population'].values, model.dem, model.rep)
+        )
+        indptr, indices = unit_graph(adjacency, order.to_layer(block_units), n)
+
+        # Units outside the largest connected piece of the graph (islands) never move
+        graph = csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr), shape=(n, n))
+        _, labels = connected_components(graph, directed=False)
+        movable = labels == np.bincount(labels).argmax()
+        index = np.full(n, -1, dtype=np.int64)
+        index[movable] = np.arange(movable.sum())
+        src = np.repeat(np.arange(n), np.diff(indptr))
+        keep = movable[src]
+
+        self.units = units
+        self.districts = np.unique(unit_district)
+        district = np.searchsorted(self.districts, unit_district).astype(np.int8)
+        k = len(self.districts)
+        self.indptr = np.r_[0, np.cumsum(np.bincount(index[src[keep]], minlength=movable.sum()))].astype(np.int64)
+        self.indices = index[indices[keep]].astype(np.int32)
+        self.unit_tallies = np.vstack([pop[movable], dem[movable], rep[movable]])
+        self.frozen = np.vstack([np.bincount(district[~movable], weights=v[~movable], minlength=k) for v in (pop, dem, rep)])
+        self.frozen_units = int((~movable).sum())
+        self.start = district[movable]
+        self.ideal = pop.sum() / k
+        self.bounds = (self.ideal * (1 - epsilon), self.ideal * (1 + epsilon))
+        self.epsilon = epsilon
+
+    def __len__(self):
+        return len(self.start)
+
+
+class ReComChain:
+    """One ReCom Markov chain over an ``Ensemble``, keeping per-district tallies and pair cut counts."""
+
+    def __init__(self, ensemble, assignment, rng):
+        self.ensemble = ensemble
+        self.assignment = assignment.copy()
+        self.rng = rng
+        k = len(ensemble.districts)
+        self.tallies = ensemble.frozen + np.vstack([
+            np.bincount(self.assignment, weights=values, minlength=k) for values in ensemble.unit_tallies
+        ])
+        src = np.repeat(np.arange(len(ensemble)), np.diff(ensemble.indptr))
+        once = src < ensemble.indices
+        self.pair_cuts = np.zeros((k, k), dtype=np.int64)
+        self._count_cuts(src[once], ensemble.indices[once], 1)
+
+    def _count_cuts(self, src, dst, sign):
+        a, b = self.assignment[src], self.assignment[dst]
+        cut = a != b
+        np.add.at(self.pair_cuts, (a[cut], b[cut]), sign)
+        np.add.at(self.pair_cuts, (b[cut], a[cut]), sign)
+
+    def _balanced_cut(self, n, src, dst, pop, bounds_a, bounds_b):
+        """
+        Subtree of a random spanning tree of the merged region whose removal
+        leaves both sides within bounds: returns (local members of the
+        subtree, whether the subtree goes to the first district), or None.
+        """
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import depth_first_order, minimum_spanning_tree
+
+        # Random weights give a random spanning tree; zero weights would drop the edge
+        weights = self.rng.random(len(src)) + 1
+        tree = minimum_spanning_tree(csr_matrix((weights, (src, dst)), shape=(n, n)))
+        root = int(self.rng.integers(n))
+        preorder, parent = depth_first_order(tree, root, directed=False, return_predecessors=True)
+        if len(preorder) < n:
+            return None
+
+        subtree, size, parent = pop.tolist(), [1] * n, parent.tolist()
+        for node in reversed(preorder[1:].tolist()):
+            subtree[parent[node]] += subtree[node]
+            size[parent[node]] += size[node]
+        subtree = np.array(subtree)
+        rest = pop.sum() - subtree
+        (lo_a, hi_a), (lo_b, hi_b) = bounds_a, bounds_b
+        to_a = (subtree >= lo_a) & (subtree <= hi_a) & (rest >= lo_b) & (rest <= hi_b)
+        to_b = (subtree >= lo_b) & (subtree <= hi_b) & (rest >= lo_a) & (rest <= hi_a)
+        to_a[root] = to_b[root] = False
+        options = np.r_[np.flatnonzero(to_a), -1 - np.flatnonzero(to_b)]
+        if not len(options):
+            return None
+        pick = options[self.rng.integers(len(options))]
+        node = pick if pick >= 0 else -1 - pick
+        # Subtrees are contiguous runs of the depth-first preorder
+        position = np.empty(n, dtype=np.int64)
+        position[preorder] = np.arange(n)
+        return preorder[position[node]:position[node] + size[node]], pick >= 0
+
+    def step(self):
+        """Propose one recombination; returns False if it was rejected (the plan is unchanged)."""
+        ensemble = self.ensemble
+        a_idx, b_idx = np.nonzero(np.triu(self.pair_cuts))
+        cuts = self.pair_cuts[a_idx, b_idx]
+        pick = self.rng.choice(len(cuts), p=cuts / cuts.sum())
+        a, b = int(a_idx[pick]), int(b_idx[pick])
+
+        nodes = np.flatnonzero((self.assignment == a) | (self.assignment == b))
+        local = np.full(len(ensemble), -1, dtype=np.int64)
+        local[nodes] = np.arange(len(nodes))
+        slots, owner = _edge_slots(ensemble.indptr, nodes)
+        neighbours = ensemble.indices[slots]
+        inner = local[neighbours]
+        internal = inner > owner
+
+        lo, hi = ensemble.bounds
+        frozen = ensemble.frozen[0]
+        bounds_a = (lo - frozen[a], hi - frozen[a])
+        bounds_b = (lo - frozen[b], hi - frozen[b])
+        pop = ensemble.unit_tallies[0][nodes]
+        for _ in range(TREE_TRIES):
+            cut = self._balanced_cut(len(nodes), owner[internal], inner[internal], pop, bounds_a, bounds_b)
+            if cut is not None:
+                break
+        else:
+            return False
+        members, subtree_to_a = cut
+        first, second = (a, b) if subtree_to_a else (b, a)
+
+        # Edges touching the region, each once: re-count their cuts around the reassignment
+        touching = (inner < 0) | internal
+        src, dst = nodes[owner[touching]], neighbours[touching]
+        self._count_cuts(src, dst, -1)
+        self.assignment[nodes] = second
+        self.assignment[nodes[members]] = first
+        self._count_cuts(src, dst, 1)
+
+        for row, values in enumerate(ensemble.unit_tallies):
+            moved = values[nodes[members]].sum()
+            self.tallies[row, first] = ensemble.frozen[row, first] + moved
+            self.tallies[row, second] = ensemble.frozen[row, second] + values[nodes].sum() - moved
+        return True
+
+    def scores(self):
+        """``SCORES`` of the current plan followed by its sorted Democratic shares."""
+        pop, dem, rep = self.tallies
+        metrics = vote_metrics(dem, rep)
+        return [
+            metrics['Dem seats'], metrics['Efficiency gap'], metrics['Mean-median'], metrics['Partisan bias'],
+            self.pair_cuts.sum() // 2, np.abs(pop / self.ensemble.ideal - 1).max(),
+        ] + sorted(dem / (dem + rep))
+
+
+def score_columns(ensemble):
+    return ['step', 'accepted'] + SCORES + [f'Share {i + 1}' for i in range(len(ensemble.districts))]
+
+
+def _chain_meta(ensemble, seed, index):
+    return {
+        'version': ENSEMBLE_VERSION, 'seed': seed, 'chain': index, 'units': ensemble.units,
+        'epsilon': ensemble.epsilon, 'start': hashlib.sha1(ensemble.start.tobytes()).hexdigest(),
+    }
+
+
+def _write_chain(base, meta, chain, rows, done):
+    frame = pd.DataFrame(rows[:done + 1], columns=score_columns(chain.ensemble))
+    frame = frame.astype({'step': np.int32, 'accepted': bool, 'Dem seats': np.int8, 'Cut edges': np.int32})
+    frame = frame.astype({c: np.float32 for c in frame.columns if frame[c].dtype == np.float64})
+    frame.to_parquet(base + '.parquet.tmp', index=False)
+    os.replace(base + '.parquet.tmp', base + '.parquet')
+    np.savez(base + '.checkpoint.tmp.npz', meta=json.dumps(meta), assignment=chain.assignment,
+             rng=json.dumps(chain.rng.bit_generator.state), done=done)
+    os.replace(base + '.checkpoint.tmp.npz', base + '.checkpoint.npz')
+
+
+def _resume(base, meta, ensemble, steps):
+    """Chain, score rows and completed steps from the checkpoint at ``base``, or None if there is no usable one."""
+    path = base + '.checkpoint.npz'
+    if not os.path.exists(path) or not os.path.exists(base + '.parquet'):
+        return None
+    with np.load(path) as data:
+        if json.loads(str(data['meta'])) != meta:
+            return None
+        rng = np.random.default_rng()
+        rng.bit_generator.state = json.loads(str(data['rng']))
+        chain = ReComChain(ensemble, data['assignment'], rng)
+        done = int(data['done'])
+    frame = pd.read_parquet(base + '.parquet')
+    rows = np.zeros((max(steps, done) + 1, len(frame.columns)))
+    rows[:done + 1] = frame.values[:done + 1]
+    return chain, rows, done
+
+
+def run_chain(task):
+    """Run (or resume) one chain to ``steps`` steps; returns its index, accepted steps and seconds."""
+    index, steps, seed, out_dir, checkpoint = task
+    ensemble = _ENSEMBLE
+    base = os.path.join(out_dir, f'chain_{index:02d}')
+    meta = _chain_meta(ensemble, seed, index)
+    start = time.perf_counter()
+    resumed = _resume(base, meta, ensemble, steps)
+    if resumed is None:
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+        chain = ReComChain(ensemble, ensemble.start, rng)
+        rows = np.zeros((steps + 1, len(score_columns(ensemble))))
+        rows[0] = [0, True] + chain.scores()
+        done = 0
+    else:
+        chain, rows, done = resumed
+
+    while done < steps:
+        accepted = chain.step()
+        done += 1
+        rows[done] = [done, accepted] + chain.scores()
+        if done % checkpoint == 0 or done == steps:
+            _write_chain(base, meta, chain, rows, done)
+    return index, int(rows[1:steps + 1, 1].sum()), time.perf_counter() - start
+
+
+def load_chains(out_dir, chains):
+    """Steps of all chains as one DataFrame with a ``chain`` column."""
+    return pd.concat([
+        pd.read_parquet(os.path.join(out_dir, f'chain_{i:02d}.parquet')).assign(chain=i) for i in range(chains)
+    ], ignore_index=True)
+
+
+def summarize(steps, burn_in=0):
+    """
+    Distribution of every score over the pooled ensemble (steps after
+    ``burn_in`` of every chain) and the percentile of the submitted plan, which
+    is step 0 of every chain. Ties count half, so a plan in the middle of a run
+    of equal seat counts is at the 50th percentile of that run.
+    """
+    submitted = steps[steps['step'] == 0].iloc[0]
+    pool = steps[steps['step'] > burn_in]
+    rows = []
+    for column in [c for c in steps.columns if c in SCORES or c.startswith('Share ')]:
+        values = pool[column].values
+        value = submitted[column]
+        rows.append({
+            'Score': column, 'Submitted': value, 'Mean': values.mean(),
+            'P5': np.quantile(values, 0.05), 'Median': np.median(values), 'P95': np.quantile(values, 0.95),
+            'Percentile': ((values < value).sum() + (values == value).sum() / 2) / len(values) * 100,
+        })
+    return pd.DataFrame(rows)
+
+
+def run(args):
+    global _ENSEMBLE
+    blocks = load_layer(args.blocks, epsg=4326)
+    precincts = load_layer(args.precincts, epsg=4326)
+    order = load_block_order(blocks)
+    pl_blocks = load_pl_blocks(args.pl)
+    crosswalk = load_crosswalk(blocks, precincts)
+    model = ElectionModel(load_returns(args.returns), block_weights(crosswalk, pl_blocks), order)
+    plan = ingest_assignment(args.assignment, order).plan
+    _ENSEMBLE = ensemble = Ensemble(
+        load_adjacency(blocks), order, plan, align_crosswalk(crosswalk, order), block_counts(pl_blocks, order),
+        model, args.units, args.epsilon,
+    )
+    print(f"{len(ensemble):,} {args.units} units in {len(ensemble.districts)} districts "
+          f"({ensemble.frozen_units:,} islands fixed), ideal population {ensemble.ideal:,.0f}")
+    deviation = np.abs(ReComChain(ensemble, ensemble.start, None).tallies[0] / ensemble.ideal - 1).max()
+    if deviation > args.epsilon:
+        print(f"Warning: the submitted plan deviates {deviation * 100:.2f}% from the ideal population, "
+              f"more than --epsilon {args.epsilon * 100:.2f}%")
+
+    os.makedirs(args.output, exist_ok=True)
+    tasks = [(i, args.steps, args.seed, args.output, args.checkpoint) for i in range(args.chains)]
+    workers = min(args.workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        print("fork is not available on this platform; running chains serially")
+        workers = 1
+    print(f"\nRunning {len(tasks)} chain(s) of {args.steps:,} steps with {workers} worker(s)...")
+
+    if workers == 1:
+        results = map(run_chain, tasks)
+    else:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        results = pool.imap_unordered(run_chain, tasks)
+    try:
+        for index, accepted, seconds in results:
+            print(f"  chain {index}: {accepted:,} of {args.steps:,} steps accepted ({seconds:.1f}s)")
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    summary = summarize(load_chains(args.output, args.chains), args.burn_in)
+    summary_file = os.path.join(args.output, 'summary.csv')
+    summary.to_csv(summary_file, index=False)
+    print()
+    print(summary.to_string(index=False, float_format=lambda v: f'{v:.4f}'))
+    print(f"Summary saved to: {summary_file}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignment', help="assignment CSV (GEOID20, District) the chains start from")
+    parser.add_argument('--returns', required=True, help="precinct election returns CSV")
+    parser.add_argument('--pl', required=True, help="PL 94-171 block data (see tabulation.py)")
+    parser.add_argument('--blocks', default="tl_2020_24_tabblock20.shp")
+    parser.add_argument('--precincts', default="tl_2020_24_vtd20.shp")
+    parser.add_argument('-o', '--output', required=True, help="output directory for the chains and summary")
+    parser.add_argument('--units', choices=['precincts', 'blocks'], default='precincts', help="graph nodes")
+    parser.add_argument('--chains', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--steps', type=int, default=10000, help="steps per chain")
+    parser.add_argument('--burn-in', type=int, default=0, help="steps of every chain left out of the summary")
+    parser.add_argument('--epsilon', type=float, default=EPSILON, help="allowed population deviation (fraction)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--checkpoint', type=int, default=CHECKPOINT_EVERY, help="steps between checkpoints")
+    parser.add_argument('-j', '--workers', type=int, help="worker processes (default: all cores)")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
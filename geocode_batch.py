@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Bulk address-to-district batch job.
+
+Reads a CSV of addresses in chunks, geocodes each chunk through a chain of
+backends, resolves the district of every coordinate with the block-level index
+and streams the results to an output CSV.
+
+Backends:
+- address points: local CSV/Parquet of address points (no network)
+- TIGER address ranges: local TIGER/Line ADDRFEAT shapefiles, interpolated
+  along the street segment (no network)
+- Census: the Census Bureau batch geocoder (network, 10,000 addresses per call)
+"""
+import argparse
+import io
+import os
+import sys
+import urllib.request
+import uuid
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from assignment_ingest import ingest_assignment, print_report
+from block_index import INDEX_DIR, BlockIndex, build_block_index, ensure_block_index, index_key
+from block_order import NO_DISTRICT
+from settings import ASSIGNMENT_FILE
+
+STREET_SUFFIXES = {
+    'STREET': 'ST', 'AVENUE': 'AVE', 'ROAD': 'RD', 'DRIVE': 'DR', 'LANE': 'LN',
+    'COURT': 'CT', 'PLACE': 'PL', 'BOULEVARD': 'BLVD', 'CIRCLE': 'CIR', 'TERRACE': 'TER',
+    'PARKWAY': 'PKWY', 'HIGHWAY': 'HWY', 'PIKE': 'PIKE', 'WAY': 'WAY', 'SQUARE': 'SQ',
+}
+DIRECTIONS = {
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+}
+ABBREVIATIONS = {**STREET_SUFFIXES, **DIRECTIONS}
+
+RESULT_COLUMNS = ['lat', 'lon', 'match_source', 'matched_address']
+
+
+def normalize_street(street):
+    """Upper-case, strip punctuation and abbreviate suffixes/directions of a Series of street names."""
+    street = street.fillna('').astype(str).str.upper().str.replace(r'[^\w\s]', ' ', regex=True)
+    tokens = street.str.split()
+    return tokens.map(lambda words: ' '.join(ABBREVIATIONS.get(w, w) for w in words))
+
+
+def split_house_number(street):
+    """Split normalized street lines into (house number, street name) Series."""
+    parts = street.str.extract(r'^(\d+)[A-Z]?\s+(.*)$')
+    return pd.to_numeric(parts[0], errors='coerce'), parts[1].fillna('')
+
+
+def normalize_frame(df, street_col, city_col, zip_col):
+    """Add normalized ``_street``, ``_number``, ``_name``, ``_city`` and ``_zip`` key columns."""
+    out = pd.DataFrame(index=df.index)
+    out['_street'] = normalize_street(df[street_col])
+    out['_number'], out['_name'] = split_house_number(out['_street'])
+    out['_city'] = (
+        df[city_col].fillna('').astype(str).str.upper().str.strip() if city_col in df else ''
+    )
+    out['_zip'] = (
+        df[zip_col].fillna('').astype(str).str.extract(r'(\d{5})')[0].fillna('') if zip_col in df else ''
+    )
+    return out
+
+
+def _empty_result(index):
+    result = pd.DataFrame(index=index, columns=RESULT_COLUMNS)
+    result[['lat', 'lon']] = np.nan
+    return result
+
+
+def _match_on_keys(keys, table, on_sets):
+    """Match ``keys`` to ``table`` trying each list of columns in ``on_sets`` in turn."""
+    result = _empty_result(keys.index)
+    for on in on_sets:
+        pending = keys[result['lat'].isna()]
+        usable = pending[(pending[on] != '').all(axis=1)]
+        if len(usable) == 0:
+            continue
+        matched = usable[on].reset_index().merge(table, on=on, how='inner')
+        matched = matched.drop_duplicates('index').set_index('index')
+        result.loc[matched.index, RESULT_COLUMNS] = matched[RESULT_COLUMNS].values
+    return result
+
+
+class AddressPointGeocoder:
+    """
+    Exact match against a local address-point file.
+
+    The file needs ``street`` (full street line incl. house number), ``lat`` and
+    ``lon`` columns and optionally ``city`` and ``zip``.
+    """
+
+    name = 'address_points'
+
+    def __init__(self, path):
+        points = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path, dtype=str)
+        keys = normalize_frame(points, 'street', 'city', 'zip')
+        table = keys[['_street', '_city', '_zip']].copy()
+        table['lat'] = pd.to_numeric(points['lat'], errors='coerce')
+        table['lon'] = pd.to_numeric(points['lon'], errors='coerce')
+        table['match_source'] = self.name
+        table['matched_address'] = keys['_street'] + ', ' + keys['_city'] + ' ' + keys['_zip']
+        self.table = table.dropna(subset=['lat', 'lon'])
+
+    def geocode(self, keys):
+        return _match_on_keys(keys, self.table, [['_street', '_zip'], ['_street', '_city']])
+
+
+class TigerRangeGeocoder:
+    """
+    Interpolate house numbers along TIGER/Line ADDRFEAT street segments.
+
+    Each segment carries left/right from/to house numbers and ZIP codes; a
+    number is matched to the segment side whose range (and parity) contains it
+    and placed at the proportional distance along the segment.
+    """
+
+    name = 'tiger_ranges'
+
+    def __init__(self, paths):
+        import geopandas as gpd
+
+        frames = [gpd.read_file(p).to_crs(epsg=4326) for p in paths]
+        features = pd.concat(frames, ignore_index=True)
+        features['_name'] = normalize_street(features['FULLNAME'])
+        sides = []
+        for side in ('L', 'R'):
+            part = pd.DataFrame({
+                '_name': features['_name'],
+                '_zip': features[f'ZIP{side}'].fillna('').astype(str),
+                'from_hn': pd.to_numeric(features[f'{side}FROMHN'], errors='coerce'),
+                'to_hn': pd.to_numeric(features[f'{side}TOHN'], errors='coerce'),
+                'segment': np.arange(len(features)),
+            })
+            sides.append(part.dropna(subset=['from_hn', 'to_hn']))
+        self.ranges = pd.concat(sides, ignore_index=True)
+        self.geometry = np.asarray(features.geometry.values, dtype=object)
+
+    def geocode(self, keys):
+        result = _empty_result(keys.index)
+        pending = keys.dropna(subset=['_number'])
+        pending = pending[pending['_name'] != '']
+        if len(pending) == 0:
+            return result
+        candidates = pending[['_number', '_name', '_zip']].reset_index().merge(self.ranges, on='_name')
+        # Restrict to the requested ZIP when one was given
+        zip_ok = (candidates['_zip_x'] == '') | (candidates['_zip_x'] == candidates['_zip_y'])
+        lo = np.minimum(candidates['from_hn'], candidates['to_hn'])
+        hi = np.maximum(candidates['from_hn'], candidates['to_hn'])
+        in_range = (candidates['_number'] >= lo) & (candidates['_number'] <= hi)
+        same_parity = (candidates['_number'] % 2) == (candidates['from_hn'] % 2)
+        candidates = candidates[zip_ok & in_range & same_parity].drop_duplicates('index')
+        if len(candidates) == 0:
+            return result
+
+        span = (candidates['to_hn'] - candidates['from_hn']).replace(0, np.nan)
+        fraction = ((candidates['_number'] - candidates['from_hn']) / span).fillna(0.5).clip(0, 1)
+        points = shapely.line_interpolate_point(
+            self.geometry[candidates['segment'].values], fraction.values, normalized=True
+        )
+        idx = candidates['index'].values
+        result.loc[idx, 'lon'] = shapely.get_x(points)
+        result.loc[idx, 'lat'] = shapely.get_y(points)
+        result.loc[idx, 'match_source'] = self.name
+        result.loc[idx, 'matched_address'] = (
+            candidates['_number'].astype(int).astype(str) + ' ' + candidates['_name'] + ' ' + candidates['_zip_y']
+        ).values
+        return result
+
+
+class CensusGeocoder:
+    """Census Bureau batch geocoder (up to 10,000 addresses per request)."""
+
+    name = 'census'
+    url = 'https://geocoding.geo.census.gov/geocoder/locations/addressbatch'
+    batch_size = 10_000
+
+    def __init__(self, state='MD', benchmark='Public_AR_Current', timeout=600):
+        self.state = state
+        self.benchmark = benchmark
+        self.timeout = timeout
+
+    def _post(self, csv_text):
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="benchmark"\r\n\r\n{self.benchmark}\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="addressFile"; filename="addresses.csv"\r\n'
+            f'Content-Type: text/csv\r\n\r\n{csv_text}\r\n--{boundary}--\r\n'
+        ).encode()
+        request = urllib.request.Request(
+            self.url, data=body, headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read().decode('utf-8', errors='replace')
+
+    def geocode(self, keys):
+        result = _empty_result(keys.index)
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys.iloc[start:start + self.batch_size]
+            request = pd.DataFrame({
+                'id': batch.index, 'street': batch['_street'], 'city': batch['_city'],
+                'state': self.state, 'zip': batch['_zip'],
+            })
+            text = self._post(request.to_csv(index=False, header=False))
+            response = pd.read_csv(
+                io.StringIO(text), header=None, dtype=str,
+                names=['id', 'input', 'match', 'type', 'matched', 'coords', 'tlid', 'side'],
+            )
+            response = response[response['match'] == 'Match']
+            if response.empty:
+                continue
+            coords = response['coords'].str.split(',', expand=True)
+            idx = response['id'].astype(batch.index.dtype).values
+            result.loc[idx, 'lon'] = pd.to_numeric(coords[0]).values
+            result.loc[idx, 'lat'] = pd.to_numeric(coords[1]).values
+            result.loc[idx, 'match_source'] = self.name
+            result.loc[idx, 'matched_address'] = response['matched'].values
+        return result
+
+
+class ChainGeocoder:
+    """Try each backend in turn on the addresses the previous ones did not match."""
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def geocode(self, keys):
+        result = _empty_result(keys.index)
+        for backend in self.backends:
+            pending = result['lat'].isna()
+            if not pending.any():
+                break
+            found = backend.geocode(keys[pending])
+            found = found[found['lat'].notna()]
+            result.loc[found.index, RESULT_COLUMNS] = found[RESULT_COLUMNS].values
+        return result
+
+
+def run(args):
+    backends = []
+    if args.address_points:
+        backends.append(AddressPointGeocoder(args.address_points))
+    if args.tiger_ranges:
+        backends.append(TigerRangeGeocoder(args.tiger_ranges))
+    if args.census:
+        backends.append(CensusGeocoder(state=args.state))
+    if not backends:
+        sys.exit("No geocoder backend selected (use --address-points, --tiger-ranges and/or --census)")
+    geocoder = ChainGeocoder(backends)
+
+    print("Loading block index...")
+    if args.rebuild_index or index_key(args.index) is None:
+        from layer_cache import blocks_key, load_layer
+
+        blocks = load_layer(args.blocks, epsg=4326)
+        if args.rebuild_index:
+            build_block_index(blocks, args.index, key=blocks_key(blocks))
+            index = BlockIndex(args.index)
+        else:
+            index = ensure_block_index(blocks, args.index)
+    else:
+        index = BlockIndex(args.index)
+    order = index.block_order()
+    assignment = ingest_assignment(args.assignment, order)
+    print_report(assignment.report)
+    plan = order.to_layer(assignment.plan)
+
+    tmp = args.output + '.tmp'
+    total = matched = 0
+    reader = pd.read_csv(args.input, dtype=str, chunksize=args.chunk_size, keep_default_na=False)
+    for i, chunk in enumerate(reader):
+        keys = normalize_frame(chunk, args.street_col, args.city_col, args.zip_col)
+        located = geocoder.geocode(keys)
+        lat = located['lat'].astype(float).values
+        lon = located['lon'].astype(float).values
+        positions, districts = index.lookup(lat, lon, plan)
+
+        out = chunk.copy()
+        out[RESULT_COLUMNS] = located[RESULT_COLUMNS].values
+        out['GEOID20'] = index.geoid(positions)
+        out['District'] = pd.Series(districts, index=out.index, dtype='Int64').mask(districts == NO_DISTRICT)
+        out.to_csv(tmp, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+
+        total += len(chunk)
+        matched += int(out['District'].notna().sum())
+        print(f"  {total:,} addresses processed, {matched:,} assigned to a district")
+
+    os.replace(tmp, args.output)
+    print(f"\nResults saved to: {args.output}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help="CSV of addresses")
+    parser.add_argument('-o', '--output', required=True, help="output CSV")
+    parser.add_argument('--assignment', default=ASSIGNMENT_FILE,
+                        help="block assignment CSV (GEOID20, District) or Census block assignment file")
+    parser.add_argument('--blocks', default="tl_2020_24_tabblock20.shp", help="block shapefile for the index")
+    parser.add_argument('--index', default=INDEX_DIR, help="block index directory")
+    parser.add_argument('--rebuild-index', action='store_true', help="rebuild the block index first")
+    parser.add_argument('--address-points', help="local address point CSV/Parquet")
+    parser.add_argument('--tiger-ranges', nargs='+', help="TIGER/Line ADDRFEAT shapefiles")
+    parser.add_argument('--census', action='store_true', help="fall back to the Census batch geocoder")
+    parser.add_argument('--state', default='MD')
+    parser.add_argument('--street-col', default='street')
+    parser.add_argument('--city-col', default='city')
+    parser.add_argument('--zip-col', default='zip')
+    parser.add_argument('--chunk-size', type=int, default=10_000)
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Incremental dissolve of census blocks into district polygons.
+
+The plan (an int8 array over the canonical block order, see block_order.py)
+and the dissolved (unsimplified) district geometries of the last run are
+persisted in the cache directory. On the next run the new plan is compared
+with the stored one element-wise and only districts that gained or lost blocks
+are recomputed; untouched districts reuse their cached geometry.
+"""
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from block_order import NO_DISTRICT
+from layer_cache import CACHE_DIR, blocks_key
+
+STATE_VERSION = 2
+
+
+def _state_paths(cache_dir, name):
+    base = os.path.join(cache_dir, name)
+    return base + '.plan.npy', base + '.districts.arrow', base + '.state.json'
+
+
+def changed_districts(old, new):
+    """Return the set of districts that gained or lost at least one block."""
+    moved = old != new
+    affected = np.unique(np.r_[old[moved], new[moved]])
+    return {int(d) for d in affected if d != NO_DISTRICT}
+
+
+def _geometries(blocks, order, positions):
+    return np.asarray(blocks.geometry.values, dtype=object)[order.layer[positions]]
+
+
+def _dissolve(blocks, plan, order, districts):
+    rows = []
+    for dist in sorted(districts):
+        positions = np.flatnonzero(plan == dist)
+        if len(positions):
+            rows.append((dist, shapely.union_all(_geometries(blocks, order, positions))))
+    return gpd.GeoDataFrame(
+        {'District': [r[0] for r in rows]}, geometry=[r[1] for r in rows], crs=blocks.crs
+    )
+
+
+def _patch(cached, blocks, plan, previous, order, districts):
+    """Add/subtract the moved blocks from the cached geometry of each district."""
+    rows = []
+    for dist in sorted(districts):
+        gained = np.flatnonzero((plan == dist) & (previous != dist))
+        lost = np.flatnonzero((previous == dist) & (plan != dist))
+        current = cached.loc[cached['District'] == dist, 'geometry']
+        geom = current.iloc[0] if len(current) else shapely.Polygon()
+        if len(lost):
+            geom = shapely.difference(geom, shapely.union_all(_geometries(blocks, order, lost)))
+        if len(gained):
+            geom = shapely.union(geom, shapely.union_all(_geometries(blocks, order, gained)))
+        if not geom.is_empty:
+            rows.append((dist, geom))
+    return gpd.GeoDataFrame(
+        {'District': [r[0] for r in rows]}, geometry=[r[1] for r in rows], crs=blocks.crs
+    )
+
+
+def dissolve_districts(blocks, plan, order, cache_dir=CACHE_DIR, name='districts', method='redissolve'):
+    """
+    Dissolve ``blocks`` into one polygon per district of ``plan``.
+
+    ``plan`` is the district of every block in the canonical ``order`` of
+    ``blocks`` (``NO_DISTRICT`` where unassigned). ``method`` is either
+    ``'redissolve'`` (union all blocks of each affected district again) or
+    ``'patch'`` (add/subtract only the moved blocks from the cached polygon,
+    cheaper for small edits). The returned frame lists the districts that
+    were recomputed in ``attrs['recomputed']``.
+    """
+    if method not in ('redissolve', 'patch'):
+        raise ValueError(f"Unknown dissolve method: {method!r}")
+
+    plan_path, districts_path, state_path = _state_paths(cache_dir, name)
+    key = blocks_key(blocks)
+
+    cached = previous = None
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get('version') == STATE_VERSION and state.get('blocks') == key:
+            previous = np.load(plan_path)
+            cached = gpd.read_feather(districts_path)
+    except (OSError, ValueError):
+        pass
+
+    all_districts = {int(d) for d in np.unique(plan) if d != NO_DISTRICT}
+    if cached is None or len(previous) != len(plan):
+        affected = all_districts
+        result = _dissolve(blocks, plan, order, affected)
+    else:
+        affected = changed_districts(previous, plan)
+        if not affected:
+            cached.attrs['recomputed'] = []
+            return cached
+        if method == 'patch':
+            updated = _patch(cached, blocks, plan, previous, order, affected)
+        else:
+            updated = _dissolve(blocks, plan, order, affected)
+        kept = cached[~cached['District'].isin(affected) & cached['District'].isin(all_districts)]
+        result = pd.concat([kept, updated], ignore_index=True)
+
+    result = gpd.GeoDataFrame(result, geometry='geometry', crs=blocks.crs)
+    result = result.sort_values('District').reset_index(drop=True)
+
+    # Invalidate first so an interrupted write never pairs mismatched files
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    with open(plan_path + '.tmp', 'wb') as f:
+        np.save(f, plan)
+    os.replace(plan_path + '.tmp', plan_path)
+    result.to_feather(districts_path + '.tmp', compression='uncompressed')
+    os.replace(districts_path + '.tmp', districts_path)
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump({'version': STATE_VERSION, 'blocks': key}, f)
+    os.replace(state_path + '.tmp', state_path)
+
+    result.attrs['recomputed'] = sorted(affected)
+    return result
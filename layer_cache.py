@@ -0,0 +1,131 @@
+"""
+On-disk cache of reprojected TIGER/Line layers.
+
+Parsing the block shapefile and reprojecting it dominate the time of every map
+rebuild, and neither changes between plan revisions. The reprojected layer is
+written once as an uncompressed Arrow (Feather) file and memory-mapped back on
+later runs.
+
+geopandas and pandas are imported on first use, so modules that only need the
+cache location or fingerprints (block index lookups) start without them.
+"""
+import hashlib
+import json
+import os
+
+CACHE_DIR = os.environ.get('REDISTRICTING_CACHE', '.cache')
+
+# Bump when the on-disk layout changes so stale entries are rebuilt
+CACHE_VERSION = 1
+
+SHAPEFILE_PARTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def source_files(path):
+    """Return the files that make up a layer (all sidecars for a shapefile)."""
+    stem, ext = os.path.splitext(path)
+    if ext.lower() != '.shp':
+        return [path]
+    return [stem + part for part in SHAPEFILE_PARTS if os.path.exists(stem + part)]
+
+
+def source_stat(path):
+    """Cheap fingerprint of a layer: name, size and mtime of every source file."""
+    stat = []
+    for name in source_files(path):
+        st = os.stat(name)
+        stat.append([os.path.basename(name), st.st_size, st.st_mtime_ns])
+    return stat
+
+
+def content_hash(path):
+    """BLAKE2b digest over the contents of every source file of a layer."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in source_files(path):
+        digest.update(os.path.basename(name).encode())
+        with open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_paths(path, epsg, cache_dir=CACHE_DIR):
+    """Return (data, manifest) paths of the cache entry for a layer and target CRS."""
+    source_id = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    base = os.path.join(cache_dir, f'{stem}-{source_id}-epsg{epsg}')
+    return base + '.arrow', base + '.json'
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest_path, manifest):
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_path)
+
+
+def is_cached(path, epsg=4326, cache_dir=CACHE_DIR):
+    """True if a valid cache entry exists for the layer in its current state."""
+    data_path, manifest_path = cache_paths(path, epsg, cache_dir)
+    manifest = _read_manifest(manifest_path)
+    if manifest is None or not os.path.exists(data_path):
+        return False
+    if manifest.get('version') != CACHE_VERSION or manifest.get('epsg') != epsg:
+        return False
+    stat = source_stat(path)
+    if manifest.get('stat') == stat:
+        return True
+    # The files were touched or copied; only a content change invalidates
+    if manifest.get('hash') == content_hash(path):
+        manifest['stat'] = stat
+        _write_manifest(manifest_path, manifest)
+        return True
+    return False
+
+
+def load_layer(path, epsg=4326, cache_dir=CACHE_DIR, refresh=False):
+    """
+    Read a vector layer reprojected to ``epsg``, going through the cache.
+
+    On a miss the source is parsed with ``gpd.read_file``, reprojected and
+    stored; on a hit the stored Arrow file is memory-mapped instead.
+    """
+    import geopandas as gpd
+
+    data_path, manifest_path = cache_paths(path, epsg, cache_dir)
+    if not refresh and is_cached(path, epsg, cache_dir):
+        return gpd.read_feather(data_path, memory_map=True)
+
+    layer = gpd.read_file(path)
+    if layer.crs is None or layer.crs.to_epsg() != epsg:
+        layer = layer.to_crs(epsg=epsg)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = data_path + '.tmp'
+    layer.to_feather(tmp, compression='uncompressed')
+    os.replace(tmp, data_path)
+    _write_manifest(manifest_path, {
+        'version': CACHE_VERSION,
+        'source': os.path.abspath(path),
+        'epsg': epsg,
+        'stat': source_stat(path),
+        'hash': content_hash(path),
+        'rows': len(layer),
+    })
+    return layer
+
+
+def blocks_key(blocks):
+    """Fingerprint of a block set; derived state built for other blocks is stale."""
+    import pandas as pd
+
+    hashed = pd.util.hash_pandas_object(blocks['GEOID20'], index=False)
+    return f'{len(blocks)}-{int(hashed.sum()) & 0xFFFFFFFFFFFFFFFF:016x}'
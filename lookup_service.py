@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Local district lookup HTTP service.
+
+One asyncio (aiohttp) process keeps the block point index (block_index.py) and
+the plan resident and answers:
+
+- ``GET /district?lat=..&lon=..``: district and block of one point
+- ``POST /district`` with ``{"lat": [...], "lon": [...]}`` or
+  ``{"points": [[lat, lon], ...]}``: many points in one index query
+- ``GET /geocode?address=..``: address -> coordinates -> district
+- ``POST /geocode`` with ``{"addresses": [...]}``
+- ``GET /health``
+
+Single-point requests arriving together are resolved in one vectorized index
+query per event loop iteration. Addresses go to a Census-compatible one-line
+geocoder (``--geocoder-url``) through one pooled HTTP client with retries;
+results, misses included, are kept in a persistent SQLite cache keyed by the
+normalized address, with a TTL and least-recently-used eviction, and
+concurrent requests for the same address share one upstream call.
+
+``--stub ADDRESSES.csv`` runs a stand-in geocoder instead, answering in the
+Census format from a CSV of address, lat and lon columns, for offline testing.
+"""
+import argparse
+import asyncio
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from assignment_ingest import ingest_assignment
+from block_index import INDEX_DIR, NO_BLOCK, BlockIndex
+from block_order import NO_DISTRICT
+from geocode_batch import ABBREVIATIONS
+from layer_cache import CACHE_DIR
+from settings import ASSIGNMENT_FILE
+
+CENSUS_URL = 'https://geocoding.geo.census.gov/geocoder/locations/onelineaddress'
+BENCHMARK = 'Public_AR_Current'
+
+CACHE_FILE = os.path.join(CACHE_DIR, 'geocode.sqlite')
+CACHE_TTL = 30 * 86400  # seconds a match is reused
+MISS_TTL = 86400  # seconds a failed match is reused
+CACHE_ENTRIES = 1_000_000
+EVICT_EVERY = 1000  # inserts between LRU eviction passes
+
+CONNECTIONS = 20
+TIMEOUT = 15
+RETRIES = 3
+BACKOFF = 0.5  # seconds, doubled per retry
+
+MAX_POINTS = 1_000_000
+MAX_ADDRESSES = 1000
+
+
+def normalize_address(address):
+    """Upper-case, strip punctuation and abbreviate suffixes/directions (as in geocode_batch)."""
+    words = re.sub(r'[^\w\s]', ' ', str(address).upper()).split()
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in words)
+
+
+class GeocodeCache:
+    """Persistent normalized-address -> (lat, lon, matched address) cache with TTL and LRU eviction."""
+
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL, miss_ttl=MISS_TTL, max_entries=CACHE_ENTRIES):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS geocode ('
+                        'key TEXT PRIMARY KEY, lat REAL, lon REAL, matched TEXT, created REAL, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS geocode_used ON geocode (used)')
+        self.ttl, self.miss_ttl, self.max_entries = ttl, miss_ttl, max_entries
+        self._inserts = 0
+
+    def get(self, key):
+        """Cached (lat, lon, matched) of ``key`` (lat is None for a cached miss), or None if not cached."""
+        row = self.db.execute('SELECT lat, lon, matched, created FROM geocode WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[3] > (self.ttl if row[0] is not None else self.miss_ttl):
+            return None
+        self.db.execute('UPDATE geocode SET used = ? WHERE key = ?', (now, key))
+        # Commit right away so an idle server holds no write lock; WAL with synchronous=NORMAL
+        # does not fsync on commit, so this stays cheap
+        self.db.commit()
+        return row[:3]
+
+    def put(self, key, lat, lon, matched):
+        now = time.time()
+        self.db.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)', (key, lat, lon, matched, now, now))
+        self._inserts += 1
+        if self._inserts % EVICT_EVERY == 0:
+            self.evict()
+        self.db.commit()
+
+    def evict(self):
+        """Drop the least recently used entries beyond ``max_entries``."""
+        excess = self.db.execute('SELECT COUNT(*) FROM geocode').fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.db.execute('DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY used LIMIT ?)', (excess,))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class GeocoderError(Exception):
+    """The geocoder could not be reached after all retries."""
+
+
+class OneLineGeocoder:
+    """Census one-line address geocoder (or anything answering in its JSON format) over a pooled session."""
+
+    def __init__(self, session, url=CENSUS_URL, benchmark=BENCHMARK, retries=RETRIES, backoff=BACKOFF):
+        self.session = session
+        self.url = url
+        self.benchmark = benchmark
+        self.retries = retries
+        self.backoff = backoff
+
+    @staticmethod
+    def _match(data):
+        try:
+            matches = data['result']['addressMatches']
+            if not matches:
+                return None, None, None
+            coords = matches[0]['coordinates']
+            return float(coords['y']), float(coords['x']), matches[0].get('matchedAddress')
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise GeocoderError("unexpected geocoder response")
+
+    async def geocode(self, address):
+        """(lat, lon, matched address) of ``address``, all None when there is no match."""
+        params = {'address': address, 'benchmark': self.benchmark, 'format': 'json'}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(self.url, params=params) as response:
+                    if response.status >= 500 or response.status == 429:
+                        error = f"HTTP {response.status}"
+                    elif response.status >= 400:
+                        raise GeocoderError(f"geocoder rejected the request: HTTP {response.status}")
+                    else:
+                        return self._match(await response.json(content_type=None))
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = repr(e)
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise GeocoderError(f"geocoder failed after {self.retries + 1} attempts: {error}")
+
+
+class AddressResolver:
+    """Cache in front of the geocoder; concurrent requests for one address share one upstream call."""
+
+    def __init__(self, geocoder, cache):
+        self.geocoder = geocoder
+        self.cache = cache
+        self._inflight = {}
+        self.hits = self.misses = 0
+
+    async def resolve(self, address):
+        key = normalize_address(address)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        if key not in self._inflight:
+            self._inflight[key] = asyncio.ensure_future(self._fetch(key, address))
+        return await asyncio.shield(self._inflight[key])
+
+    async def _fetch(self, key, address):
+        try:
+            result = await self.geocoder.geocode(address)
+            self.cache.put(key, *result)
+            return result
+        finally:
+            del self._inflight[key]
+
+
+class DistrictIndex:
+    """The resident block index and plan; single-point queries queued in one loop iteration run together."""
+
+    def __init__(self, index, plan):
+        self.index = index
+        self.plan = plan
+        self._pending = []
+        self.queries = self.points = 0
+
+    def lookup(self, lat, lon):
+        """(districts, GEOID20s) of coordinate arrays; None where a point is in no block or district."""
+        positions, districts = self.index.lookup(lat, lon, self.plan)
+        self.queries += 1
+        self.points += len(positions)
+        geoids = self.index.geoid(positions)
+        return ([int(d) if d != NO_DISTRICT else None for d in districts],
+                [g if p != NO_BLOCK else None for g, p in zip(geoids, positions)])
+
+    async def lookup_one(self, lat, lon):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((lat, lon, future))
+        if len(self._pending) == 1:
+            asyncio.get_running_loop().call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        live = [p for p in pending if not p[2].cancelled()]
+        if not live:
+            return
+        try:
+            districts, geoids = self.lookup([p[0] for p in live], [p[1] for p in live])
+        except Exception as e:
+            for p in live:
+                p[2].set_exception(e)
+            return
+        for p, district, geoid in zip(live, districts, geoids):
+            p[2].set_result((district, geoid))
+
+
+def _coordinate(request, name):
+    try:
+        return float(request.query[name])
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text=f"'{name}' must be a number")
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="request body must be JSON")
+
+
+async def district_get(request):
+    lat, lon = _coordinate(request, 'lat'), _coordinate(request, 'lon')
+    district, geoid = await request.app['districts'].lookup_one(lat, lon)
+    return web.json_response({'lat': lat, 'lon': lon, 'district': district, 'geoid': geoid})
+
+
+async def district_post(request):
+    body = await _json_body(request)
+    try:
+        if 'points' in body:
+            points = np.asarray(body['points'], dtype=np.float64).reshape(-1, 2)
+            lat, lon = points[:, 0], points[:, 1]
+        else:
+            lat = np.asarray(body['lat'], dtype=np.float64)
+            lon = np.asarray(body['lon'], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(text="expected {'points': [[lat, lon], ...]} or {'lat': [...], 'lon': [...]}")
+    if lat.ndim != 1 or lat.shape != lon.shape or len(lat) > MAX_POINTS:
+        raise web.HTTPBadRequest(text=f"lat and lon must be lists of the same length (at most {MAX_POINTS:,})")
+    districts, geoids = request.app['districts'].lookup(lat, lon)
+    return web.json_response({'districts': districts, 'geoids': geoids})
+
+
+async def _geocode(request, addresses):
+    resolver = request.app['resolver']
+    try:
+        located = await asyncio.gather(*(resolver.resolve(a) for a in addresses))
+    except GeocoderError as e:
+        raise web.HTTPBadGateway(text=str(e))
+    found = [i for i, r in enumerate(located) if r[0] is not None]
+    districts, geoids = request.app['districts'].lookup([located[i][0] for i in found], [located[i][1] for i in found])
+    results = [{'address': a, 'lat': None, 'lon': None, 'matched_address': None, 'district': None, 'geoid': None}
+               for a in addresses]
+    for i, district, geoid in zip(found, districts, geoids):
+        lat, lon, matched = located[i]
+        results[i].update(lat=lat, lon=lon, matched_address=matched, district=district, geoid=geoid)
+    return results
+
+
+async def geocode_get(request):
+    address = request.query.get('address', '').strip()
+    if not address:
+        raise web.HTTPBadRequest(text="'address' is required")
+    return web.json_response((await _geocode(request, [address]))[0])
+
+
+async def geocode_post(request):
+    body = await _json_body(request)
+    addresses = body.get('addresses') if isinstance(body, dict) else None
+    if not isinstance(addresses, list) or len(addresses) > MAX_ADDRESSES:
+        raise web.HTTPBadRequest(text=f"expected {{'addresses': [...]}} with at most {MAX_ADDRESSES} addresses")
+    return web.json_response({'results': await _geocode(request, [str(a) for a in addresses])})
+
+
+async def health(request):
+    districts, resolver = request.app['districts'], request.app['resolver']
+    return web.json_response({
+        'blocks': len(districts.index), 'queries': districts.queries, 'points': districts.points,
+        'cache_hits': resolver.hits, 'cache_misses': resolver.misses,
+    })
+
+
+def make_app(index, plan, geocoder_url=CENSUS_URL, cache_path=CACHE_FILE, cache_ttl=CACHE_TTL,
+             cache_entries=CACHE_ENTRIES, connections=CONNECTIONS, timeout=TIMEOUT):
+    """The lookup service for ``plan`` (district of every block position of ``index``)."""
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app['districts'] = DistrictIndex(index, plan)
+
+    async def client(app):
+        connector = aiohttp.TCPConnector(limit=connections, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            cache = GeocodeCache(cache_path, ttl=cache_ttl, max_entries=cache_entries)
+            app['resolver'] = AddressResolver(OneLineGeocoder(session, geocoder_url), cache)
+            yield
+            cache.close()
+
+    app.cleanup_ctx.append(client)
+    app.router.add_get('/district', district_get)
+    app.router.add_post('/district', district_post)
+    app.router.add_get('/geocode', geocode_get)
+    app.router.add_post('/geocode', geocode_post)
+    app.router.add_get('/health', health)
+    return app
+
+
+def stub_geocoder_app(path):
+    """Stand-in one-line geocoder answering from a CSV of address, lat and lon columns."""
+    table = pd.read_csv(path, dtype={'address': str})
+    points = {normalize_address(a): (lat, lon, a) for a, lat, lon in zip(table['address'], table['lat'], table['lon'])}
+
+    async def onelineaddress(request):
+        match = points.get(normalize_address(request.query.get('address', '')))
+        matches = [] if match is None else [{
+            'matchedAddress': match[2], 'coordinates': {'x': match[1], 'y': match[0]},
+        }]
+        return web.json_response({'result': {'addressMatches': matches}})
+
+    app = web.Application()
+    app.router.add_get('/geocoder/locations/onelineaddress', onelineaddress)
+    return app
+
+
+def run(args):
+    if args.stub:
+        web.run_app(stub_geocoder_app(args.stub), host=args.host, port=args.port)
+        return
+    print("Loading block index...")
+    try:
+        index = BlockIndex(args.index)
+    except OSError:
+        sys.exit(f"No block index at {args.index}; build it with the map script or geocode_batch.py --rebuild-index")
+    order = index.block_order()
+    plan = order.to_layer(ingest_assignment(args.assignment, order).plan)
+    print(f"Serving {len(index):,} blocks, {len(set(plan[plan != NO_DISTRICT].tolist()))} districts")
+    web.run_app(make_app(index, plan, args.geocoder_url, args.cache, args.cache_ttl * 86400,
+                         args.cache_entries, args.connections), host=args.host, port=args.port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--assignment', default=ASSIGNMENT_FILE,
+                        help="block assignment CSV (GEOID20, District)")
+    parser.add_argument('--index', default=INDEX_DIR, help="block index directory")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--geocoder-url', default=CENSUS_URL, help="Census-compatible one-line geocoder endpoint")
+    parser.add_argument('--cache', default=CACHE_FILE, help="SQLite geocode cache")
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL / 86400, help="days a geocode is reused")
+    parser.add_argument('--cache-entries', type=int, default=CACHE_ENTRIES)
+    parser.add_argument('--connections', type=int, default=CONNECTIONS, help="geocoder connection pool size")
+    parser.add_argument('--stub', metavar='ADDRESSES_CSV', help="run a stub geocoder serving these addresses instead")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Zoom-dependent multi-resolution geometry for the map layers.
+
+Each layer is simplified into several levels, one per zoom range, each with a
+target vertex budget. Simplification uses coverage (Visvalingam-Whyatt)
+simplification so neighbouring polygons keep sharing their edges at every
+level; district levels are simplified from the shared boundary arcs of the
+block topology instead, the same arcs the exported boundaries come from. The
+page shows only the level for the current zoom and swaps on zoom, so the
+statewide view carries a fraction of the vertices of the street view.
+"""
+import json
+import os
+
+import numpy as np
+import shapely
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from folium.template import Template
+
+from compact_output import PRECISION, QUANTIZATION, SEPARATORS, feature_properties, to_geojson, to_topojson, write_text
+from topology import OUTSIDE, arc_polygons, simplify_arcs
+
+# (min zoom, max zoom, vertex budget); None keeps full resolution
+DISTRICT_LEVELS = [(0, 8, 5_000), (9, 11, 25_000), (12, 20, 100_000)]
+PRECINCT_LEVELS = [(0, 9, 25_000), (10, 12, 100_000), (13, 20, 300_000)]
+
+SEARCH_STEPS = 14
+
+# TopoJSON grid step as a fraction of a level's simplification tolerance, so that
+# quantization error stays well below the simplification error at every zoom
+GRID_PER_TOLERANCE = 0.1
+
+TOPOJSON_JS = 'https://cdnjs.cloudflare.com/ajax/libs/topojson/1.6.9/topojson.min.js'
+
+
+def _simplify(geoms, tolerance):
+    if hasattr(shapely, 'coverage_simplify'):
+        return shapely.coverage_simplify(geoms, tolerance)
+    # shapely < 2.1: per-polygon Douglas-Peucker, topology preserved within each polygon only
+    return shapely.simplify(geoms, tolerance, preserve_topology=True)
+
+
+def simplify_to_budget(geoms, budget, simplify=_simplify, weights=None):
+    """
+    Simplify ``geoms`` with the smallest tolerance whose total vertex count fits ``budget``.
+
+    ``simplify(geoms, tolerance)`` does the simplification; ``weights`` counts
+    each geometry's vertices that many times. Returns (simplified geometries,
+    tolerance). The tolerance is found by a log-space bisection.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    weights = np.ones(len(geoms), dtype=np.int64) if weights is None else weights
+
+    def vertices(g):
+        return int((shapely.get_num_coordinates(g) * weights).sum())
+
+    if budget is None or vertices(geoms) <= budget:
+        return geoms, 0.0
+    x0, y0, x1, y1 = shapely.total_bounds(geoms)
+    lo, hi = np.log(max(x1 - x0, y1 - y0) * 1e-7), np.log(max(x1 - x0, y1 - y0))
+    best = None
+    for _ in range(SEARCH_STEPS):
+        mid = (lo + hi) / 2
+        simplified = simplify(geoms, np.exp(mid))
+        if vertices(simplified) <= budget:
+            best, hi = (simplified, float(np.exp(mid))), mid
+        else:
+            lo = mid
+    if best is None:
+        best = (simplify(geoms, float(np.exp(hi))), float(np.exp(hi)))
+    return best
+
+
+def level_quantization(frame, tolerance, quantization=QUANTIZATION, precision=PRECISION):
+    """
+    TopoJSON quantization for a level simplified with ``tolerance``.
+
+    The grid step is ``GRID_PER_TOLERANCE`` of the tolerance, never finer than
+    ``precision`` decimals (the GeoJSON rounding, used for unsimplified levels)
+    nor coarser than ``quantization`` steps across the layer.
+    """
+    x0, y0, x1, y1 = shapely.total_bounds(frame.geometry.values)
+    step = max(tolerance * GRID_PER_TOLERANCE, 10.0 ** -precision)
+    return max(quantization, int(np.ceil(max(x1 - x0, y1 - y0) / step)) + 1)
+
+
+def build_levels(frame, levels):
+    """
+    Simplify a GeoDataFrame once per level.
+
+    Returns a list of dicts with ``min``/``max`` zoom, the simplified ``frame``,
+    the ``tolerance`` used and the resulting ``vertices``.
+    """
+    out = []
+    for minzoom, maxzoom, budget in levels:
+        geoms, tolerance = simplify_to_budget(frame.geometry.values, budget)
+        level = frame.copy()
+        level['geometry'] = geoms
+        out.append({
+            'min': minzoom, 'max': maxzoom, 'frame': level, 'tolerance': tolerance,
+            'vertices': int(shapely.get_num_coordinates(geoms).sum()),
+        })
+    return out
+
+
+def build_district_levels(lines, pairs, levels, crs=None):
+    """
+    District levels from the block topology, like ``build_levels``.
+
+    ``lines`` and ``pairs`` are the exact boundary arcs of a plan
+    (``boundary_arcs`` with tolerance 0). The arcs are simplified once per
+    level, so every level, and ``district_boundaries`` at the same tolerance,
+    is built from the same shared lines.
+    """
+    # A shared arc is part of both districts' rings, the outer boundary of one
+    weights = (pairs != OUTSIDE).sum(axis=1)
+    out = []
+    for minzoom, maxzoom, budget in levels:
+        simplified, tolerance = simplify_to_budget(lines, budget, simplify_arcs, weights)
+        frame = arc_polygons(simplified, pairs, crs)
+        out.append({
+            'min': minzoom, 'max': maxzoom, 'frame': frame, 'tolerance': tolerance,
+            'vertices': int(shapely.get_num_coordinates(frame.geometry.values).sum()),
+        })
+    return out
+
+
+def encode_levels(levels, properties, precision=PRECISION, topojson=False, quantization=QUANTIZATION):
+    """
+    Encoded data of every level: compact GeoJSON rounded to ``precision``
+    decimals, or TopoJSON quantized for each level's tolerance.
+    """
+    out = []
+    for level in levels:
+        if topojson:
+            grid = level_quantization(level['frame'], level['tolerance'], quantization, precision)
+            out.append(to_topojson({'layer': (level['frame'], properties)}, grid))
+        else:
+            out.append(to_geojson(level['frame'], properties, precision))
+    return out
+
+
+class MultiResolutionGeoJson(JSCSSMixin, Layer):
+    """
+    Map layer that shows the geometry level matching the current zoom.
+
+    Levels are embedded in the page, or, with ``level_dir``/``level_url``, only
+    the ``inline`` coarsest ones are: the others are written as separate files
+    (named after ``prefix`` and the layer) and fetched the first time their
+    zoom range is reached. Where the fetch fails, e.g. a page opened from disk
+    rather than over HTTP, the finest embedded level is shown instead.
+
+    Levels are compact GeoJSON rounded to ``precision`` decimals, or TopoJSON
+    with ``topojson=True``, quantized finely enough for each level's tolerance
+    (see ``level_quantization``; ``quantization`` is the coarsest grid used).
+    ``style_js`` is a JavaScript function ``feature -> path style``;
+    ``highlight`` is a path style dict applied while a feature is hovered. The
+    encoded size of each level is kept in ``sizes``.
+
+    ``data`` takes the levels already encoded by ``encode_levels``, so a layer
+    whose geometry does not change is encoded once. The columns of ``joined``,
+    one row per feature in level order, are then merged into the feature
+    properties in the page.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.layerGroup();
+            (function() {
+                var group = {{ this.get_name() }};
+                var map = {{ this._parent.get_name() }};
+                var style = {{ this.style_js }};
+                var highlight = {{ this.highlight|tojson }};
+                var fields = {{ this.fields|tojson }};
+                var aliases = {{ this.aliases|tojson }};
+                var levels = {{ this.levels_js }};
+                var joined = {{ this.joined_js }};
+                function decode(data) {
+                    var collection = data.type === 'Topology' ? topojson.feature(data, data.objects.layer) : data;
+                    if (joined) {
+                        collection.features.forEach(function(feature, i) {
+                            feature.properties = Object.assign({}, feature.properties, joined[i]);
+                        });
+                    }
+                    return collection;
+                }
+                function build(level) {
+                    level.layer = L.geoJSON(null, {
+                        style: style,
+                        onEachFeature: function(feature, layer) {
+                            layer.bindTooltip(fields.map(function(field, i) {
+                                return '<b>' + aliases[i] + '</b> ' + feature.properties[field];
+                            }).join('<br>'));
+                            if (highlight) {
+                                layer.on({
+                                    mouseover: function() { layer.setStyle(highlight); },
+                                    mouseout: function() { level.layer.resetStyle(layer); }
+                                });
+                            }
+                        }
+                    });
+                    if (level.data) {
+                        level.layer.addData(decode(level.data));
+                    } else {
+                        fetch(level.url)
+                            .then(function(response) { return response.json(); })
+                            .then(function(data) { level.layer.addData(decode(data)); })
+                            .catch(function() {
+                                var embedded = levels.filter(function(l) { return l.data; }).pop();
+                                if (embedded) level.layer.addData(decode(embedded.data));
+                            });
+                    }
+                }
+                function update() {
+                    var zoom = map.getZoom();
+                    levels.forEach(function(level) {
+                        var active = zoom >= level.min && zoom <= level.max;
+                        if (active && !level.layer) build(level);
+                        if (active && !group.hasLayer(level.layer)) group.addLayer(level.layer);
+                        if (!active && level.layer && group.hasLayer(level.layer)) group.removeLayer(level.layer);
+                    });
+                }
+                map.on('zoomend', update);
+                update();
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, levels, style_js, fields, aliases, name=None, show=True, highlight=None,
+                 level_dir=None, level_url=None, inline=1, prefix='', properties=None,
+                 precision=PRECISION, topojson=False, quantization=QUANTIZATION, data=None, joined=None):
+        super().__init__(name=name, overlay=True, show=show)
+        self._name = 'MultiResolutionGeoJson'
+        self.style_js = style_js
+        self.highlight = highlight
+        self.fields = list(fields)
+        self.aliases = list(aliases)
+        if topojson:
+            self.default_js = [('topojson', TOPOJSON_JS)]
+        if data is None:
+            columns = list(properties if properties is not None else fields)
+            data = encode_levels(levels, columns, precision, topojson, quantization)
+        self.joined_js = 'null' if joined is None else json.dumps(
+            feature_properties(joined, joined.columns), separators=SEPARATORS
+        )
+
+        entries = []
+        self.sizes = []
+        for i, (level, encoded) in enumerate(zip(levels, data)):
+            self.sizes.append(len(encoded.encode('utf-8')))
+            if level_dir is None or i < inline:
+                entries.append('{"min": %d, "max": %d, "data": %s}' % (level['min'], level['max'], encoded))
+                continue
+            entry = {'min': level['min'], 'max': level['max']}
+            extension = 'topojson' if topojson else 'geojson'
+            filename = f'{prefix}{self.layer_name}_{i}.{extension}'.replace(' ', '_')
+            os.makedirs(level_dir, exist_ok=True)
+            write_text(os.path.join(level_dir, filename), encoded)
+            entry['url'] = f'{level_url}/{filename}' if level_url else filename
+            entries.append(json.dumps(entry))
+        self.levels_js = '[' + ', '.join(entries) + ']'
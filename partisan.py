@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Partisan metrics of districting plans from precinct election returns.
+
+Precinct two-party votes are disaggregated to census blocks once, in proportion
+to block voting-age population (land area where there is no PL 94-171 data),
+through the cached block-to-VTD crosswalk, into arrays over the canonical block
+order (block_order.py). Each plan is then a bincount of the block votes by its
+district array, so a whole directory of assignment CSVs can be scored in
+seconds.
+
+Metrics (all signed so that positive favours Democrats):
+- efficiency gap: (wasted Republican - wasted Democratic votes) / total votes
+- mean-median: median minus mean Democratic two-party share across districts
+- partisan bias: Democratic seat share above 50% when the statewide vote is
+  shifted uniformly to 50/50
+"""
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from assignment_ingest import ingest_assignment
+from block_order import NO_BLOCK, NO_DISTRICT, load_block_order
+from crosswalk import NO_PRECINCT, load_crosswalk
+from layer_cache import load_layer
+
+
+def load_returns(path, precinct_col='GEOID20', dem_col='DEM', rep_col='REP'):
+    """Two-party votes per precinct (summing rows such as early/absentee/election day)."""
+    returns = pd.read_csv(path, dtype={precinct_col: str}, usecols=[precinct_col, dem_col, rep_col])
+    returns = returns.rename(columns={precinct_col: 'VTD', dem_col: 'Dem', rep_col: 'Rep'})
+    returns[['Dem', 'Rep']] = returns[['Dem', 'Rep']].apply(pd.to_numeric, errors='coerce').fillna(0)
+    return returns.groupby('VTD', as_index=False)[['Dem', 'Rep']].sum()
+
+
+def block_weights(crosswalk, pl_blocks=None):
+    """
+    Share of its precinct carried by every block.
+
+    Blocks are weighted by VAP when ``pl_blocks`` is given, and by land area
+    otherwise or in precincts with no VAP; precincts with neither are split
+    evenly over their blocks.
+    """
+    weights = crosswalk[crosswalk['VTD'] != NO_PRECINCT][['GEOID20', 'VTD', 'ALAND20']]
+    if pl_blocks is not None:
+        weights = weights.merge(pl_blocks[['GEOID20', 'VAP']], on='GEOID20', how='left')
+        weights['VAP'] = weights['VAP'].fillna(0)
+    else:
+        weights = weights.assign(VAP=0)
+    by_precinct = weights.groupby('VTD')
+    vap = by_precinct['VAP'].transform('sum')
+    land = by_precinct['ALAND20'].transform('sum')
+    count = by_precinct['GEOID20'].transform('size')
+    share = np.where(vap > 0, weights['VAP'] / vap.where(vap > 0, 1),
+                     np.where(land > 0, weights['ALAND20'] / land.where(land > 0, 1), 1 / count))
+    return weights.assign(Weight=share)[['GEOID20', 'VTD', 'Weight']]
+
+
+class ElectionModel:
+    """Block-level two-party votes of one election, ready to aggregate by plan."""
+
+    def __init__(self, returns, weights, order):
+        blocks = weights.merge(returns, on='VTD', how='left')
+        positions = order.positions(blocks['GEOID20'].values)
+        found = positions != NO_BLOCK
+        self.dem = np.zeros(len(order))
+        self.rep = np.zeros(len(order))
+        self.dem[positions[found]] = (blocks['Dem'].fillna(0) * blocks['Weight']).values[found]
+        self.rep[positions[found]] = (blocks['Rep'].fillna(0) * blocks['Weight']).values[found]
+        matched = returns['VTD'].isin(weights['VTD'])
+        self.unmatched = returns.loc[~matched, ['Dem', 'Rep']].values.sum()
+
+    def district_votes(self, plan):
+        """Two-party votes and Democratic share per district of ``plan``, indexed by District."""
+        assigned = plan != NO_DISTRICT
+        ids, codes = np.unique(plan[assigned], return_inverse=True)
+        dem = np.bincount(codes, weights=self.dem[assigned], minlength=len(ids))
+        rep = np.bincount(codes, weights=self.rep[assigned], minlength=len(ids))
+        table = pd.DataFrame({'Dem': dem, 'Rep': rep}, index=pd.Index(ids.astype(int), name='District'))
+        table['Dem share'] = table['Dem'] / (table['Dem'] + table['Rep'])
+        return table
+
+
+def vote_metrics(dem, rep):
+    """Seats, efficiency gap, mean-median and partisan bias from per-district vote arrays."""
+    total = dem + rep
+    share = dem / total
+    dem_wins = dem > rep
+
+    # Winner wastes the votes above half the district total, the loser all of its votes
+    wasted_dem = np.where(dem_wins, dem - total / 2, dem)
+    wasted_rep = np.where(dem_wins, rep, rep - total / 2)
+    statewide = dem.sum() / total.sum()
+    swung = share + (0.5 - statewide)
+    return {
+        'Districts': len(dem),
+        'Dem seats': int(dem_wins.sum()),
+        'Dem vote share': statewide,
+        'Efficiency gap': (wasted_rep.sum() - wasted_dem.sum()) / total.sum(),
+        'Mean-median': float(np.median(share) - share.mean()),
+        'Partisan bias': float((swung > 0.5).mean() - 0.5),
+    }
+
+
+def partisan_metrics(table):
+    """``vote_metrics`` of a ``district_votes`` table."""
+    return vote_metrics(table['Dem'].values, table['Rep'].values)
+
+
+def evaluate(model, plan):
+    """Return (per-district votes table, metrics dict) for one plan array."""
+    table = model.district_votes(plan)
+    return table, partisan_metrics(table)
+
+
+def print_metrics(table, metrics):
+    for dist, row in table.iterrows():
+        lean = 'D' if row['Dem share'] >= 0.5 else 'R'
+        print(f"District {dist}: {row['Dem share'] * 100:.1f}% D ({lean}+{abs(row['Dem share'] - 0.5) * 200:.1f})")
+    print(f"Democratic seats: {metrics['Dem seats']} of {metrics['Districts']} "
+          f"({metrics['Dem vote share'] * 100:.1f}% two-party vote)")
+    print(f"Efficiency gap: {metrics['Efficiency gap'] * 100:+.2f}%")
+    print(f"Mean-median: {metrics['Mean-median'] * 100:+.2f}%")
+    print(f"Partisan bias: {metrics['Partisan bias'] * 100:+.2f}%")
+
+
+def run(args):
+    blocks = load_layer(args.blocks, epsg=4326)
+    precincts = load_layer(args.precincts, epsg=4326)
+    pl_blocks = None
+    if args.pl:
+        from tabulation import load_pl_blocks
+        pl_blocks = load_pl_blocks(args.pl)
+    returns = load_returns(args.returns, args.precinct_col, args.dem_col, args.rep_col)
+    order = load_block_order(blocks)
+    model = ElectionModel(returns, block_weights(load_crosswalk(blocks, precincts), pl_blocks), order)
+    if model.unmatched:
+        print(f"Warning: {model.unmatched:,.0f} votes in precincts not in the VTD layer", file=sys.stderr)
+
+    paths = []
+    for path in args.plans:
+        paths += sorted(glob.glob(os.path.join(path, '*.csv'))) if os.path.isdir(path) else [path]
+
+    rows = []
+    for path in paths:
+        table, metrics = evaluate(model, ingest_assignment(path, order).plan)
+        if len(paths) == 1:
+            print_metrics(table, metrics)
+        rows.append({'plan': os.path.basename(path), **metrics})
+    summary = pd.DataFrame(rows)
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print(f"Scored {len(summary)} plans to {args.output}")
+    elif len(paths) > 1:
+        print(summary.to_string(index=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('plans', nargs='+', help="assignment CSVs (GEOID20, District) or directories of them")
+    parser.add_argument('--returns', required=True, help="precinct election returns CSV")
+    parser.add_argument('--precinct-col', default='GEOID20', help="VTD GEOID20 column in the returns")
+    parser.add_argument('--dem-col', default='DEM')
+    parser.add_argument('--rep-col', default='REP')
+    parser.add_argument('--pl', help="PL 94-171 block data for VAP weights (see tabulation.py)")
+    parser.add_argument('--blocks', default="tl_2020_24_tabblock20.shp")
+    parser.add_argument('--precincts', default="tl_2020_24_vtd20.shp")
+    parser.add_argument('-o', '--output', help="summary CSV, one row per plan")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Differences between two districting plans.
+
+Both plans are district arrays over the canonical block order (block_order.py),
+so the moved blocks are one element-wise comparison; only those blocks are
+dissolved, one "from -> to" change polygon per district pair, so the cost
+scales with the size of the change rather than with the state. Population
+moved per pair comes from the PL 94-171 block counts when available.
+
+Assignments are CSVs with GEOID20 and District columns, or Census block
+assignment files (``BLOCKID|DISTRICT``, e.g. BlockAssign_ST24_MD_CD.txt).
+"""
+import argparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from assignment_ingest import ingest_assignment
+from block_order import NO_DISTRICT, load_block_order
+from layer_cache import load_layer
+
+UNASSIGNED = NO_DISTRICT
+
+
+def moved_blocks(old, new):
+    """Canonical ``Position`` of every block whose district differs between plans ``old`` and ``new``, with From and To."""
+    positions = np.flatnonzero(old != new)
+    return pd.DataFrame({
+        'Position': positions,
+        'From': old[positions].astype(int),
+        'To': new[positions].astype(int),
+    })
+
+
+def moved_population(moved, counts=None):
+    """Blocks (and population/VAP when the ``block_counts`` table is given) moved per (From, To) pair."""
+    columns = []
+    if counts is not None:
+        columns = [c for c in ('Population', 'VAP') if c in counts.columns]
+        moved = moved.assign(**{c: counts[c].values[moved['Position'].values] for c in columns})
+    table = moved.groupby(['From', 'To']).agg(Blocks=('Position', 'size'), **{c: (c, 'sum') for c in columns})
+    return table.astype(int).reset_index()
+
+
+def change_polygons(blocks, order, moved, counts=None):
+    """
+    One polygon per (From, To) pair covering its moved blocks, with the moved
+    block count and population. Only the moved blocks are unioned.
+    """
+    table = moved_population(moved, counts)
+    geoms = np.asarray(blocks.geometry.values, dtype=object)[order.layer[moved['Position'].values]]
+    pairs = moved.assign(_geom=geoms).groupby(['From', 'To'])['_geom']
+    unioned = pairs.agg(lambda g: shapely.coverage_union_all(np.asarray(g.values, dtype=object)))
+    table = table.merge(unioned.rename('geometry').reset_index(), on=['From', 'To'], how='inner')
+    return gpd.GeoDataFrame(table, geometry='geometry', crs=blocks.crs)
+
+
+def print_diff(table):
+    """Print moved blocks (and population) per district pair."""
+    for _, row in table.sort_values(['From', 'To']).iterrows():
+        source = 'unassigned' if row['From'] == UNASSIGNED else f"District {row['From']}"
+        target = 'unassigned' if row['To'] == UNASSIGNED else f"District {row['To']}"
+        line = f"{source} -> {target}: {row['Blocks']:,} blocks"
+        if 'Population' in table.columns:
+            line += f", {row['Population']:,} people"
+        print(line)
+    total = f"Total moved: {table['Blocks'].sum():,} blocks"
+    if 'Population' in table.columns:
+        total += f", {table['Population'].sum():,} people"
+    print(total)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('old', help="baseline assignment (plan CSV or Census block assignment file)")
+    parser.add_argument('new', help="proposed assignment")
+    parser.add_argument('--pl', help="PL 94-171 block data for moved population (see tabulation.py)")
+    parser.add_argument('--blocks', default="tl_2020_24_tabblock20.shp")
+    parser.add_argument('-o', '--output', help="write the change polygons as GeoJSON")
+    args = parser.parse_args(argv)
+
+    blocks = load_layer(args.blocks, epsg=4326)
+    order = load_block_order(blocks)
+    counts = None
+    if args.pl:
+        from tabulation import block_counts, load_pl_blocks
+        counts = block_counts(load_pl_blocks(args.pl), order)
+    moved = moved_blocks(ingest_assignment(args.old, order).plan, ingest_assignment(args.new, order).plan)
+    if args.output:
+        from compact_output import to_geojson, write_text
+        changes = change_polygons(blocks, order, moved, counts)
+        print_diff(changes)
+        write_text(args.output, to_geojson(changes, [c for c in changes.columns if c != 'geometry']))
+        print(f"Change polygons saved to: {args.output}")
+    else:
+        print_diff(moved_population(moved, counts))
+
+
+if __name__ == '__main__':
+    main()
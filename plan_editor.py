@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Interactive plan editor.
+
+Serves a map where clicking a precinct (or a single block) reassigns it to the
+chosen district. The base layers are loaded once (as by the map script) and
+the plan is an array over the block layer, so an edit never dissolves or joins
+anything: the clicked point is found in the block point index, and only the
+districts that lost or gained blocks are updated:
+
+- population: the moved blocks' counts are subtracted and added
+- contiguity: a connected-components pass over the district's own blocks
+  (plan_metrics.district_contiguity)
+- precinct and county splits: (precinct, district) and (county, district)
+  block counts are patched for the moved blocks
+- outline: rebuilt from the block topology edges on the district's boundary
+  (topology.district_outline)
+
+Each edit answers with those districts and the plan-wide summary, and the page
+redraws only them. Edits can be undone, and the plan is saved as an assignment
+CSV (GEOID20, District).
+
+Endpoints: ``GET /`` (the editor), ``GET /state``, ``GET /precincts.geojson``,
+``POST /edit`` with ``{"lat", "lon", "district", "unit": "precinct"|"block"}``,
+``POST /undo`` and ``POST /save``.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+from aiohttp import web
+
+import create_enhanced_map
+from assignment_ingest import ingest_assignment
+from block_index import NO_BLOCK
+from block_order import NO_DISTRICT, write_plan
+from compact_output import round_geometries, to_geojson
+from plan_metrics import district_contiguity
+from topology import district_outline
+
+OUTLINE_TOLERANCE = 0.0002  # degrees (~20 m); fine enough to see single blocks move
+PRECINCT_TOLERANCE = 0.0005
+UNITS = ('precinct', 'block')
+
+
+class PlanEditor:
+    """A plan being edited, with per-district population, contiguity, splits and outlines kept current."""
+
+    def __init__(self, base, plan, seats=None, tolerance=OUTLINE_TOLERANCE):
+        order = base['order']
+        self.order = order
+        self.topology = base['topology']
+        self.adjacency = base['adjacency']
+        self.block_index = base['block_index']
+        self.tolerance = tolerance
+        self.districts = order.to_layer(plan)
+        self.ids = [int(d) for d in np.unique(plan[plan != NO_DISTRICT])]
+        span = max(self.ids) + 1
+
+        counts = base['counts']
+        self.block_population = order.to_layer(
+            counts['Population'].values.astype(np.int64) if counts is not None else np.zeros(len(order), dtype=np.int64)
+        )
+        self.ideal = self.block_population.sum() / (seats or len(self.ids))
+        self.precinct = order.to_layer(base['crosswalk']['VTD'].cat.codes.values.astype(np.int64))
+        county_geoids = base['blocks']['GEOID20'].str[:5].values
+        self.county, county_ids = pd.factorize(county_geoids)
+        names = dict(zip(base['counties']['GEOID20'], base['counties'].get('NAME20', base['counties']['GEOID20'])))
+        self.county_names = [names.get(g, g) for g in county_ids]
+
+        # Blocks of every precinct, for precinct-sized edits
+        by_precinct = np.argsort(self.precinct, kind='stable')
+        self._precinct_blocks = by_precinct
+        self._precinct_ptr = np.searchsorted(self.precinct[by_precinct], np.arange(self.precinct.max() + 2))
+
+        assigned = self.districts != NO_DISTRICT
+        self.population = np.zeros(span, dtype=np.int64)
+        self.precinct_counts = np.zeros((self.precinct.max() + 1, span), dtype=np.int32)
+        self.county_counts = np.zeros((len(county_ids), span), dtype=np.int32)
+        self._count(np.flatnonzero(assigned), 1)
+        self.history = []
+        self.stats = {d: self._district(d) for d in self.ids}
+
+    def _count(self, positions, sign):
+        """Add ``sign`` to the split counts of ``positions`` under their current districts."""
+        districts = self.districts[positions]
+        assigned = districts != NO_DISTRICT
+        in_precinct = assigned & (self.precinct[positions] >= 0)
+        np.add.at(self.precinct_counts, (self.precinct[positions][in_precinct], districts[in_precinct]), sign)
+        np.add.at(self.county_counts, (self.county[positions][assigned], districts[assigned]), sign)
+        np.add.at(self.population, districts[assigned], sign * self.block_population[positions][assigned])
+
+    def _district(self, district):
+        """Population, deviation, contiguity and outline of one district."""
+        components, detached = district_contiguity(self.adjacency, self.districts, district)
+        outline = district_outline(self.topology, self.districts, district, self.tolerance)
+        population = int(self.population[district])
+        return {
+            'district': district,
+            'population': population,
+            'deviation': population - self.ideal,
+            'deviation_pct': (population - self.ideal) / self.ideal * 100 if self.ideal else 0.0,
+            'components': int(components),
+            'detached': int(detached),
+            'feature': None if outline is None else {
+                'type': 'Feature', 'properties': {'District': district},
+                'geometry': round_geometries([outline])[0].__geo_interface__,
+            },
+        }
+
+    def summary(self):
+        populations = [self.stats[d]['population'] for d in self.ids]
+        split_counties = np.flatnonzero((self.county_counts > 0).sum(axis=1) > 1)
+        unassigned = self.districts == NO_DISTRICT
+        return {
+            'ideal': self.ideal,
+            'total_deviation': max(populations) - min(populations),
+            'total_deviation_pct': (max(populations) - min(populations)) / self.ideal * 100 if self.ideal else 0.0,
+            'split_precincts': int(((self.precinct_counts > 0).sum(axis=1) > 1).sum()),
+            'split_counties': [self.county_names[c] for c in split_counties],
+            'unassigned_population': int(self.block_population[unassigned].sum()),
+            'edits': len(self.history),
+        }
+
+    def select(self, lat, lon, unit='precinct'):
+        """Layer rows of the block under a point, or of its whole precinct; empty if the point is in no block."""
+        position = int(self.block_index.query([lat], [lon])[0])
+        if position == NO_BLOCK:
+            return np.empty(0, dtype=np.int64)
+        precinct = self.precinct[position]
+        if unit == 'block' or precinct < 0:
+            return np.array([position])
+        return self._precinct_blocks[self._precinct_ptr[precinct]:self._precinct_ptr[precinct + 1]]
+
+    def _move(self, positions, districts):
+        touched = set(self.districts[positions].tolist()) | set(np.atleast_1d(districts).tolist())
+        self._count(positions, -1)
+        self.districts[positions] = districts
+        self._count(positions, 1)
+        for district in touched - {NO_DISTRICT}:
+            self.stats[district] = self._district(district)
+        return sorted(touched - {NO_DISTRICT})
+
+    def assign(self, positions, district):
+        """Move ``positions`` to ``district``; returns the delta for the page."""
+        start = time.perf_counter()
+        positions = positions[self.districts[positions] != district]
+        touched = []
+        if len(positions):
+            self.history.append((positions, self.districts[positions].copy()))
+            touched = self._move(positions, district)
+        return self.delta(touched, len(positions), start)
+
+    def undo(self):
+        """Revert the last edit; returns the delta for the page."""
+        start = time.perf_counter()
+        if not self.history:
+            return self.delta([], 0, start)
+        positions, districts = self.history.pop()
+        return self.delta(self._move(positions, districts), len(positions), start)
+
+    def delta(self, touched, moved, start):
+        return {
+            'moved': moved,
+            'districts': [self.stats[d] for d in touched],
+            'summary': self.summary(),
+            'seconds': time.perf_counter() - start,
+        }
+
+    def state(self):
+        return {'districts': [self.stats[d] for d in self.ids], 'summary': self.summary()}
+
+    def save(self, path):
+        write_plan(path, self.order, self.order.from_layer(self.districts))
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="request body must be JSON")
+
+
+async def page_get(request):
+    return web.Response(text=request.app['page'], content_type='text/html')
+
+
+async def state_get(request):
+    return web.json_response(request.app['editor'].state())
+
+
+async def precincts_get(request):
+    return web.Response(text=request.app['precincts'], content_type='application/json')
+
+
+async def edit_post(request):
+    editor = request.app['editor']
+    body = await _json_body(request)
+    try:
+        lat, lon, district = float(body['lat']), float(body['lon']), int(body['district'])
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(text="expected {'lat': .., 'lon': .., 'district': .., 'unit': 'precinct'|'block'}")
+    unit = body.get('unit', 'precinct')
+    if district not in editor.ids or unit not in UNITS:
+        raise web.HTTPBadRequest(text=f"district must be one of {editor.ids} and unit one of {list(UNITS)}")
+    return web.json_response(editor.assign(editor.select(lat, lon, unit), district))
+
+
+async def undo_post(request):
+    return web.json_response(request.app['editor'].undo())
+
+
+async def save_post(request):
+    path = request.app['save_path']
+    request.app['editor'].save(path)
+    print(f"Saved plan to: {path}")
+    return web.json_response({'path': path})
+
+
+def editor_html(ids, colors, center):
+    """The editor page: Leaflet map, district picker, undo/save and the metrics table."""
+    options = ''.join(f'<option value="{d}">District {d}</option>' for d in ids)
+    return f'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Plan Editor</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+    html, body, #map {{ margin: 0; height: 100%; }}
+    #panel {{ position: fixed; top: 10px; right: 10px; z-index: 1000; background: white; padding: 12px;
+              border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.2); font: 12px Arial, sans-serif; }}
+    #panel table {{ border-collapse: collapse; margin-top: 8px; }}
+    #panel td, #panel th {{ padding: 2px 6px; text-align: right; }}
+    .bad {{ color: #c00; font-weight: bold; }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="panel">
+    <b>Assign to</b> <select id="district">{options}</select>
+    <select id="unit"><option value="precinct">precinct</option><option value="block">block</option></select>
+    <button id="undo">Undo</button> <button id="save">Save</button>
+    <table id="metrics"><tr><th>District</th><th>Population</th><th>Deviation</th><th>Pieces</th></tr></table>
+    <div id="summary"></div>
+    <div id="status" style="color: #666; margin-top: 6px;"></div>
+</div>
+<script>
+var colors = {json.dumps(colors)};
+var map = L.map('map').setView([{center[0]}, {center[1]}], 8);
+L.tileLayer('https://{{s}}.basemaps.cartocdn.com/light_all/{{z}}/{{x}}/{{y}}{{r}}.png', {{
+    attribution: '&copy; OpenStreetMap contributors &copy; CARTO'
+}}).addTo(map);
+var districtLayers = {{}};
+var busy = false;
+
+function fmt(n) {{ return Math.round(n).toLocaleString(); }}
+
+function apply(delta) {{
+    delta.districts.forEach(function(d) {{
+        if (districtLayers[d.district]) map.removeLayer(districtLayers[d.district]);
+        if (d.feature) districtLayers[d.district] = L.geoJSON(d.feature, {{
+            interactive: false,
+            style: {{fillColor: colors[d.district] || '#808080', color: '#000000', weight: 2, fillOpacity: 0.45}}
+        }}).addTo(map);
+        var row = document.getElementById('row-' + d.district);
+        if (!row) {{
+            row = document.getElementById('metrics').insertRow(-1);
+            row.id = 'row-' + d.district;
+        }}
+        row.innerHTML = '<td style="background:' + (colors[d.district] || '#808080') + '">' + d.district + '</td>' +
+            '<td>' + fmt(d.population) + '</td><td>' + (d.deviation >= 0 ? '+' : '') + fmt(d.deviation) +
+            ' (' + d.deviation_pct.toFixed(2) + '%)</td><td' + (d.components > 1 ? ' class="bad"' : '') + '>' +
+            d.components + (d.detached ? ' (' + d.detached + ' detached)' : '') + '</td>';
+    }});
+    var s = delta.summary;
+    document.getElementById('summary').innerHTML =
+        'Total deviation: ' + fmt(s.total_deviation) + ' (' + s.total_deviation_pct.toFixed(2) + '%)<br>' +
+        'Split precincts: ' + s.split_precincts + '<br>' +
+        'Split counties: ' + s.split_counties.length + (s.split_counties.length ? ' (' + s.split_counties.join(', ') + ')' : '') +
+        (s.unassigned_population ? '<br><span class="bad">Unassigned population: ' + fmt(s.unassigned_population) + '</span>' : '');
+    if (delta.moved !== undefined) document.getElementById('status').textContent =
+        delta.moved + ' block(s) moved in ' + Math.round(delta.seconds * 1000) + ' ms; ' + s.edits + ' edit(s)';
+}}
+
+function post(url, body) {{
+    if (busy) return;
+    busy = true;
+    fetch(url, {{method: 'POST', headers: {{'Content-Type': 'application/json'}}, body: JSON.stringify(body || {{}})}})
+        .then(function(r) {{ return r.ok ? r.json() : r.text().then(function(t) {{ throw new Error(t); }}); }})
+        .then(function(data) {{ if (data.path) document.getElementById('status').textContent = 'Saved to ' + data.path; else apply(data); }})
+        .catch(function(e) {{ document.getElementById('status').textContent = e.message; }})
+        .finally(function() {{ busy = false; }});
+}}
+
+fetch('precincts.geojson').then(function(r) {{ return r.json(); }}).then(function(data) {{
+    L.geoJSON(data, {{interactive: false, style: {{color: '#555555', weight: 0.5, fill: false}}}}).addTo(map);
+}});
+fetch('state').then(function(r) {{ return r.json(); }}).then(apply);
+
+map.on('click', function(e) {{
+    post('edit', {{lat: e.latlng.lat, lon: e.latlng.lng,
+                  district: +document.getElementById('district').value,
+                  unit: document.getElementById('unit').value}});
+}});
+document.getElementById('undo').onclick = function() {{ post('undo'); }};
+document.getElementById('save').onclick = function() {{ post('save'); }};
+</script>
+</body>
+</html>
+'''
+
+
+def make_app(editor, precincts, save_path, colors=None, center=None):
+    """The editor service for ``editor``; ``precincts`` is the precinct layer drawn under the districts."""
+    app = web.Application()
+    app['editor'] = editor
+    app['save_path'] = save_path
+    simplified = precincts.assign(geometry=shapely.simplify(precincts.geometry.values, PRECINCT_TOLERANCE))
+    app['precincts'] = to_geojson(simplified, ['GEOID20'])
+    app['page'] = editor_html(
+        editor.ids, colors or create_enhanced_map.district_colors,
+        center or (create_enhanced_map.center_lat, create_enhanced_map.center_lon),
+    )
+    app.router.add_get('/', page_get)
+    app.router.add_get('/state', state_get)
+    app.router.add_get('/precincts.geojson', precincts_get)
+    app.router.add_post('/edit', edit_post)
+    app.router.add_post('/undo', undo_post)
+    app.router.add_post('/save', save_post)
+    return app
+
+
+def run(args):
+    base = create_enhanced_map.load_base_layers()
+    plan = ingest_assignment(args.assignment, base['order']).plan
+    print("Preparing editor...")
+    editor = PlanEditor(base, plan, args.seats)
+    save_path = args.save or os.path.splitext(args.assignment)[0] + '_edited.csv'
+    print(f"Editing {len(editor.ids)} districts; saving to {save_path}")
+    web.run_app(make_app(editor, base['precincts'], save_path), host=args.host, port=args.port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignment', nargs='?', default=create_enhanced_map.ASSIGNMENT_FILE,
+                        help="assignment CSV (GEOID20, District) to start from")
+    parser.add_argument('--save', help="where Save writes the plan (default: <assignment>_edited.csv)")
+    parser.add_argument('--seats', type=int, help="number of districts for the ideal population")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Compactness and contiguity checks of a districting plan.
+
+Compactness (Polsby-Popper, Reock, convex hull ratio) is computed from the
+dissolved district geometries in the Maryland State Plane projection.
+Contiguity needs no geometry at all: the rook adjacency of the census blocks
+(blocks sharing an edge, read off the cached block topology) is stored once as
+a CSR graph, and each plan is a connected-components pass over the edges whose
+two blocks are in the same district.
+
+Blocks without any neighbour (islands) cannot be connected by the graph and
+are ignored by the contiguity check by default.
+
+Contiguity uses scipy.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from assignment_ingest import ingest_assignment
+from block_order import load_block_order
+from layer_cache import CACHE_DIR, blocks_key, load_layer
+from topology import OUTSIDE, load_topology
+
+ADJACENCY_VERSION = 1
+
+# NAD83 / Maryland (metres)
+PROJECTED_EPSG = 26985
+
+
+def build_adjacency(topology, n_blocks):
+    """Symmetric rook adjacency of blocks as CSR (``indptr``, ``indices``) arrays."""
+    sides = topology['sides']
+    inner = sides[(sides[:, 0] != OUTSIDE) & (sides[:, 1] != OUTSIDE) & (sides[:, 0] != sides[:, 1])]
+    pairs = np.unique(np.sort(inner, axis=1), axis=0)
+    src = np.r_[pairs[:, 0], pairs[:, 1]]
+    dst = np.r_[pairs[:, 1], pairs[:, 0]]
+    order = np.lexsort((dst, src))
+    indptr = np.r_[0, np.cumsum(np.bincount(src, minlength=n_blocks))].astype(np.int64)
+    return {'indptr': indptr, 'indices': dst[order].astype(np.int32)}
+
+
+def load_adjacency(blocks, topology=None, cache_dir=CACHE_DIR, name='blocks', refresh=False):
+    """Return the block adjacency CSR of ``blocks``, building and caching it on first use."""
+    path = os.path.join(cache_dir, f'{name}.adjacency.npz')
+    key = blocks_key(blocks)
+    if not refresh and os.path.exists(path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') == ADJACENCY_VERSION and meta.get('blocks') == key:
+                return {k: data[k] for k in ('indptr', 'indices')}
+
+    if topology is None:
+        topology = load_topology(blocks, cache_dir, name)
+    adjacency = build_adjacency(topology, len(blocks))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, meta=json.dumps({'version': ADJACENCY_VERSION, 'blocks': key}), **adjacency)
+    os.replace(tmp, path)
+    return adjacency
+
+
+def contiguity(adjacency, districts, ignore_islands=True):
+    """
+    Connected pieces of every district.
+
+    ``districts`` is the district of every block position (``OUTSIDE`` where
+    unassigned). Returns a DataFrame indexed by District with the number of
+    ``Components`` and the ``Detached`` blocks outside the largest one.
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    indptr, indices = adjacency['indptr'], adjacency['indices']
+    n = len(districts)
+    src = np.repeat(np.arange(n), np.diff(indptr))
+    same = districts[src] == districts[indices]
+    graph = csr_matrix((np.ones(same.sum(), dtype=np.int8), (src[same], indices[same])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+
+    keep = districts != OUTSIDE
+    if ignore_islands:
+        keep &= np.diff(indptr) > 0
+    pieces = pd.DataFrame({'District': districts[keep], 'Component': labels[keep]})
+    sizes = pieces.groupby(['District', 'Component']).size()
+    by_district = sizes.groupby(level='District')
+    return pd.DataFrame({
+        'Components': by_district.size(),
+        'Detached': by_district.sum() - by_district.max(),
+    })
+
+
+def district_contiguity(adjacency, districts, district, ignore_islands=True):
+    """
+    ``contiguity`` of one district, touching only its own blocks and edges.
+
+    Returns (components, detached blocks outside the largest component).
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    indptr, indices = adjacency['indptr'], adjacency['indices']
+    nodes = np.flatnonzero(districts == district)
+    starts = indptr[nodes]
+    degree = indptr[nodes + 1] - starts
+    if ignore_islands:
+        nodes, starts, degree = nodes[degree > 0], starts[degree > 0], degree[degree > 0]
+    if not len(nodes):
+        return 0, 0
+    local = np.full(len(districts), -1, dtype=np.int64)
+    local[nodes] = np.arange(len(nodes))
+    src = np.repeat(np.arange(len(nodes)), degree)
+    dst = local[indices[np.arange(degree.sum()) + np.repeat(starts - np.cumsum(degree) + degree, degree)]]
+    inner = dst >= 0
+    graph = csr_matrix((np.ones(inner.sum(), dtype=np.int8), (src[inner], dst[inner])), shape=(len(nodes), len(nodes)))
+    components, labels = connected_components(graph, directed=False)
+    return components, len(nodes) - np.bincount(labels).max()
+
+
+def compactness(districts_gdf, id_column='District', epsg=PROJECTED_EPSG):
+    """Polsby-Popper, Reock and convex hull ratio of every district, indexed by ``id_column``."""
+    geoms = np.asarray(districts_gdf.to_crs(epsg=epsg).geometry.values, dtype=object)
+    area = shapely.area(geoms)
+    perimeter = shapely.length(geoms)
+    radius = shapely.minimum_bounding_radius(geoms)
+    return pd.DataFrame({
+        'Polsby-Popper': 4 * np.pi * area / perimeter ** 2,
+        'Reock': area / (np.pi * radius ** 2),
+        'Convex hull': area / shapely.area(shapely.convex_hull(geoms)),
+    }, index=pd.Index(districts_gdf[id_column].astype(int).values, name=id_column))
+
+
+def plan_metrics(blocks, plan, order, districts_gdf=None, adjacency=None, ignore_islands=True):
+    """Contiguity, plus compactness when the dissolved ``districts_gdf`` is given, per district."""
+    if adjacency is None:
+        adjacency = load_adjacency(blocks)
+    table = contiguity(adjacency, order.to_layer(plan), ignore_islands)
+    if districts_gdf is not None:
+        table = table.join(compactness(districts_gdf), how='outer')
+    return table
+
+
+def plan_failures(table, max_components=1, min_polsby_popper=None):
+    """Human-readable reasons a plan fails the gates (empty if it passes)."""
+    failures = []
+    for dist, row in table.iterrows():
+        if row['Components'] > max_components:
+            failures.append(f"District {dist} is in {int(row['Components'])} pieces "
+                            f"({int(row['Detached'])} detached blocks)")
+        if min_polsby_popper is not None and row.get('Polsby-Popper', np.inf) < min_polsby_popper:
+            failures.append(f"District {dist} Polsby-Popper {row['Polsby-Popper']:.3f} < {min_polsby_popper}")
+    return failures
+
+
+def print_plan_metrics(table):
+    for dist, row in table.iterrows():
+        line = f"District {dist}: {int(row['Components'])} component(s)"
+        if 'Polsby-Popper' in table.columns:
+            line += (f", Polsby-Popper {row['Polsby-Popper']:.3f}, Reock {row['Reock']:.3f}, "
+                     f"convex hull {row['Convex hull']:.3f}")
+        print(line)
+
+
+def run(args):
+    blocks = load_layer(args.blocks, epsg=4326)
+    order = load_block_order(blocks)
+    plan = ingest_assignment(args.assignment, order).plan
+    districts_gdf = None
+    if args.compactness:
+        from incremental_dissolve import dissolve_districts
+        districts_gdf = dissolve_districts(blocks, plan, order)
+    table = plan_metrics(blocks, plan, order, districts_gdf, ignore_islands=not args.count_islands)
+    print_plan_metrics(table)
+    failures = plan_failures(table, args.max_components, args.min_polsby_popper)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignment', help="assignment CSV (GEOID20, District)")
+    parser.add_argument('--blocks', default="tl_2020_24_tabblock20.shp")
+    parser.add_argument('--compactness', action='store_true', help="also compute compactness (dissolves districts)")
+    parser.add_argument('--max-components', type=int, default=1, help="pieces allowed per district")
+    parser.add_argument('--min-polsby-popper', type=float, help="fail districts below this Polsby-Popper score")
+    parser.add_argument('--count-islands', action='store_true', help="treat blocks with no neighbours as pieces")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Stage timing and memory profiling of the map build.
+
+A ``Profiler`` records wall time and resident memory of named stages, either
+as nested ``with profile.stage('dissolve'):`` blocks or as sequential
+``profile.lap('dissolve')`` calls in straight-line scripts (each lap ends the
+previous one). Per stage it keeps:
+
+- ``seconds`` of wall time
+- ``rss_mb`` at the end and ``rss_delta_mb`` over the stage
+- ``peak_rss_mb``: the stage's own peak on Linux (the kernel high-water mark
+  is reset at every stage start), the process peak so far elsewhere
+- with ``trace=True``, the ``alloc_peak_mb`` of Python allocations and the
+  ``top_allocations`` (source lines) from tracemalloc, which slows the run
+
+The report is written as JSON; run this module on a report to print it and,
+with ``--baseline``, to flag stages that got slower or bigger (exit status 1).
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+PROFILE_VERSION = 1
+MB = 1 << 20
+TOP_ALLOCATIONS = 5
+
+
+def _memory():
+    """Current and peak resident set size in bytes."""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        # ru_maxrss is bytes on macOS and KiB elsewhere; there is no current RSS here
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024
+        return peak, peak
+
+
+def _reset_peak():
+    """Reset the kernel's peak RSS so the next reading is the peak of the new stage (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class Profiler:
+    """Collects per-stage time and memory; see the module docstring."""
+
+    def __init__(self, label='', trace=False):
+        self.label = label
+        self.trace = trace
+        self.stages = []
+        self._stack = []
+        self._open = []
+        self._lap = None
+        self._started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._t0 = time.perf_counter()
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _seen(self, peak, alloc_peak=0):
+        # Resetting the high-water marks for a stage hides them from the enclosing ones
+        for state in self._open:
+            state['peak'] = max(state['peak'], peak)
+            state['alloc_peak'] = max(state['alloc_peak'], alloc_peak)
+
+    def _alloc_peak(self):
+        return tracemalloc.get_traced_memory()[1] if self.trace else 0
+
+    def _begin(self, name):
+        self._seen(_memory()[1], self._alloc_peak())
+        _reset_peak()
+        if self.trace:
+            tracemalloc.reset_peak()
+        self._stack.append(name)
+        rss = _memory()[0]
+        state = {
+            'name': '/'.join(self._stack), 'start': time.perf_counter(), 'rss': rss, 'peak': rss, 'alloc_peak': 0,
+            'snapshot': tracemalloc.take_snapshot() if self.trace else None,
+        }
+        self._open.append(state)
+        return state
+
+    def _end(self, state):
+        seconds = time.perf_counter() - state['start']
+        rss, peak = _memory()
+        self._open.remove(state)
+        self._stack.pop()
+        peak = max(peak, state['peak'])
+        alloc_peak = max(self._alloc_peak(), state['alloc_peak'])
+        self._seen(peak, alloc_peak)
+        record = {
+            'name': state['name'],
+            'seconds': round(seconds, 4),
+            'rss_mb': round(rss / MB, 1),
+            'peak_rss_mb': round(peak / MB, 1),
+            'rss_delta_mb': round((rss - state['rss']) / MB, 1),
+        }
+        if state['snapshot'] is not None:
+            record['alloc_peak_mb'] = round(alloc_peak / MB, 1)
+            top = tracemalloc.take_snapshot().compare_to(state['snapshot'], 'lineno')[:TOP_ALLOCATIONS]
+            record['top_allocations'] = [
+                {'where': f'{s.traceback[0].filename}:{s.traceback[0].lineno}', 'size_mb': round(s.size_diff / MB, 2)}
+                for s in top
+            ]
+        self.stages.append(record)
+        return record
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Profile the enclosed block as stage ``name`` (nested stages are named ``outer/inner``)."""
+        state = self._begin(name)
+        try:
+            yield
+        finally:
+            self._end(state)
+
+    def lap(self, name=None):
+        """End the current lap, if any, and start a new one called ``name`` (``None`` just ends it)."""
+        if self._lap is not None:
+            self._end(self._lap)
+            self._lap = None
+        if name is not None:
+            self._lap = self._begin(name)
+
+    def report(self):
+        """The run as a JSON-serialisable dict."""
+        self.lap()
+        return {
+            'version': PROFILE_VERSION,
+            'label': self.label,
+            'started': self._started,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'total_seconds': round(time.perf_counter() - self._t0, 4),
+            'peak_rss_mb': round(max([s['peak_rss_mb'] for s in self.stages] + [_memory()[1] / MB]), 1),
+            'stages': self.stages,
+        }
+
+    def write(self, path):
+        """Write the report to ``path`` and return it."""
+        report = self.report()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(path + '.tmp', path)
+        return report
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def stage_totals(report):
+    """Seconds and peak RSS per stage name, summing repeated stages."""
+    totals = {}
+    for stage in report['stages']:
+        seconds, peak = totals.get(stage['name'], (0.0, 0.0))
+        totals[stage['name']] = (seconds + stage['seconds'], max(peak, stage['peak_rss_mb']))
+    return totals
+
+
+def compare_reports(report, baseline, tolerance=0.25, min_seconds=0.5, min_mb=50):
+    """
+    Regressions of ``report`` against ``baseline``: stages more than
+    ``tolerance`` (a fraction) slower and at least ``min_seconds`` slower, or
+    with a peak RSS that grew by that fraction and at least ``min_mb``.
+    """
+    regressions = []
+    current, before = stage_totals(report), stage_totals(baseline)
+    for name, (seconds, peak) in current.items():
+        if name not in before:
+            continue
+        old_seconds, old_peak = before[name]
+        if seconds > old_seconds * (1 + tolerance) and seconds - old_seconds >= min_seconds:
+            regressions.append(f"{name}: {old_seconds:.2f}s -> {seconds:.2f}s")
+        if peak > old_peak * (1 + tolerance) and peak - old_peak >= min_mb:
+            regressions.append(f"{name}: peak RSS {old_peak:,.0f} MB -> {peak:,.0f} MB")
+    return regressions
+
+
+def print_report(report, baseline=None):
+    """Print the stages of a report, with the baseline's seconds when given."""
+    before = stage_totals(baseline) if baseline else {}
+    width = max([len(s['name']) for s in report['stages']] + [5])
+    for name, (seconds, peak) in stage_totals(report).items():
+        line = f"  {name:<{width}} {seconds:8.2f}s {peak:8,.0f} MB"
+        if name in before:
+            line += f"  (baseline {before[name][0]:.2f}s, {seconds - before[name][0]:+.2f}s)"
+        print(line)
+    print(f"  {'total':<{width}} {report['total_seconds']:8.2f}s {report['peak_rss_mb']:8,.0f} MB peak")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('report', help="profile JSON written by a run")
+    parser.add_argument('--baseline', help="profile JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown/growth as a fraction")
+    parser.add_argument('--min-seconds', type=float, default=0.5, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+    report = load_report(args.report)
+    baseline = load_report(args.baseline) if args.baseline else None
+    print_report(report, baseline)
+    if baseline is None:
+        return 0
+    regressions = compare_reports(report, baseline, args.tolerance, args.min_seconds)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for the redistricting tools.
+
+    python redistrict.py <command> [options]
+
+Each command is the ``main`` of one module, imported only when that command
+runs: ``lookup`` against a built block index loads NumPy, pyarrow and shapely
+but not geopandas, folium or the shapefiles, so it starts in under a second,
+while ``build`` pays for the whole map pipeline. Every module also still runs
+as a script of its own. ``python redistrict.py <command> -h`` lists the options
+of a command; input and output locations default to settings.py.
+"""
+import importlib
+import os
+import sys
+
+# command: (module, summary)
+COMMANDS = {
+    'build': ('create_enhanced_map', "render the map of a plan"),
+    'build-simple': ('create_map', "render the basic district map"),
+    'batch': ('batch_render', "render many plans in parallel"),
+    'watch': ('watch_map', "re-render and live-reload maps when assignment files change"),
+    'edit': ('plan_editor', "interactive plan editor"),
+    'lookup': ('block_index', "district and block of points, from the block index"),
+    'geocode': ('geocode_batch', "bulk address-to-district job"),
+    'serve': ('lookup_service', "district lookup HTTP service"),
+    'stats': ('tabulation', "population by district from PL 94-171 data"),
+    'partisan': ('partisan', "partisan metrics of plans"),
+    'metrics': ('plan_metrics', "compactness and contiguity checks"),
+    'diff': ('plan_diff', "blocks and population moved between two plans"),
+    'ingest': ('assignment_ingest', "validate an assignment file"),
+    'ensemble': ('ensemble', "ReCom ensembles for outlier analysis"),
+    'benchmark': ('benchmark', "benchmark the pipeline on synthetic grids"),
+    'profile': ('profiler', "print or compare a build profile"),
+}
+
+
+def usage():
+    width = max(len(name) for name in COMMANDS)
+    lines = [f"usage: {os.path.basename(sys.argv[0])} <command> [options]", "", "commands:"]
+    lines += [f"  {name:<{width}}  {summary}" for name, (_, summary) in COMMANDS.items()]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        print(f"\nunknown command: {command}", file=sys.stderr)
+        return 2
+    # Show the command in the usage and error messages of its parser
+    sys.argv[0] = f"{os.path.basename(sys.argv[0])} {command}"
+    module = importlib.import_module(COMMANDS[command][0])
+    return module.main(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
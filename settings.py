@@ -0,0 +1,28 @@
+"""
+Default input and output locations.
+
+The census layers are read from the working directory; the plan, PL 94-171
+data, election returns and current map default to the files on the Desktop.
+``REDISTRICTING_DATA`` points at another directory holding the same file names
+and ``REDISTRICTING_OUTPUT`` moves the map output, so the tools can run from
+cron jobs and services without editing the scripts.
+"""
+import os
+
+DATA_DIR = os.environ.get('REDISTRICTING_DATA', "/Users/davidkunes/Desktop")
+OUTPUT_DIR = os.environ.get('REDISTRICTING_OUTPUT', os.path.join(DATA_DIR, "redistricting_map"))
+
+BLOCKS_FILE = "tl_2020_24_tabblock20.shp"
+PRECINCTS_FILE = "tl_2020_24_vtd20.shp"
+COUNTIES_FILE = "tl_2020_24_county20.shp"
+
+# The plan rendered by default: GEOID20, District CSV or Census block assignment file
+ASSIGNMENT_FILE = os.path.join(DATA_DIR, "DKunes_Submission.csv")
+# PL 94-171 block data: a CSV/Parquet extract with GEOID20 and P00xxxxx columns, or the
+# Census legacy format directory (md geo file plus segments 1 and 2)
+PL_FILE = os.path.join(DATA_DIR, "md2020.pl")
+# Precinct election returns (VTD GEOID20, DEM and REP vote columns) for partisan metrics
+RETURNS_FILE = os.path.join(DATA_DIR, "md_precinct_returns.csv")
+# The current (2022) map as a Census block assignment file or plan CSV; maps then show the
+# blocks each plan moves as a "changes" layer
+CURRENT_PLAN_FILE = os.path.join(DATA_DIR, "BlockAssign_ST24_MD_CD.txt")
@@ -0,0 +1,201 @@
+"""
+Population and demographic tabulation of a plan from PL 94-171 block data.
+
+Block-level redistricting data is read from either a CSV/Parquet extract with a
+GEOID20 column and PL table columns (``P0010001``, ...), or the Census legacy
+format directory (``<st>geo2020.pl`` plus segments 1 and 2). The extracted
+block table is cached as Parquet and aligned once to the canonical block order
+(block_order.py), so a plan revision is tabulated with one bincount per column
+over the plan array.
+"""
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from assignment_ingest import ingest_assignment
+from block_order import NO_DISTRICT, load_block_order
+from layer_cache import CACHE_DIR, load_layer, source_stat
+from settings import ASSIGNMENT_FILE, BLOCKS_FILE, PL_FILE
+
+TABULATION_VERSION = 1
+
+# PL 94-171 table cells kept, with their report names
+PL_COLUMNS = {
+    'P0010001': 'Population',
+    'P0020002': 'Hispanic',
+    'P0020005': 'White',
+    'P0020006': 'Black',
+    'P0020007': 'AIAN',
+    'P0020008': 'Asian',
+    'P0020009': 'NHPI',
+    'P0020010': 'Other',
+    'P0020011': 'Multiracial',
+    'P0030001': 'VAP',
+    'P0040002': 'Hispanic VAP',
+    'P0040005': 'White VAP',
+    'P0040006': 'Black VAP',
+    'P0040008': 'Asian VAP',
+}
+
+BLOCK_SUMLEV = '750'
+
+# Legacy format: 5 identification fields, then the table cells of each segment
+LEGACY_HEADER = ['FILEID', 'STUSAB', 'CHARITER', 'CIFSN', 'LOGRECNO']
+LEGACY_SEGMENTS = {
+    1: [('P001', 71), ('P002', 73)],
+    2: [('P003', 71), ('P004', 73), ('H001', 3)],
+}
+GEO_LOGRECNO, GEO_SUMLEV, GEO_GEOCODE = 7, 2, 9
+
+
+def _segment_columns(segment):
+    columns = list(LEGACY_HEADER)
+    for table, cells in LEGACY_SEGMENTS[segment]:
+        columns += [f'{table[0]}{int(table[1:]):03d}{i:04d}' for i in range(1, cells + 1)]
+    return columns
+
+
+def _read_legacy(directory):
+    """Block rows of a PL 94-171 legacy format directory."""
+    geo_path = glob.glob(os.path.join(directory, '*geo2020.pl'))[0]
+    geo = pd.read_csv(geo_path, sep='|', header=None, dtype=str, encoding='latin-1',
+                      usecols=[GEO_SUMLEV, GEO_LOGRECNO, GEO_GEOCODE])
+    geo.columns = ['SUMLEV', 'LOGRECNO', 'GEOID20']
+    geo = geo[geo['SUMLEV'] == BLOCK_SUMLEV][['LOGRECNO', 'GEOID20']]
+
+    table = geo
+    for segment in LEGACY_SEGMENTS:
+        path = glob.glob(os.path.join(directory, f'*0000{segment}2020.pl'))[0]
+        columns = _segment_columns(segment)
+        wanted = ['LOGRECNO'] + [c for c in PL_COLUMNS if c in columns]
+        part = pd.read_csv(path, sep='|', header=None, names=columns, usecols=wanted,
+                           dtype={'LOGRECNO': str}, encoding='latin-1')
+        table = table.merge(part, on='LOGRECNO', how='left')
+    return table.drop(columns='LOGRECNO')
+
+
+def _read_extract(path):
+    """Block rows of a CSV or Parquet extract keyed by GEOID20 (or GEOCODE)."""
+    if path.lower().endswith('.parquet'):
+        table = pd.read_parquet(path)
+    else:
+        table = pd.read_csv(path, dtype={'GEOID20': str, 'GEOCODE': str, 'SUMLEV': str}, low_memory=False)
+    if 'GEOID20' not in table.columns:
+        table = table.rename(columns={'GEOCODE': 'GEOID20'})
+    if 'SUMLEV' in table.columns:
+        table = table[table['SUMLEV'].str.zfill(3) == BLOCK_SUMLEV]
+    return table[['GEOID20'] + [c for c in PL_COLUMNS if c in table.columns]]
+
+
+def load_pl_blocks(path, cache_dir=CACHE_DIR, refresh=False):
+    """
+    Block-level PL 94-171 counts, one row per GEOID20 with columns named as in
+    ``PL_COLUMNS`` values. Cached after the first read of ``path``.
+    """
+    stamp = [[entry.name, entry.stat().st_size, entry.stat().st_mtime_ns] for entry in os.scandir(path)] \
+        if os.path.isdir(path) else source_stat(path)
+    base = os.path.join(cache_dir, os.path.basename(os.path.normpath(path)) + '.pl')
+    key = {'version': TABULATION_VERSION, 'source': os.path.abspath(path), 'stat': stamp}
+    if not refresh:
+        try:
+            with open(base + '.json') as f:
+                if json.load(f) == key:
+                    return pd.read_parquet(base + '.parquet')
+        except (OSError, ValueError):
+            pass
+
+    table = _read_legacy(path) if os.path.isdir(path) else _read_extract(path)
+    table = table.rename(columns=PL_COLUMNS)
+    counts = [c for c in PL_COLUMNS.values() if c in table.columns]
+    table[counts] = table[counts].fillna(0).astype(np.int64)
+    table = table.drop_duplicates('GEOID20', keep='last').reset_index(drop=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(base + '.json'):
+        os.remove(base + '.json')
+    table.to_parquet(base + '.parquet.tmp', index=False)
+    os.replace(base + '.parquet.tmp', base + '.parquet')
+    with open(base + '.json.tmp', 'w') as f:
+        json.dump(key, f)
+    os.replace(base + '.json.tmp', base + '.json')
+    return table
+
+
+def block_counts(pl_blocks, order):
+    """PL counts of every block in the canonical ``order`` (zero for blocks missing from ``pl_blocks``)."""
+    return order.align(pl_blocks)
+
+
+def tabulate(counts, plan, districts=None):
+    """
+    Aggregate block counts by district.
+
+    ``counts`` is the ``block_counts`` table of the block order of ``plan``.
+    Returns a DataFrame indexed by District with every count column, the
+    deviation from the ideal (equal) population and shares of the population
+    and VAP groups. ``districts`` is the number of seats (defaults to the number
+    of districts in ``plan``). Population in blocks without an assignment is
+    reported in ``attrs['unassigned']``.
+    """
+    columns = [c for c in PL_COLUMNS.values() if c in counts.columns]
+    assigned = plan != NO_DISTRICT
+    ids, codes = np.unique(plan[assigned], return_inverse=True)
+
+    table = pd.DataFrame({'Blocks': np.bincount(codes, minlength=len(ids))}, index=pd.Index(ids.astype(int), name='District'))
+    for column in columns:
+        table[column] = np.bincount(codes, weights=counts[column].values[assigned], minlength=len(ids)).astype(np.int64)
+
+    seats = districts or len(table)
+    population = counts['Population'].values
+    ideal = population.sum() / seats
+    table['Deviation'] = table['Population'] - ideal
+    table['Deviation %'] = table['Deviation'] / ideal * 100
+    for column in columns:
+        if column in ('Population', 'VAP'):
+            continue
+        total = 'VAP' if column.endswith('VAP') else 'Population'
+        if total in table.columns:
+            table[f'{column} %'] = table[column] / table[total].where(table[total] > 0) * 100
+
+    table.attrs['ideal'] = ideal
+    table.attrs['unassigned'] = int(population[~assigned].sum())
+    return table
+
+
+def print_tabulation(table):
+    """Print the equal-population report of a ``tabulate`` result."""
+    print(f"Ideal population: {table.attrs['ideal']:,.1f}")
+    for dist, row in table.iterrows():
+        print(f"District {dist}: {int(row['Population']):,} ({row['Deviation']:+,.0f}, {row['Deviation %']:+.3f}%)")
+    spread = table['Deviation'].max() - table['Deviation'].min()
+    print(f"Total deviation: {spread:,.0f} ({spread / table.attrs['ideal'] * 100:.3f}%)")
+    if table.attrs['unassigned']:
+        print(f"Warning: population in unassigned blocks: {table.attrs['unassigned']:,}")
+
+
+def run(args):
+    order = load_block_order(load_layer(args.blocks, epsg=4326))
+    plan = ingest_assignment(args.assignment, order).plan
+    table = tabulate(block_counts(load_pl_blocks(args.pl), order), plan, args.seats)
+    print_tabulation(table)
+    if args.output:
+        table.to_csv(args.output)
+        print(f"Tabulation saved to: {args.output}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignment', nargs='?', default=ASSIGNMENT_FILE, help="assignment CSV (GEOID20, District)")
+    parser.add_argument('--pl', default=PL_FILE, help="PL 94-171 extract or legacy format directory")
+    parser.add_argument('--blocks', default=BLOCKS_FILE)
+    parser.add_argument('--seats', type=int, help="number of districts for the ideal population")
+    parser.add_argument('-o', '--output', help="CSV of the full table by district")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
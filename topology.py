@@ -0,0 +1,237 @@
+"""
+Shared-arc topology of the census block layer.
+
+TIGER/Line blocks are topologically clean: neighbouring blocks share the same
+vertices along their common edge. The topology (every distinct edge and the
+block on either side of it) is built once per block layer and cached.
+
+District boundaries are then derived without any polygon union: edges whose two
+sides are in different districts are chained into arcs (TopoJSON-style), each
+arc is simplified exactly once, and every district is assembled from the arcs
+that carry its label. Neighbouring districts therefore share the same simplified
+line, so the output has no gaps or slivers.
+"""
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from layer_cache import CACHE_DIR, blocks_key
+
+TOPOLOGY_VERSION = 1
+
+# Vertices closer than this (in layer units, ~1 cm in degrees) are the same node
+QUANTUM = 1e-7
+
+OUTSIDE = -1
+
+
+def build_topology(blocks, quantum=QUANTUM):
+    """
+    Extract the edge topology of ``blocks``.
+
+    Returns a dict of arrays: ``coords`` (unique vertices), ``edges`` (pairs of
+    vertex ids) and ``sides`` (block position on either side of each edge,
+    ``OUTSIDE`` for the outer boundary of the layer).
+    """
+    parts, part_block = shapely.get_parts(blocks.geometry.values, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    # Pack quantized x/y into one int64 key so vertex matching is a 1-D unique
+    origin = coords.min(axis=0)
+    q = np.round((coords - origin) / quantum).astype(np.int64)
+    if q.max(initial=0) >= 1 << 31:
+        raise ValueError("Layer extent too large for the topology quantum; increase `quantum`")
+    keys = (q[:, 0] << 31) | q[:, 1]
+    vertex_keys, first, vertex_id = np.unique(keys, return_index=True, return_inverse=True)
+
+    same_ring = coord_ring[:-1] == coord_ring[1:]
+    a, b = vertex_id[:-1][same_ring], vertex_id[1:][same_ring]
+    owner = part_block[ring_part[coord_ring[:-1][same_ring]]]
+    proper = a != b
+    a, b, owner = a[proper], b[proper], owner[proper]
+
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    edge_key = lo.astype(np.int64) * len(vertex_keys) + hi
+    order = np.argsort(edge_key, kind='stable')
+    edge_key, owner = edge_key[order], owner[order]
+    starts = np.flatnonzero(np.r_[True, edge_key[1:] != edge_key[:-1]])
+    counts = np.diff(np.r_[starts, len(edge_key)])
+
+    left = owner[starts]
+    right = np.where(counts > 1, owner[np.minimum(starts + 1, len(owner) - 1)], OUTSIDE)
+
+    edges = np.column_stack([edge_key[starts] // len(vertex_keys), edge_key[starts] % len(vertex_keys)])
+    return {
+        'coords': coords[first],
+        'edges': edges.astype(np.int32),
+        'sides': np.column_stack([left, right]).astype(np.int32),
+    }
+
+
+def load_topology(blocks, cache_dir=CACHE_DIR, name='blocks', refresh=False):
+    """Return the topology of ``blocks``, building and caching it on first use."""
+    path = os.path.join(cache_dir, f'{name}.topology.npz')
+    key = blocks_key(blocks)
+    if not refresh and os.path.exists(path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') == TOPOLOGY_VERSION and meta.get('blocks') == key:
+                return {k: data[k] for k in ('coords', 'edges', 'sides')}
+
+    topology = build_topology(blocks)
+    os.makedirs(cache_dir, exist_ok=True)
+    meta = json.dumps({'version': TOPOLOGY_VERSION, 'blocks': key})
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, meta=meta, **topology)
+    os.replace(tmp, path)
+    return topology
+
+
+def _chain_arcs(edges, labels, n_vertices):
+    """Chain edges into maximal arcs whose interior vertices have degree 2."""
+    u, v = edges[:, 0], edges[:, 1]
+    degree = np.bincount(np.r_[u, v], minlength=n_vertices)
+
+    # CSR of incident edges per vertex
+    ends = np.r_[u, v]
+    incident = np.r_[np.arange(len(edges)), np.arange(len(edges))]
+    order = np.argsort(ends, kind='stable')
+    indptr = np.r_[0, np.cumsum(np.bincount(ends, minlength=n_vertices))]
+    incident = incident[order]
+
+    # A degree-2 vertex is still a node when the district pair changes across it
+    is_node = degree != 2
+    two = np.flatnonzero(degree == 2)
+    first_edge, second_edge = incident[indptr[two]], incident[indptr[two] + 1]
+    is_node[two[labels[first_edge] != labels[second_edge]]] = True
+
+    nodes = np.flatnonzero(is_node).tolist()
+    u, v, labels = u.tolist(), v.tolist(), labels.tolist()
+    indptr, incident, is_node = indptr.tolist(), incident.tolist(), is_node.tolist()
+    visited = [False] * len(u)
+    arcs, arc_labels = [], []
+
+    def walk(start, edge):
+        path = [start]
+        vertex = start
+        while True:
+            visited[edge] = True
+            vertex = v[edge] if u[edge] == vertex else u[edge]
+            path.append(vertex)
+            if is_node[vertex] or vertex == start:
+                return path
+            e0, e1 = incident[indptr[vertex]], incident[indptr[vertex] + 1]
+            edge = e1 if e0 == edge else e0
+            if visited[edge]:
+                return path
+
+    for vertex in nodes:
+        for k in range(indptr[vertex], indptr[vertex + 1]):
+            edge = incident[k]
+            if not visited[edge]:
+                arcs.append(walk(vertex, edge))
+                arc_labels.append(labels[edge])
+
+    # Whatever is left forms closed rings without any node (islands, enclaves)
+    for edge in range(len(u)):
+        if not visited[edge]:
+            arcs.append(walk(u[edge], edge))
+            arc_labels.append(labels[edge])
+    return arcs, arc_labels
+
+
+def simplify_arcs(lines, tolerance):
+    """
+    Simplify boundary arcs as one collection: each arc is simplified once, its
+    endpoints (nodes) never move and the arcs are kept from crossing each other.
+    """
+    return shapely.get_parts(shapely.simplify(shapely.multilinestrings(lines), tolerance, preserve_topology=True))
+
+
+def boundary_arcs(topology, districts, tolerance=0.001):
+    """
+    Simplified district boundary arcs.
+
+    ``districts`` gives the district of every block position. Returns the
+    simplified LineStrings (exact with ``tolerance`` 0) and the (lower, upper)
+    district pair of each arc.
+    """
+    edges, sides = topology['edges'], topology['sides']
+    left = districts[sides[:, 0]]
+    right = np.where(sides[:, 1] == OUTSIDE, OUTSIDE, districts[sides[:, 1]])
+    keep = left != right
+    pair_lo = np.minimum(left[keep], right[keep]).astype(np.int64)
+    pair_hi = np.maximum(left[keep], right[keep]).astype(np.int64)
+    labels = (pair_lo + 1) * (1 << 16) + (pair_hi + 1)
+
+    arcs, arc_labels = _chain_arcs(edges[keep], labels, len(topology['coords']))
+    if not arcs:
+        return np.array([], dtype=object), np.empty((0, 2), dtype=np.int64)
+    lengths = np.fromiter((len(arc) for arc in arcs), dtype=np.int64, count=len(arcs))
+    vertex_ids = np.fromiter((i for arc in arcs for i in arc), dtype=np.int64, count=lengths.sum())
+    lines = shapely.linestrings(
+        topology['coords'][vertex_ids], indices=np.repeat(np.arange(len(arcs)), lengths)
+    )
+    if tolerance:
+        lines = simplify_arcs(lines, tolerance)
+    arc_labels = np.asarray(arc_labels, dtype=np.int64)
+    pairs = np.column_stack([arc_labels // (1 << 16) - 1, arc_labels % (1 << 16) - 1])
+    return lines, pairs
+
+
+def district_boundaries(topology, blocks, districts, tolerance=0.001):
+    """
+    Build simplified, gap-free district polygons from the block topology.
+
+    ``districts`` is the district of every block position of ``blocks``
+    (``OUTSIDE`` where unassigned; ``BlockOrder.to_layer`` of a plan). Returns
+    a GeoDataFrame with District and geometry columns, one row per district,
+    in the CRS of ``blocks``; the block geometries themselves are not used.
+    """
+    lines, pairs = boundary_arcs(topology, districts, tolerance)
+    return arc_polygons(lines, pairs, blocks.crs)
+
+
+def arc_polygons(lines, pairs, crs=None):
+    """
+    District polygons from ``boundary_arcs`` output, as a GeoDataFrame with
+    District and geometry columns.
+
+    Every arc knows the two districts it separates, so each district is
+    assembled from its own arcs by even-odd nesting (enclaves become holes).
+    The arcs do not cross, and neighbours are built from the same lines.
+    """
+    rows = []
+    for dist in np.unique(pairs[pairs != OUTSIDE]):
+        own = (pairs == dist).any(axis=1)
+        rows.append((int(dist), shapely.build_area(shapely.multilinestrings(lines[own]))))
+    return gpd.GeoDataFrame(
+        {'District': [r[0] for r in rows]}, geometry=[r[1] for r in rows], crs=crs
+    )
+
+
+def district_outline(topology, districts, district, tolerance=0.001):
+    """
+    Simplified polygon of one district, built without touching the others.
+
+    The edges with ``district`` on exactly one side are merged into rings and
+    assembled by even-odd nesting, so enclaves become holes. Unlike
+    ``district_boundaries`` the simplified outline is not shared with the
+    neighbouring districts. Returns None if the district has no blocks.
+    """
+    edges, sides = topology['edges'], topology['sides']
+    inside = districts == district
+    left = inside[sides[:, 0]]
+    right = np.where(sides[:, 1] == OUTSIDE, False, inside[sides[:, 1]])
+    boundary = edges[left != right]
+    if not len(boundary):
+        return None
+    segments = shapely.linestrings(
+        topology['coords'][boundary.ravel()], indices=np.repeat(np.arange(len(boundary)), 2)
+    )
+    area = shapely.build_area(shapely.line_merge(shapely.multilinestrings(segments)))
+    return shapely.simplify(area, tolerance, preserve_topology=True)
@@ -0,0 +1,145 @@
+"""
+Vector tile export for the map layers.
+
+Instead of inlining every polygon as GeoJSON in the page, each layer is cut into
+a z/x/y directory of Mapbox Vector Tiles (``<layer>/{z}/{x}/{y}.pbf``) with a
+separate simplification per zoom level, and the page loads them with Leaflet.VectorGrid.
+Initial load is then proportional to the viewport instead of the whole state.
+
+Requires the optional ``mapbox-vector-tile`` package for encoding.
+"""
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import shapely
+from branca.element import MacroElement
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template
+
+# Half the width of the Web Mercator world in metres
+WORLD_HALF = 20037508.342789244
+EXTENT = 4096
+
+# name: layer name inside the tiles; frame: GeoDataFrame; properties: columns to keep
+TileSource = namedtuple('TileSource', ['name', 'frame', 'properties', 'minzoom', 'maxzoom'])
+
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (minx, miny, maxx, maxy) of tile z/x/y."""
+    size = 2 * WORLD_HALF / (1 << z)
+    return (-WORLD_HALF + x * size, WORLD_HALF - (y + 1) * size,
+            -WORLD_HALF + (x + 1) * size, WORLD_HALF - y * size)
+
+
+def tile_range(bounds, z):
+    """Inclusive (x0, y0, x1, y1) range of tiles at zoom ``z`` covering Mercator ``bounds``."""
+    size = 2 * WORLD_HALF / (1 << z)
+    last = (1 << z) - 1
+    x0 = int(np.clip((bounds[0] + WORLD_HALF) // size, 0, last))
+    x1 = int(np.clip((bounds[2] + WORLD_HALF) // size, 0, last))
+    y0 = int(np.clip((WORLD_HALF - bounds[3]) // size, 0, last))
+    y1 = int(np.clip((WORLD_HALF - bounds[1]) // size, 0, last))
+    return x0, y0, x1, y1
+
+
+def export_tiles(sources, out_dir, pixel_tolerance=0.5, buffer=8):
+    """
+    Write every ``TileSource`` as vector tiles under ``out_dir/<name>/``.
+
+    Each source gets its own tile set so a map layer only fetches its own
+    features. Geometries are simplified once per zoom to ``pixel_tolerance``
+    screen pixels (256 px tiles) and clipped to each tile plus ``buffer``
+    pixels. Returns {name: {zoom: tiles written}}.
+    """
+    import mapbox_vector_tile
+
+    written = {}
+    for source in sources:
+        frame = source.frame.to_crs(epsg=3857)
+        geoms = np.asarray(frame.geometry.values, dtype=object)
+        properties = [
+            {k: (v.item() if hasattr(v, 'item') else v) for k, v in row.items() if pd.notna(v)}
+            for row in frame[source.properties].to_dict('records')
+        ]
+        layer_dir = os.path.join(out_dir, source.name)
+        written[source.name] = {}
+        for z in range(source.minzoom, source.maxzoom + 1):
+            size = 2 * WORLD_HALF / (1 << z)
+            pad = size * buffer / 256
+            simplified = shapely.simplify(geoms, size / 256 * pixel_tolerance, preserve_topology=True)
+            tree = shapely.STRtree(simplified)
+            x0, y0, x1, y1 = tile_range(shapely.total_bounds(simplified), z)
+            count = 0
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+                    hits = tree.query(shapely.box(minx - pad, miny - pad, maxx + pad, maxy + pad))
+                    if len(hits) == 0:
+                        continue
+                    clipped = shapely.clip_by_rect(simplified[hits], minx - pad, miny - pad, maxx + pad, maxy + pad)
+                    features = [
+                        {'geometry': geom, 'properties': properties[i]}
+                        for i, geom in zip(hits, clipped) if not geom.is_empty
+                    ]
+                    if not features:
+                        continue
+                    data = mapbox_vector_tile.encode(
+                        [{'name': source.name, 'features': features}],
+                        default_options={'quantize_bounds': (minx, miny, maxx, maxy), 'extents': EXTENT},
+                    )
+                    path = os.path.join(layer_dir, str(z), str(x))
+                    os.makedirs(path, exist_ok=True)
+                    with open(os.path.join(path, f'{y}.pbf'), 'wb') as f:
+                        f.write(data)
+                    count += 1
+            written[source.name][z] = count
+
+        with open(os.path.join(layer_dir, 'metadata.json'), 'w') as f:
+            json.dump({
+                'tilejson': '3.0.0', 'tiles': ['{z}/{x}/{y}.pbf'],
+                'minzoom': source.minzoom, 'maxzoom': source.maxzoom,
+                'bounds': [float(v) for v in source.frame.to_crs(epsg=4326).total_bounds],
+                'vector_layers': [{'id': source.name, 'fields': {p: 'String' for p in source.properties}}],
+            }, f, indent=1)
+    return written
+
+
+def tile_layer(base_url, layer, style_js, name, max_native_zoom, show=True):
+    """
+    Leaflet.VectorGrid layer for the tile set of ``layer`` under ``base_url``.
+
+    ``style_js`` is a JavaScript function ``(properties, zoom) -> path style``.
+    """
+    url = f'{base_url}/{layer}/{{z}}/{{x}}/{{y}}.pbf'
+    options = (
+        '{"rendererFactory": L.canvas.tile, "interactive": true, '
+        f'"maxNativeZoom": {int(max_native_zoom)}, '
+        f'"vectorTileLayerStyles": {{{json.dumps(layer)}: {style_js}}}}}'
+    )
+    return VectorGridProtobuf(url, name=name, options=options, show=show)
+
+
+class TilePopup(MacroElement):
+    """Show selected feature properties in a popup when a vector tile feature is clicked."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}.on('click', function(e) {
+                var props = e.layer.properties || {};
+                var rows = {{ this.fields|tojson }}.map(function(field, i) {
+                    return '<b>' + {{ this.aliases|tojson }}[i] + '</b> ' + (props[field] === undefined ? '' : props[field]);
+                });
+                L.popup().setLatLng(e.latlng).setContent(rows.join('<br>'))
+                    .openOn({{ this._parent._parent.get_name() }});
+            });
+        {% endmacro %}
+    """)
+
+    def __init__(self, fields, aliases):
+        super().__init__()
+        self._name = 'TilePopup'
+        self.fields = list(fields)
+        self.aliases = list(aliases)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Watch assignment files and re-render their maps on every save.
+
+The base layers and everything derived from them (block order, topology,
+crosswalk, adjacency, point index, PL and election data, the encoded precinct
+and county layers) are loaded once. The assignment files are then polled, and
+when one changes, and its content differs from the last rendered version, only
+the plan stages run again: ingest, the district boundaries from the block
+topology, precinct shares, metrics and the page (the district GeoJSON/TopoJSON
+exports, which the page does not read, are skipped). Each rebuild prints its
+time from the save to the reload event. Outputs are replaced atomically,
+and a failed render (e.g. a half-written file) keeps the previous output.
+
+The output directory is served over HTTP together with a server-sent events
+stream; pages rendered in watch mode listen on it and reload themselves after
+every rebuild. Changes to the base layers need a restart.
+"""
+import argparse
+import contextlib
+import hashlib
+import http.server
+import io
+import os
+import threading
+import time
+import traceback
+
+import create_enhanced_map
+
+EVENTS_PATH = '/__events'
+POLL_INTERVAL = 0.25  # seconds between checks; a change must also be stable for this long
+KEEPALIVE = 15  # seconds between keep-alive comments on idle event streams
+
+
+class ReloadNotifier:
+    """Version counter that event stream handlers block on until the next rebuild."""
+
+    def __init__(self):
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def notify(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version, timeout):
+        """Return the current version once it differs from ``version``, or after ``timeout`` seconds."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+def serve(directory, notifier, host, port):
+    """Serve ``directory`` and the reload event stream from a background thread."""
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+
+        def end_headers(self):
+            self.send_header('Cache-Control', 'no-cache')
+            super().end_headers()
+
+        def do_GET(self):
+            if self.path != EVENTS_PATH:
+                return super().do_GET()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            version = notifier.version
+            try:
+                while True:
+                    current = notifier.wait(version, KEEPALIVE)
+                    self.wfile.write(b'data: reload\n\n' if current != version else b': keepalive\n\n')
+                    self.wfile.flush()
+                    version = current
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def render(base, path, output_dir, plan_name, quiet):
+    """Render one plan; returns the seconds taken, or None if rendering failed."""
+    start = time.perf_counter()
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log) if quiet else contextlib.nullcontext():
+            create_enhanced_map.render_plan(
+                base, path, output_dir, plan_name=plan_name, live_reload=EVENTS_PATH, write_boundaries=False
+            )
+    except Exception:
+        print(log.getvalue(), end='')
+        traceback.print_exc()
+        return None
+    return time.perf_counter() - start
+
+
+def watch(base, plans, output_dir, notifier, interval=POLL_INTERVAL, quiet=False):
+    """Poll ``plans`` (path -> plan name) forever, re-rendering the ones whose content changed."""
+    seen, rendered = {}, {}
+    while True:
+        for path, plan_name in plans.items():
+            stamp = _stamp(path)
+            if stamp is None or stamp == seen.get(path):
+                continue
+            # Let the editor finish writing; a file still changing is picked up on the next poll
+            time.sleep(interval)
+            if _stamp(path) != stamp:
+                continue
+            seen[path] = stamp
+            digest = _digest(path)
+            if digest == rendered.get(path):
+                continue
+            print(f"{time.strftime('%H:%M:%S')} {os.path.basename(path)} changed, rebuilding {plan_name}...")
+            seconds = render(base, path, output_dir, plan_name, quiet)
+            if seconds is None:
+                print("Rebuild failed; keeping the previous output")
+                continue
+            edited = path in rendered
+            rendered[path] = digest
+            notifier.notify()
+            print(f"{time.strftime('%H:%M:%S')} {plan_name} rebuilt in {seconds:.2f}s")
+            if edited:
+                # Save to reload: the file's modification time to the reload event, polling included
+                print(f"  reload sent {time.time() - stamp[0] / 1e9:.2f}s after the save")
+        time.sleep(interval)
+
+
+def run(args):
+    os.makedirs(args.output, exist_ok=True)
+    plans = {
+        path: 'DKunes' if path == create_enhanced_map.ASSIGNMENT_FILE else os.path.splitext(os.path.basename(path))[0]
+        for path in args.assignments or [create_enhanced_map.ASSIGNMENT_FILE]
+    }
+    base = create_enhanced_map.load_base_layers()
+
+    notifier = ReloadNotifier()
+    if not args.no_serve:
+        serve(args.output, notifier, args.host, args.port)
+        for plan_name in plans.values():
+            print(f"Serving http://{args.host}:{args.port}/{plan_name}_Redistricting_Map.html")
+    print(f"Watching {len(plans)} assignment file(s); Ctrl+C to stop")
+    try:
+        watch(base, plans, args.output, notifier, args.interval, args.quiet)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('assignments', nargs='*', help="assignment CSVs to watch (default: the map script's plan)")
+    parser.add_argument('-o', '--output', default=create_enhanced_map.OUTPUT_DIR, help="output directory")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--no-serve', action='store_true', help="only rebuild; do not serve the pages")
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="seconds between file checks")
+    parser.add_argument('-q', '--quiet', action='store_true', help="hide the per-build report")
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()